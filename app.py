@@ -1,17 +1,31 @@
 # app.py
 import streamlit as st
-import psycopg
-import pandas as pd
 from dotenv import load_dotenv
 import os
-from styles import load_styles
-from sidebar import render_sidebar
-from state import init_session_state, summarize_df
+import time
 
+# Before any project import: modules read their settings from the
+# environment into constants at import time
 load_dotenv()
-from llm import generate_sql, explain_result
+from styles import load_styles
+from sidebar import render_sidebar
+from state import init_session_state, IncrementalSummary
+from llm import generate_sql_stream, clean_sql, explain_result_stream_async
+from result_cache import cached_query
+from db import FrameResult
+from refine import refine_locally
+from replica import get_replica
+from jobs import current_session_id, get_scheduler, iter_result
+from funnel import match_funnel_question, run_funnel, describe_funnel
+from approx import approximate_query
+from plan_guard import PlanRejected, check_plan
+from query_log import log_query
+from templates import get_template_registry, render_sql
+from tracing import record, span
+from cancellation import LLM_DEADLINE, TURN_DEADLINE, CancelToken, DeadlineExceeded
 
-DB_URL = os.getenv("DB_URL")
+# Render results before the explanation is ready (set EXPLAIN_PIPELINED=0 to wait)
+PIPELINED_EXPLAIN = os.getenv("EXPLAIN_PIPELINED", "1") != "0"
 
 st.set_page_config(
     page_title="Netcore Journey AI",
@@ -47,6 +61,34 @@ with chat_col:
         with st.chat_message(msg["role"]):
             st.markdown(msg["content"])
 
+def stream_sql(reply_slot, token, feedback=None):
+    """Stream generated SQL into the chat bubble and return the cleaned query."""
+    with span("generate_sql", retry=bool(feedback)) as stage:
+        streamed = ""
+        stage_token = token.child(LLM_DEADLINE, "SQL generation")
+        try:
+            for piece in generate_sql_stream(feedback=feedback, token=stage_token):
+                if not streamed:
+                    stage.set(first_token_ms=round(stage.duration_ms, 1))
+                streamed += piece
+                reply_slot.code(streamed + "▌", language="sql")
+        finally:
+            stage_token.close()
+        sql = clean_sql(streamed)
+        reply_slot.code(sql, language="sql")
+        stage.set(response_chars=len(streamed))
+    return sql
+
+def show_queue_status(handle, status_slot):
+    """Shown while a scheduled query hasn't produced its first chunk yet."""
+    stats = handle.scheduler.stats()
+    if handle.state == "queued":
+        status_slot.caption(f"⏳ Queued behind {stats['running']} running queries…")
+    elif handle.shared:
+        status_slot.caption("🔗 Same query already running for another user, sharing its result…")
+    else:
+        status_slot.caption("⏳ Running query…")
+
 # ---------- INPUT ----------
 user_input = st.chat_input(
     "Ask about journeys, triggers, splits, channels, conversions..."
@@ -60,56 +102,294 @@ if user_input:
     with chat_col:
         with st.chat_message("user"):
             st.markdown(user_input)
+        with st.chat_message("assistant"):
+            reply_slot = st.empty()
 
     with result_col:
-        with st.spinner("🤖 Thinking and querying..."):
+        with span("turn", question=user_input[:200]) as turn:
+            st.session_state.last_trace = turn.trace_id
+            # A new question supersedes whatever this session was still waiting on
+            scheduler = get_scheduler()
+            session_id = current_session_id()
+            if st.session_state.turn_token is not None:
+                st.session_state.turn_token.cancel("superseded by a new question")
+            scheduler.cancel_session(session_id)
+            # Every stage of this turn hangs off one token: the deadline or a
+            # newer question cancels the Gemini calls and the Postgres query
+            token = CancelToken(TURN_DEADLINE, "turn")
+            token.on_cancel(lambda: scheduler.cancel_session(session_id))
+            st.session_state.turn_token = token
             try:
-                sql_query = generate_sql()
+                funnel_route = match_funnel_question(
+                    user_input, approximate=st.session_state.approximate
+                )
+                approximation = None
+                executed_sql = None
+                refined = None
+                on_replica = False
+                plan = None
 
-                if not sql_query.lower().startswith("select"):
-                    st.error("Only SELECT queries allowed")
-                    st.stop()
+                if funnel_route:
+                    # ---------- FUNNEL ENGINE (no LLM round trip) ----------
+                    sql_query = describe_funnel(*funnel_route)
+                    reply_slot.markdown(f"📈 Answered by the funnel engine\n\n`{sql_query}`")
+                    result = scheduler.submit(
+                        session_id, ("funnel", *funnel_route), lambda: run_funnel(*funnel_route)
+                    )
+                    cache_hit = False
+                else:
+                    with st.spinner("🤖 Thinking and querying..."):
+                        # Same question shape as an earlier one, only the ids changed
+                        templates = get_template_registry()
+                        learned = templates.match_question(user_input)
 
-                with st.expander("🔍 View Generated SQL"):
-                    st.code(sql_query, language="sql")
+                        # ---------- STREAM SQL INTO THE CHAT ----------
+                        # A query the planner rejects gets one narrowing retry
+                        feedback = None
+                        for attempt in range(2):
+                            if learned and not attempt:
+                                template, params = learned
+                                prepared = True
+                                sql_query = render_sql(template, params)
+                                reply_slot.code(sql_query, language="sql")
+                            else:
+                                sql_query = stream_sql(reply_slot, token, feedback)
 
-                with psycopg.connect(DB_URL) as conn:
-                    df = pd.read_sql(sql_query, conn)
+                                if not sql_query.lower().startswith("select"):
+                                    st.error("Only SELECT queries allowed")
+                                    st.stop()
 
-                summary = summarize_df(df)
+                                # Only a question asked without earlier turns in the prompt is
+                                # safe to replay in other sessions from its text alone
+                                standalone = not st.session_state.query_history and not st.session_state.last_sql
+                                template, params, prepared = templates.observe(
+                                    user_input, sql_query, learn=standalone
+                                )
 
-                # ---------- GENERATE EXPLANATION ----------
-                explanation = explain_result(
-                    user_question=user_input,
-                    sql=sql_query,
-                    result_summary=summary
-                )
+                            # ---------- LOCAL REFINEMENT ----------
+                            # A filter/sort/subset of the previous result needs no database
+                            if st.session_state.last_df is not None:
+                                with span("refine_local") as stage:
+                                    refined = refine_locally(
+                                        sql_query, st.session_state.last_sql, st.session_state.last_df
+                                    )
+                                    stage.set(applied=refined is not None)
+                                if refined is not None:
+                                    break
 
-                # Add the full query entry (with explanation) at once
-                st.session_state.query_history.append({
-                    "sql": sql_query,
-                    "summary": summary,
-                    "explanation": explanation
-                })
+                            # Known shapes run as prepared statements with bound ids
+                            run_sql = template if prepared else sql_query
+                            bound = params if prepared else None
+
+                            # ---------- LOCAL REPLICA ----------
+                            # Reads of replicated tables run on DuckDB, off the primary
+                            with span("replica_route") as stage:
+                                on_replica = get_replica().can_serve(sql_query)
+                                stage.set(applied=on_replica)
+                            if on_replica:
+                                break
+
+                            approximation = (
+                                approximate_query(run_sql)
+                                if st.session_state.approximate else None
+                            )
+
+                            # ---------- PLAN GUARD ----------
+                            token.raise_if_cancelled()
+                            try:
+                                with span("plan_guard", attempt=attempt) as stage:
+                                    plan = check_plan(
+                                        approximation.sql if approximation else run_sql,
+                                        params=bound,
+                                    )
+                                    stage.set(est_cost=plan.cost, est_rows=plan.rows)
+                                break
+                            except PlanRejected as e:
+                                if attempt:
+                                    raise
+                                learned = None
+                                st.warning(f"{e}. Asking for a narrower query...")
+                                feedback = (
+                                    f"The previous query was rejected before running: {e}. "
+                                    "Rewrite it to be cheaper: filter on aid and/or a ts range, "
+                                    "aggregate instead of returning raw rows, or use the rollup "
+                                    "table where it applies."
+                                )
+
+                        if refined is not None:
+                            executed_sql = sql_query
+                            with st.expander("🔍 View Generated SQL"):
+                                st.caption("⚡ Applied to the previous result in memory (no database query)")
+                                st.code(sql_query, language="sql")
+                            result, cache_hit = FrameResult(refined), False
+                        elif on_replica:
+                            executed_sql = sql_query
+                            with st.expander("🔍 View Generated SQL"):
+                                if learned:
+                                    st.caption("⚡ Reused a learned template (no LLM call)")
+                                st.code(sql_query, language="sql")
+                                st.caption(get_replica().describe())
+                            if st.session_state.approximate:
+                                st.caption("Approximate mode skipped: the local replica answers exactly")
+                            result, cache_hit = cached_query(
+                                sql_query, session_id=session_id, replica=True
+                            )
+                        else:
+                            executed_sql = render_sql(plan.sql, bound) if bound else plan.sql
+
+                            with st.expander("🔍 View Generated SQL"):
+                                if learned:
+                                    st.caption("⚡ Reused a learned template (no LLM call)")
+                                st.code(sql_query, language="sql")
+                                if executed_sql != sql_query:
+                                    st.caption(
+                                        "Executed as (approximate mode):" if approximation
+                                        else "Executed as:"
+                                    )
+                                    st.code(executed_sql, language="sql")
+                                if bound:
+                                    st.caption(f"Prepared statement, params {list(bound)}")
+                                st.caption(plan.describe())
 
-                st.session_state.last_sql = sql_query
-                st.session_state.last_result_summary = summary
+                            result, cache_hit = cached_query(
+                                plan.sql, params=bound, prepare=bool(bound), session_id=session_id
+                            )
+
+                if cache_hit:
+                    st.caption("⚡ Served from result cache")
 
                 tab1, tab2 = st.tabs(["📊 Results", "ℹ️ Summary"])
 
                 with tab1:
-                    st.dataframe(df, use_container_width=True)
+                    if approximation:
+                        st.info(approximation.label())
+                    table_slot = st.empty()
+                    status_slot = st.empty()
+
+                # ---------- FETCH IN CHUNKS ----------
+                # First page is rendered as soon as it arrives; the rest streams in
+                progress = IncrementalSummary()
+                stage_ms = {"fetch": 0.0, "summarize": 0.0, "render": 0.0}
+                fetch_started = tick = time.perf_counter()
+                with st.spinner("📥 Fetching rows..."):
+                    def on_wait(handle):
+                        token.raise_if_cancelled()
+                        show_queue_status(handle, status_slot)
+
+                    for chunk in iter_result(result, on_wait=on_wait):
+                        t0 = time.perf_counter()
+                        stage_ms["fetch"] += (t0 - tick) * 1000
+                        if approximation:
+                            chunk = approximation.scale(chunk)
+                        if progress.row_count == 0:
+                            table_slot.dataframe(chunk, use_container_width=True)
+                        t1 = time.perf_counter()
+                        progress.update(chunk)
+                        t2 = time.perf_counter()
+                        status_slot.caption(f"Loaded {progress.row_count:,} rows…")
+                        tick = time.perf_counter()
+                        stage_ms["render"] += (t1 - t0 + tick - t2) * 1000
+                        stage_ms["summarize"] += (t2 - t1) * 1000
+
+                df = result.frame()
+                if approximation:
+                    df = approximation.scale(df)
+                # A result that fills the plan guard's injected LIMIT is cut off too,
+                # though the fetch itself stopped at the end of the rows
+                truncated = result.truncated or (plan is not None and plan.capped(len(df)))
+                engine = getattr(result, "engine", None)
+                if engine == "replica":
+                    st.caption("🦆 Computed on the local replica")
+                if not funnel_route and not cache_hit and refined is None and engine != "replica":
+                    # Feeds the offline index advisor (index_advisor.py)
+                    log_query(
+                        sql_query,
+                        executed_sql,
+                        elapsed_ms=(time.perf_counter() - fetch_started) * 1000,
+                        rows=len(df),
+                    )
+                summary = progress.result()
+                t0 = time.perf_counter()
+                table_slot.dataframe(df, use_container_width=True)
+                stage_ms["render"] += (time.perf_counter() - t0) * 1000
+                record(
+                    "fetch", stage_ms["fetch"], rows=len(df),
+                    bytes=getattr(result, "bytes", 0), cache_hit=cache_hit,
+                    shared=getattr(result, "shared", False),
+                    truncated=truncated, engine=engine,
+                )
+                record("summarize", stage_ms["summarize"])
+                record("render", stage_ms["render"])
+                if truncated:
+                    status_slot.warning(
+                        f"Showing the first {len(df):,} rows — the result hit the row/size "
+                        "limit. Add filters or aggregate to see the rest."
+                    )
+                else:
+                    status_slot.empty()
+
+                # ---------- GENERATE EXPLANATION ----------
+                # Runs in the background; tokens are streamed into the Summary tab
+                explanation_tokens = explain_result_stream_async(
+                    user_question=user_input,
+                    sql=executed_sql or sql_query,
+                    result_summary=summary,
+                    token=token,
+                )
+                if not PIPELINED_EXPLAIN:
+                    explanation_tokens = iter(list(explanation_tokens))
+
+                if not funnel_route:
+                    st.session_state.last_sql = sql_query
+                    st.session_state.last_result_summary = summary
+                    # Kept for local refinements; only a complete, exact result qualifies
+                    exact = not approximation and not truncated
+                    st.session_state.last_df = df if exact else None
 
                 with tab2:
                     st.markdown(f"**Result Summary:**\n\nRows returned: {summary['row_count']}")
-                    st.markdown(f"**Explanation:**\n\n{explanation}")
-
+                    explanation_slot = st.empty()
+                    explanation_slot.info("✍️ Generating explanation...")
 
                 assistant_reply = f"✅ **Query Successful**\n\nRows returned: **{len(df)}**"
+                reply_slot.markdown(assistant_reply)
+
+                try:
+                    with span("explain_result") as stage:
+                        explanation = ""
+                        for piece in explanation_tokens:
+                            if not explanation:
+                                stage.set(first_token_ms=round(stage.duration_ms, 1))
+                            explanation += piece
+                            explanation_slot.markdown(f"**Explanation:**\n\n{explanation}▌")
+                        explanation = explanation.strip()
+                        explanation_slot.markdown(f"**Explanation:**\n\n{explanation}")
+                        stage.set(response_chars=len(explanation))
+                except Exception as e:
+                    explanation = None
+                    explanation_slot.warning(f"Explanation unavailable: {e}")
+
+                # Add the full query entry (with explanation) at once
+                st.session_state.query_history.append({
+                    "sql": sql_query,
+                    "summary": summary,
+                    "explanation": explanation
+                })
 
             except Exception as e:
-                st.error("Query execution failed")
+                if token.cancelled:
+                    # Report why (deadline, newer question) rather than the
+                    # Postgres/job error the cancel surfaced as
+                    e = token.error()
+                turn.error = f"{type(e).__name__}: {e}"
+                st.error(
+                    "Query timed out" if isinstance(e, DeadlineExceeded)
+                    else "Query execution failed"
+                )
                 assistant_reply = f"❌ Error: {e}"
+                reply_slot.markdown(assistant_reply)
+            finally:
+                token.close()
 
     st.session_state.messages.append(
         {"role": "assistant", "content": assistant_reply}
@@ -0,0 +1,136 @@
+# approx.py
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# Percentage of journey_xray blocks read in approximate mode
+SAMPLE_PERCENT = float(os.getenv("APPROX_SAMPLE_PERCENT", 1))
+# Fixed seed so repeated questions see the same sample (and hit the result cache)
+SAMPLE_SEED = int(os.getenv("APPROX_SAMPLE_SEED", 42))
+
+_Z95 = 1.96
+
+_XRAY_RE = re.compile(
+    r"\b(from|join)\s+journey_xray\b(\s+(?:as\s+)?(?!where\b|group\b|order\b|limit\b|join\b|"
+    r"left\b|right\b|inner\b|full\b|cross\b|natural\b|on\b|using\b|having\b|union\b|"
+    r"window\b|offset\b|fetch\b|tablesample\b)[a-z_][a-z0-9_]*)?",
+    re.I,
+)
+# Not linear in the sample: distinct counts (a user with many events is
+# almost always sampled), and HAVING thresholds applied to sampled values
+_EXACT_ONLY_RE = re.compile(r"\(\s*distinct\b|\bhaving\b", re.I)
+_AGG_RE = re.compile(r"^\s*(count|sum)\s*\((.*)\)\s*(?:as\s+)?(\"[^\"]+\"|[a-z_][a-z0-9_]*)?\s*$", re.I | re.S)
+
+
+def _split_top_level(text, sep=","):
+    """Split on `sep` outside parentheses and quotes."""
+    parts, depth, quote, start = [], 0, None, 0
+    for i, ch in enumerate(text):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == sep and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _select_list(sql):
+    """Text between the leading SELECT and its top-level FROM."""
+    depth, quote = 0, None
+    lower = sql.lower()
+    for i, ch in enumerate(sql):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif depth == 0 and lower.startswith("from", i) and not lower[i - 1:i].isalnum():
+            head = sql[:i].strip()
+            return re.sub(r"^select\s+(distinct\s+)?", "", head, flags=re.I)
+    return None
+
+
+class Approximation:
+    """A sampled rewrite of a query plus how to scale its result back up."""
+
+    def __init__(self, sql, fraction, scaled, width):
+        self.sql = sql
+        self.fraction = fraction
+        self.width = width  # number of select-list items
+        # position -> "count" | "sum"
+        self.scaled = scaled
+
+    def scale(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Scale sampled aggregates to full-table estimates. Counts get a 95%
+        confidence interval from the binomial variance of the sample count
+        (block sampling is clumpier than that, so treat it as a lower bound).
+        """
+        if df.shape[1] != self.width:
+            return df
+        df = df.copy()
+        f = self.fraction
+        for pos, kind in sorted(self.scaled.items(), reverse=True):
+            name = df.columns[pos]
+            sampled = pd.to_numeric(df.iloc[:, pos], errors="coerce").astype("float64")
+            estimate = sampled / f
+            df.isetitem(pos, estimate.round().astype("Int64") if kind != "sum" else estimate)
+            if kind != "sum":
+                margin = _Z95 * np.sqrt(sampled.clip(lower=0) * (1 - f)) / f
+                df.insert(pos + 1, f"{name}_ci_low", (estimate - margin).clip(lower=0).round().astype("Int64"))
+                df.insert(pos + 2, f"{name}_ci_high", (estimate + margin).round().astype("Int64"))
+        df.attrs["approximate"] = True
+        return df
+
+    def label(self):
+        notes = [f"≈ Approximate result from a {self.fraction * 100:g}% block sample of journey_xray."]
+        if any(kind != "sum" for kind in self.scaled.values()):
+            notes.append("Counts are scaled estimates with 95% confidence intervals (_ci_low/_ci_high).")
+        notes.append("Small groups may be missing entirely.")
+        return " ".join(notes)
+
+
+def approximate_query(sql, percent=SAMPLE_PERCENT, seed=SAMPLE_SEED):
+    """
+    Rewrite an aggregate SELECT over journey_xray to read a TABLESAMPLE
+    SYSTEM sample. Returns an Approximation, or None when the query can't
+    be safely estimated (no COUNT/SUM outputs, journey_xray read more than
+    once, a * in the select list, a DISTINCT aggregate or a HAVING clause).
+    """
+    matches = list(_XRAY_RE.finditer(sql))
+    if len(matches) != 1 or _EXACT_ONLY_RE.search(sql):
+        return None
+
+    select_list = _select_list(sql)
+    if select_list is None:
+        return None
+
+    items = _split_top_level(select_list)
+    scaled = {}
+    for pos, item in enumerate(items):
+        if re.search(r"(^|[\s,.])\*\s*$", item) or item.strip() == "*":
+            return None
+        agg = _AGG_RE.match(item)
+        if agg:
+            func = agg.group(1).lower()
+            scaled[pos] = "sum" if func == "sum" else "count"
+    if not scaled:
+        return None
+
+    m = matches[0]
+    sampled = f"{m.group(0)} TABLESAMPLE SYSTEM ({percent:g}) REPEATABLE ({seed})"
+    return Approximation(sql[:m.start()] + sampled + sql[m.end():], percent / 100, scaled, len(items))
@@ -0,0 +1,130 @@
+# benchmarks/columnar_fetch.py
+"""
+Compare the object-frame result path (pd.read_sql / DataFrame.from_records)
+with the columnar decoder in columnar.py.
+
+    python benchmarks/columnar_fetch.py --synthetic --rows 200000
+    python benchmarks/columnar_fetch.py --sql "SELECT * FROM journey_xray LIMIT 200000"
+
+--synthetic needs no database; it decodes generated journey_xray-shaped rows.
+Otherwise DB_URL is read from the environment / .env.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from columnar import decode_rows
+
+Column = namedtuple("Column", "name type_code")
+
+JOURNEY_XRAY_COLUMNS = [
+    Column("aid", 20),
+    Column("channel", 25),
+    Column("cid", 20),
+    Column("glreqid", 25),
+    Column("nid", 20),
+    Column("ts", 1114),
+    Column("uid", 20),
+]
+
+CHANNELS = ["email", "sms", "push", "whatsapp", "web", "inapp"]
+
+
+def synthetic_rows(n, seed=7):
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    return [
+        (
+            rng.randint(1, 500),
+            rng.choice(CHANNELS),
+            rng.randint(1, 50),
+            f"{rng.getrandbits(64):016x}",
+            rng.randint(1, 40),
+            start + timedelta(seconds=rng.randint(0, 86400 * 90)),
+            rng.randint(1, 5_000_000),
+        )
+        for _ in range(n)
+    ]
+
+
+def _arrow_ms(df):
+    """Time to serialize to Arrow, which is what st.dataframe does before rendering."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return None
+    start = time.perf_counter()
+    pa.Table.from_pandas(df, preserve_index=False)
+    return (time.perf_counter() - start) * 1000
+
+
+def measure(label, fn, rows):
+    start = time.perf_counter()
+    df = fn()
+    elapsed = time.perf_counter() - start
+    nbytes = int(df.memory_usage(deep=True).sum())
+    arrow_ms = _arrow_ms(df)
+    print(
+        f"{label:<28} {elapsed * 1000:>10.1f} ms  "
+        f"{nbytes / 1024 / 1024:>8.1f} MB  {nbytes / max(rows, 1):>7.1f} B/row"
+        + (f"  render(arrow) {arrow_ms:>7.1f} ms" if arrow_ms is not None else "")
+    )
+    return df
+
+
+def run_synthetic(n):
+    rows = synthetic_rows(n)
+    names = [c.name for c in JOURNEY_XRAY_COLUMNS]
+    print(f"Decoding {n:,} synthetic journey_xray rows\n")
+    measure("object frame (from_records)", lambda: pd.DataFrame.from_records(rows, columns=names), n)
+    measure("columnar (decode_rows)", lambda: decode_rows(rows, JOURNEY_XRAY_COLUMNS)[0], n)
+
+
+def run_database(sql):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    from db import ChunkedResult, connection
+
+    print(f"Fetching: {sql}\n")
+
+    def read_sql():
+        with connection() as conn:
+            return pd.read_sql(sql, conn)
+
+    def chunked(columnar):
+        result = ChunkedResult(sql, max_rows=10**9, max_bytes=2**62, columnar=columnar)
+        for _ in result:
+            pass
+        return result.frame()
+
+    rows = len(read_sql())  # warm-up: opens the pool, primes the server cache
+    print(f"{rows:,} rows\n")
+    measure("pd.read_sql (current)", read_sql, rows)
+    measure("chunked object frame", lambda: chunked(False), rows)
+    measure("chunked columnar (binary)", lambda: chunked(True), rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--synthetic", action="store_true", help="decode generated rows, no database")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--sql", default="SELECT * FROM journey_xray LIMIT 200000")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        run_synthetic(args.rows)
+    else:
+        run_database(args.sql)
+
+
+if __name__ == "__main__":
+    main()
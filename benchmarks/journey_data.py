@@ -0,0 +1,319 @@
+# benchmarks/journey_data.py
+"""
+Synthetic journey data for load testing.
+
+    python benchmarks/journey_data.py --dsn postgresql://localhost/journeys_bench --create --events 20000000
+    python benchmarks/journey_data.py --to parquet --out data/ --journeys 500 --nodes 80 --branching 3
+    python benchmarks/journey_data.py --to csv --out data/ --drop-off 0.3 --channel-mix email=5,sms=1,push=2
+
+papi_automation rows get connected DAG-shaped nodedatarray / linkdatarray
+graphs (one trigger, actions, splits, waits, exits; up to --branching
+successors per node). journey_xray events are produced by users walking
+those graphs: each step emits an event at the current node, then the user
+drops off with --drop-off probability or moves to a random successor after
+an exponential wait. Action and split nodes are assigned a channel from
+--channel-mix; journey popularity is skewed (weight ~ 1/sqrt(rank)).
+
+Walks are simulated with numpy in batches of users and written batch by
+batch (COPY into Postgres, or Parquet row groups / CSV appends), so memory
+stays flat however many events are generated.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+EVENT_COLUMNS = ["aid", "channel", "cid", "glreqid", "nid", "ts", "uid"]
+JOURNEY_COLUMNS = [
+    "id", "name", "created_date", "from_date", "to_date", "updated_date",
+    "journey_xray_enabled", "lp_content_parsed", "linkdatarray", "nodedatarray",
+]
+DEFAULT_CHANNEL_MIX = {"email": 0.35, "sms": 0.2, "push": 0.2, "whatsapp": 0.15, "web": 0.05, "inapp": 0.05}
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS papi_automation (
+    id bigint PRIMARY KEY,
+    name text,
+    created_date timestamp without time zone,
+    from_date timestamp without time zone,
+    to_date timestamp without time zone,
+    updated_date timestamp without time zone,
+    journey_xray_enabled bigint,
+    lp_content_parsed jsonb,
+    linkdatarray jsonb,
+    nodedatarray jsonb
+);
+CREATE TABLE IF NOT EXISTS journey_xray (
+    aid bigint,
+    channel text,
+    cid bigint,
+    glreqid text,
+    nid bigint,
+    ts timestamp without time zone,
+    uid bigint
+);
+"""
+
+
+class Journey:
+    """One generated journey: its graph in CSR form plus per-node channel and campaign."""
+
+    def __init__(self, aid, node_ids, categories, channels, cids, edges):
+        self.aid = aid
+        self.node_ids = node_ids
+        self.categories = categories
+        self.channels = channels
+        self.cids = cids
+        self.edges = edges
+        src = np.array([a for a, _ in edges], dtype=np.int64)
+        dst = np.array([b for _, b in edges], dtype=np.int64)
+        order = np.argsort(src, kind="stable")
+        self.offsets = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(node_ids)), out=self.offsets[1:])
+        self.targets = dst[order]
+
+    def row(self, start, end):
+        """papi_automation row (JSON columns as text)."""
+        nodes = [
+            {"key": int(nid), "text": f"{cat.title()} {i + 1}", "category": cat,
+             **({"channel": ch} if ch else {})}
+            for i, (nid, cat, ch) in enumerate(zip(self.node_ids, self.categories, self.channels))
+        ]
+        links = [{"from": int(self.node_ids[a]), "to": int(self.node_ids[b])} for a, b in self.edges]
+        return (
+            self.aid, f"Journey {self.aid}", start, start, end, end - timedelta(days=self.aid % 30),
+            int(self.aid % 4 != 0), "{}", json.dumps(links), json.dumps(nodes),
+        )
+
+
+def make_journey(aid, rng, nodes, branching, channel_mix):
+    """A connected DAG: node i > 0 hangs off an earlier node, plus extra forward links."""
+    edges = set()
+    for i in range(1, nodes):
+        edges.add((int(rng.integers(max(0, i - branching), i)), i))
+    for i in range(nodes - 1):
+        for _ in range(int(rng.integers(0, branching))):
+            edges.add((i, int(rng.integers(i + 1, nodes))))
+
+    outdeg = np.bincount([a for a, _ in edges], minlength=nodes)
+    categories = []
+    for i in range(nodes):
+        if i == 0:
+            categories.append("trigger")
+        elif outdeg[i] == 0:
+            categories.append("exit")
+        elif outdeg[i] > 1:
+            categories.append("split")
+        else:
+            categories.append("action" if rng.random() < 0.75 else "wait")
+
+    names, weights = zip(*channel_mix.items())
+    weights = np.asarray(weights, dtype=float) / sum(weights)
+    channels = [
+        str(rng.choice(names, p=weights)) if cat in ("action", "split") else None
+        for cat in categories
+    ]
+    node_ids = np.arange(nodes, dtype=np.int64) + aid * 10_000 + 1
+    cids = np.where(
+        [c is not None for c in channels], aid * 100 + rng.integers(1, 100, nodes), 0
+    )
+    return Journey(aid, node_ids, categories, channels, cids, sorted(edges))
+
+
+def walk(journey, uids, rng, drop_off, start, span_seconds, mean_wait_seconds):
+    """
+    Events for a batch of users walking the journey from the trigger, as a
+    DataFrame. Users enter uniformly over the span; walks stop at its end.
+    """
+    n = len(uids)
+    current = np.zeros(n, dtype=np.int64)
+    clock = rng.random(n) * span_seconds
+    alive = np.ones(n, dtype=bool)
+    channels = np.array([c or "" for c in journey.channels], dtype=object)
+
+    steps_uid, steps_ts, steps_node = [], [], []
+    while alive.any():
+        idx = np.flatnonzero(alive)
+        node = current[idx]
+        steps_node.append(node)
+        steps_uid.append(uids[idx])
+        steps_ts.append(clock[idx])
+
+        outdeg = journey.offsets[node + 1] - journey.offsets[node]
+        moves = (outdeg > 0) & (rng.random(len(idx)) >= drop_off)
+        alive[idx[~moves]] = False
+        moving = idx[moves]
+        pick = journey.offsets[node[moves]] + (rng.random(len(moving)) * outdeg[moves]).astype(np.int64)
+        current[moving] = journey.targets[pick]
+        clock[moving] += rng.exponential(mean_wait_seconds, len(moving))
+        alive[moving[clock[moving] > span_seconds]] = False
+
+    node = np.concatenate(steps_node)
+    total = len(node)
+    glreqid = np.frombuffer(rng.bytes(8 * total).hex().encode(), dtype="S16").astype(str)
+    return pd.DataFrame({
+        "aid": np.full(total, journey.aid, dtype=np.int64),
+        "channel": channels[node],
+        "cid": journey.cids[node],
+        "glreqid": glreqid,
+        "nid": journey.node_ids[node],
+        "ts": np.datetime64(start, "us") + (np.concatenate(steps_ts) * 1e6).astype("timedelta64[us]"),
+        "uid": np.concatenate(steps_uid),
+    })
+
+
+def generate(events, journeys=100, nodes=30, branching=2, drop_off=0.15, channel_mix=None,
+             users=1_000_000, days=90, mean_wait_hours=6, batch_users=20_000, seed=7):
+    """
+    (journey rows, iterator of event DataFrames). Each batch spreads
+    batch_users users over all journeys by popularity, until `events`
+    events were produced.
+    """
+    rng = np.random.default_rng(seed)
+    channel_mix = channel_mix or DEFAULT_CHANNEL_MIX
+    end = datetime.now().replace(microsecond=0)
+    start = end - timedelta(days=days)
+    graphs = [make_journey(aid, rng, nodes, branching, channel_mix) for aid in range(1, journeys + 1)]
+    rows = [g.row(start, end) for g in graphs]
+
+    popularity = 1 / np.sqrt(rng.permutation(journeys) + 1)
+    per_journey = np.maximum(1, np.round(batch_users * popularity / popularity.sum())).astype(int)
+
+    def batches():
+        produced = 0
+        while produced < events:
+            batch = pd.concat(
+                [
+                    walk(
+                        graph, rng.integers(1, users + 1, n, dtype=np.int64), rng, drop_off,
+                        start, days * 86400, mean_wait_hours * 3600,
+                    )
+                    for graph, n in zip(graphs, per_journey)
+                ],
+                ignore_index=True,
+            )
+            batch = batch.iloc[: events - produced]
+            produced += len(batch)
+            yield batch
+
+    return rows, batches()
+
+
+# ---------- SINKS ----------
+def load_postgres(dsn, rows, batches, create=False, replace=False):
+    """COPY journeys and event batches into Postgres. Returns events loaded."""
+    import psycopg
+
+    loaded = 0
+    with psycopg.connect(dsn) as conn:
+        if replace:
+            conn.execute("DROP TABLE IF EXISTS journey_xray; DROP TABLE IF EXISTS papi_automation")
+        if create or replace:
+            conn.execute(SCHEMA_SQL)
+        with conn.cursor() as cur:
+            with cur.copy(f"COPY papi_automation ({', '.join(JOURNEY_COLUMNS)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+            with cur.copy(f"COPY journey_xray ({', '.join(EVENT_COLUMNS)}) FROM STDIN (FORMAT csv)") as copy:
+                for batch in batches:
+                    copy.write(batch.to_csv(header=False, index=False))
+                    loaded += len(batch)
+                    _progress(loaded)
+        conn.commit()
+    return loaded
+
+
+def write_files(out, fmt, rows, batches):
+    """Stream journeys and events to out/ as Parquet (one row group per batch) or CSV."""
+    os.makedirs(out, exist_ok=True)
+    journeys = pd.DataFrame(rows, columns=JOURNEY_COLUMNS)
+    events_path = os.path.join(out, f"journey_xray.{fmt}")
+    loaded = 0
+
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        journeys.to_parquet(os.path.join(out, "papi_automation.parquet"), index=False)
+        writer = None
+        try:
+            for batch in batches:
+                table = pa.Table.from_pandas(batch, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(events_path, table.schema)
+                writer.write_table(table)
+                loaded += len(batch)
+                _progress(loaded)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        journeys.to_csv(os.path.join(out, "papi_automation.csv"), index=False)
+        with open(events_path, "w", encoding="utf-8", newline="") as f:
+            f.write(",".join(EVENT_COLUMNS) + "\n")
+            for batch in batches:
+                batch.to_csv(f, header=False, index=False)
+                loaded += len(batch)
+                _progress(loaded)
+    return loaded
+
+
+def _progress(loaded):
+    print(f"\r  {loaded:,} events", end="", file=sys.stderr, flush=True)
+
+
+def _parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--to", choices=["postgres", "parquet", "csv"], default="postgres")
+    parser.add_argument("--dsn", default=os.getenv("BENCH_DB_URL"), help="target for --to postgres")
+    parser.add_argument("--out", default="synthetic_data", help="directory for --to parquet/csv")
+    parser.add_argument("--create", action="store_true", help="create the tables if missing")
+    parser.add_argument("--replace", action="store_true", help="drop and recreate the tables")
+    parser.add_argument("--events", type=int, default=5_000_000)
+    parser.add_argument("--journeys", type=int, default=100)
+    parser.add_argument("--nodes", type=int, default=30, help="nodes per journey")
+    parser.add_argument("--branching", type=int, default=2, help="max extra successors per node")
+    parser.add_argument("--drop-off", type=float, default=0.15, help="per-step drop-off probability")
+    parser.add_argument("--channel-mix", type=_parse_mix, default=DEFAULT_CHANNEL_MIX,
+                        help="e.g. email=0.5,sms=0.3,push=0.2")
+    parser.add_argument("--users", type=int, default=1_000_000, help="distinct uid pool")
+    parser.add_argument("--days", type=int, default=90, help="event time span ending now")
+    parser.add_argument("--batch-users", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rows, batches = generate(
+        args.events, args.journeys, args.nodes, args.branching, args.drop_off,
+        args.channel_mix, args.users, args.days, batch_users=args.batch_users, seed=args.seed,
+    )
+
+    start = time.perf_counter()
+    if args.to == "postgres":
+        if not args.dsn:
+            parser.error("--dsn (or BENCH_DB_URL) is required for --to postgres")
+        loaded = load_postgres(args.dsn, rows, batches, args.create, args.replace)
+    else:
+        loaded = write_files(args.out, args.to, rows, batches)
+    elapsed = time.perf_counter() - start
+    print(
+        f"\n{len(rows):,} journeys, {loaded:,} events in {elapsed:.1f}s "
+        f"({loaded / elapsed * 60 / 1e6:.1f}M events/min)",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
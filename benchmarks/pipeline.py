@@ -0,0 +1,262 @@
+# benchmarks/pipeline.py
+"""
+End-to-end benchmark of the app.py pipeline and GeminiNeonBridge against a
+deterministic fake Gemini and a local Postgres.
+
+    python benchmarks/pipeline.py --dsn postgresql://localhost/journeys_bench --seed
+    python benchmarks/pipeline.py --dsn ... --rounds 5 --llm-latency 400 --llm-tps 80
+    python benchmarks/pipeline.py --dsn ... --target bridge --tracemalloc
+
+Gemini is replaced by a client that replays the recorded responses in
+benchmarks/fixtures/question_mix.json with configurable first-token latency
+and streaming speed, so runs are repeatable and cost nothing. app.py is
+driven through Streamlit's AppTest, so rendering is included. The bridge's
+MCP tool calls run against the same local database.
+
+Reports throughput, per-stage latency percentiles (from the tracing spans)
+and peak memory. --seed (re)creates journey_xray / papi_automation with
+synthetic data from journey_data.py first; never point --dsn at a real
+database.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures", "question_mix.json")
+
+def load_fixtures(path=FIXTURES):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["questions"]
+
+
+def seed(dsn, events, journeys, nodes, users):
+    import psycopg
+
+    from journey_data import generate, load_postgres
+
+    print(f"Seeding {events:,} events over {journeys:,} journeys ({nodes} nodes each)...")
+    start = time.perf_counter()
+    rows, batches = generate(events, journeys=journeys, nodes=nodes, users=users)
+    load_postgres(dsn, rows, batches, replace=True)
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute("CREATE INDEX ON journey_xray (aid)")
+        conn.execute("ANALYZE journey_xray")
+        conn.execute("ANALYZE papi_automation")
+    print(f"\nSeeded in {time.perf_counter() - start:.1f}s\n")
+
+
+# ---------- FAKE GEMINI ----------
+class FakeGemini:
+    """
+    Replays recorded responses for the fixture questions. latency_ms is the
+    time to the first token, tokens_per_s the streaming speed afterwards.
+    """
+
+    def __init__(self, fixtures, latency_ms=0, tokens_per_s=0):
+        self.fixtures = fixtures
+        self.latency = latency_ms / 1000
+        self.token_delay = 1 / tokens_per_s if tokens_per_s else 0
+        self.models = self  # client.models.generate_content(...)
+
+    def _find(self, text):
+        """Fixture whose question appears latest in the text."""
+        lowered = text.lower()
+        found = [(lowered.rfind(q["question"].lower()), q) for q in self.fixtures]
+        position, fixture = max(found, key=lambda f: f[0])
+        return fixture if position >= 0 else None
+
+    def reply(self, contents):
+        text = "\n".join(
+            part.get("text", "") for message in contents for part in message.get("parts", [])
+        )
+        fixture = self._find(text)
+        if "You are a data analyst" in text:
+            return fixture["explanation"] if fixture else "Result explained."
+        return (fixture or {}).get("sql") or "SELECT 1"
+
+    def _usage(self, contents, reply):
+        prompt = sum(len(p.get("text", "")) for m in contents for p in m.get("parts", []))
+        return SimpleNamespace(prompt_token_count=prompt // 4 + 1, candidates_token_count=len(reply) // 4 + 1)
+
+    def generate_content(self, model, contents, config=None):
+        reply = self.reply(contents)
+        time.sleep(self.latency + self.token_delay * len(reply.split()))
+        return SimpleNamespace(text=reply, usage_metadata=self._usage(contents, reply))
+
+    def generate_content_stream(self, model, contents, config=None):
+        reply = self.reply(contents)
+        time.sleep(self.latency)
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(self.token_delay)
+            last = i == len(words) - 1
+            yield SimpleNamespace(
+                text=word + ("" if last else " "),
+                usage_metadata=self._usage(contents, reply) if last else None,
+            )
+
+
+class FakeChat:
+    """genai ChatSession stand-in for GeminiNeonBridge: one run_sql call, then the explanation."""
+
+    def __init__(self, gemini):
+        self.gemini = gemini
+        self.fixture = None
+
+    async def send_message_async(self, content):
+        await asyncio.sleep(self.gemini.latency)
+        if isinstance(content, str):
+            self.fixture = self.gemini._find(content)
+            if self.fixture and self.fixture.get("sql"):
+                call = SimpleNamespace(name="run_sql", args={"sql": self.fixture["sql"]})
+                return _response(SimpleNamespace(function_call=call, text=None))
+        explanation = self.fixture["explanation"] if self.fixture else "Done."
+        return _response(SimpleNamespace(function_call=None, text=explanation))
+
+
+def _response(part):
+    content = SimpleNamespace(parts=[part])
+    return SimpleNamespace(
+        candidates=[SimpleNamespace(content=content)],
+        usage_metadata=SimpleNamespace(prompt_token_count=0, candidates_token_count=0),
+    )
+
+
+class LocalToolPool:
+    """Answers the bridge's run_sql tool calls from the local database instead of Neon MCP."""
+
+    async def call_tool(self, name, arguments):
+        from db import run_query
+
+        if name != "run_sql":
+            return {"error": f"tool {name} is not available in the benchmark"}
+        df = await asyncio.to_thread(run_query, arguments["sql"])
+        return {"rows": len(df), "sample": df.head(20).to_json(orient="records", date_format="iso")}
+
+
+# ---------- RUNNERS ----------
+def run_app(fixtures, rounds, warm, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    from result_cache import get_result_cache
+
+    app = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=timeout)
+    app.run()
+    turns = failures = 0
+    for _ in range(rounds):
+        for fixture in fixtures:
+            if not warm:
+                get_result_cache().clear()
+            app.chat_input[0].set_value(fixture["question"]).run()
+            turns += 1
+            if app.exception or len(app.error):
+                failures += 1
+    return turns, failures
+
+
+def run_bridge(fixtures, rounds, gemini):
+    from gemini_neon_bridge import GeminiNeonBridge
+
+    bridge = GeminiNeonBridge("bench", "bench", "bench-project")
+    bridge.pool = bridge.session = LocalToolPool()
+    bridge.model = bridge.chat = FakeChat(gemini)
+
+    async def drive():
+        turns = 0
+        for _ in range(rounds):
+            for fixture in fixtures:
+                await bridge.chat_with_gemini(fixture["question"])
+                turns += 1
+        return turns
+
+    return asyncio.run(drive()), 0
+
+
+def report(target, turns, failures, elapsed, traced_peak):
+    from tracing import durations
+    import numpy as np
+
+    print(f"\n{target}: {turns} turns in {elapsed:.2f}s -> {turns / elapsed:.2f} turns/s"
+          + (f", {failures} failed" if failures else ""))
+
+    stages = ("turn", "generate_sql", "refine_local", "plan_guard", "funnel", "fetch", "summarize", "render",
+              "explain_result", "mcp_chat", "gemini.send_message", "mcp_tool")
+    print(f"\n{'stage':<22}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage in stages:
+        values = durations(stage)
+        if not values:
+            continue
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        print(f"{stage:<22}{len(values):>6}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{max(values):>10.1f}")
+
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+    print(f"\npeak RSS {rss_mb:,.1f} MB"
+          + (f", peak traced Python allocations {traced_peak / 1024 / 1024:,.1f} MB" if traced_peak else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dsn", default=os.getenv("BENCH_DB_URL"), help="local Postgres (default BENCH_DB_URL)")
+    parser.add_argument("--target", choices=["app", "bridge"], default="app")
+    parser.add_argument("--rounds", type=int, default=3, help="passes over the question mix")
+    parser.add_argument("--fixtures", default=FIXTURES)
+    parser.add_argument("--llm-latency", type=float, default=300, help="fake Gemini first-token latency, ms")
+    parser.add_argument("--llm-tps", type=float, default=100, help="fake Gemini tokens per second (0 = instant)")
+    parser.add_argument("--warm", action="store_true", help="keep result/LLM caches between questions")
+    parser.add_argument("--timeout", type=float, default=300, help="per-turn AppTest timeout, s")
+    parser.add_argument("--tracemalloc", action="store_true", help="also track peak Python allocations (slower)")
+    parser.add_argument("--trace-out", default="", help="write spans as JSONL here")
+    parser.add_argument("--seed", action="store_true", help="(re)create and fill the benchmark tables first")
+    parser.add_argument("--events", type=int, default=2_000_000)
+    parser.add_argument("--journeys", type=int, default=200)
+    parser.add_argument("--nodes", type=int, default=40)
+    parser.add_argument("--users", type=int, default=500_000)
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error("--dsn (or BENCH_DB_URL) is required; use a disposable local database")
+
+    # Must be set before the app modules read their configuration
+    os.environ["DB_URL"] = args.dsn
+    os.environ["TRACE_PATH"] = args.trace_out
+    os.environ["TRACE_HISTORY"] = "1000000"
+    os.environ["QUERY_LOG_PATH"] = ""
+    if not args.warm:
+        os.environ["LLM_CACHE_BYPASS"] = "1"
+
+    if args.seed:
+        seed(args.dsn, args.events, args.journeys, args.nodes, args.users)
+
+    import llm
+
+    fixtures = load_fixtures(args.fixtures)
+    gemini = FakeGemini(fixtures, args.llm_latency, args.llm_tps)
+    llm.get_client = lambda: gemini
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if args.target == "app":
+        turns, failures = run_app(fixtures, args.rounds, args.warm, args.timeout)
+    else:
+        turns, failures = run_bridge(fixtures, args.rounds, gemini)
+    elapsed = time.perf_counter() - start
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else 0
+
+    report(args.target, turns, failures, elapsed, traced_peak)
+
+
+if __name__ == "__main__":
+    main()
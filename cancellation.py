@@ -0,0 +1,106 @@
+# cancellation.py
+"""
+Cancellation tokens shared by every stage of a turn.
+
+A CancelToken is cancelled explicitly (new question, reset, abandoned job)
+or by its deadline. Cancelling runs the registered callbacks, which do the
+actual aborting: a Postgres cancel request on the active connection,
+closing a Gemini stream, cancelling an asyncio task. Stages create child
+tokens with their own, shorter deadlines; cancelling a parent cancels its
+children.
+"""
+import os
+import threading
+import time
+
+# Overall and per-stage deadlines, in seconds (0 disables one)
+TURN_DEADLINE = float(os.getenv("TURN_DEADLINE_S", 180))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE_S", 60))
+QUERY_DEADLINE = float(os.getenv("QUERY_DEADLINE_S", 120))
+AGENT_DEADLINE = float(os.getenv("AGENT_DEADLINE_S", 300))
+
+
+class Cancelled(RuntimeError):
+    """The work was cancelled before it finished."""
+
+
+class DeadlineExceeded(Cancelled):
+    """The work ran past its deadline."""
+
+
+class CancelToken:
+    def __init__(self, deadline=None, name="turn"):
+        self.name = name
+        self.deadline = time.monotonic() + deadline if deadline else None
+        self.reason = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._timer = None
+        if deadline:
+            self._timer = threading.Timer(deadline, self.cancel, args=(f"{name} deadline of {deadline:g}s exceeded",))
+            self._timer.daemon = True
+            self._timer.start()
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    def cancel(self, reason="cancelled"):
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        if self._timer is not None:
+            self._timer.cancel()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass  # one failing abort must not block the others
+
+    def on_cancel(self, callback):
+        """Run callback when cancelled (immediately if already). Returns an unregister function."""
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def child(self, deadline=None, name=None):
+        """Token cancelled with this one, or earlier by its own deadline."""
+        remaining = self.remaining()
+        if remaining is not None and (not deadline or remaining < deadline):
+            deadline = max(remaining, 0.001)
+        child = CancelToken(deadline, name or self.name)
+        unregister = self.on_cancel(lambda: child.cancel(self.reason))
+        child.on_cancel(unregister)
+        return child
+
+    def remaining(self):
+        """Seconds left before the deadline, or None without one."""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def error(self):
+        if self.reason and "deadline" in self.reason:
+            return DeadlineExceeded(self.reason)
+        return Cancelled(self.reason or "cancelled")
+
+    def raise_if_cancelled(self):
+        if self.reason is not None:
+            raise self.error()
+
+    def close(self):
+        """Release the deadline timer once the work is done (no cancel callbacks run)."""
+        if self._timer is not None:
+            self._timer.cancel()
+        with self._lock:
+            self._callbacks = []
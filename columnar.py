@@ -0,0 +1,107 @@
+# columnar.py
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+try:
+    import pyarrow  # noqa: F401  (ships with streamlit)
+    _TEXT_DTYPE = "string[pyarrow]"
+except ImportError:
+    _TEXT_DTYPE = None
+
+# Postgres type OIDs
+_INT_OIDS = {20, 21, 23}            # int8, int2, int4
+_FLOAT_OIDS = {700, 701}            # float4, float8
+_TIMESTAMP_OIDS = {1114}            # timestamp without time zone
+_TIMESTAMPTZ_OIDS = {1184}          # timestamp with time zone
+_TEXT_OIDS = {25, 1043, 18, 19}     # text, varchar, char, name
+_BOOL_OIDS = {16}
+
+# Text columns with at most this many distinct values (and no more than
+# half the chunk) are stored as pandas categoricals, e.g. journey_xray.channel
+CATEGORICAL_MAX_UNIQUE = int(os.getenv("RESULT_CATEGORICAL_MAX_UNIQUE", 256))
+
+
+def _object_array(values):
+    # Pre-sized so list/dict values (jsonb) stay one object per row
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+
+def _typed_column(values, type_code, categorical):
+    if type_code in _INT_OIDS:
+        if None in values:
+            return pd.array(values, dtype="Int64")
+        return np.fromiter(values, dtype=np.int64, count=len(values))
+
+    if type_code in _FLOAT_OIDS:
+        return np.array(values, dtype=np.float64)
+
+    if type_code in _TIMESTAMP_OIDS:
+        return pd.to_datetime(values).array
+
+    if type_code in _TIMESTAMPTZ_OIDS:
+        return pd.to_datetime(values, utc=True).array
+
+    if type_code in _BOOL_OIDS and None not in values:
+        return np.array(values, dtype=bool)
+
+    if type_code in _TEXT_OIDS:
+        if categorical:
+            return pd.Categorical(_object_array(values))
+        if _TEXT_DTYPE:
+            return pd.array(values, dtype=_TEXT_DTYPE)
+
+    return _object_array(values)
+
+
+def is_low_cardinality(values):
+    unique = len(set(values))
+    return unique <= CATEGORICAL_MAX_UNIQUE and unique <= max(1, len(values) // 2)
+
+
+def decode_rows(rows, description, categorical=None):
+    """
+    Decode a batch of psycopg rows into a DataFrame of typed columns
+    (int64/float64/datetime64 numpy arrays, categoricals for low-cardinality
+    text) instead of per-row Python objects.
+
+    `categorical` is the set of column names stored as categoricals; when
+    None it is decided from this batch and returned so later batches of the
+    same result use the same encoding.
+    """
+    # Per-column list comprehensions are much faster than zip(*rows) here
+    columns = [[row[i] for row in rows] for i in range(len(description))]
+
+    if categorical is None:
+        categorical = {
+            col.name
+            for col, values in zip(description, columns)
+            if col.type_code in _TEXT_OIDS and values and is_low_cardinality(values)
+        }
+
+    # Keyed by position so duplicate column names (joins) survive
+    data = {
+        i: _typed_column(values, col.type_code, col.name in categorical)
+        for i, (col, values) in enumerate(zip(description, columns))
+    }
+    df = pd.DataFrame(data)
+    df.columns = [col.name for col in description]
+    return df, categorical
+
+
+def concat_chunks(chunks):
+    """Concatenate decoded chunks, merging categoricals instead of falling back to object."""
+    if len(chunks) == 1:
+        return chunks[0]
+
+    df = pd.concat(chunks, ignore_index=True)
+    for i, dtype in enumerate(chunks[0].dtypes):
+        if isinstance(dtype, pd.CategoricalDtype):
+            df.isetitem(i, union_categoricals(
+                [c.iloc[:, i] for c in chunks], ignore_order=True
+            ))
+    return df
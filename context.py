@@ -0,0 +1,100 @@
+# context.py
+import os
+
+# Turns kept verbatim (SQL + summary with sample rows + explanation)
+RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", 3))
+# Rough token budget for the whole SQL prompt (instructions, schema,
+# query history and recent messages); the history gets what's left
+TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000))
+# Longest value kept in a sample row (nodedatarray rows can be huge)
+SAMPLE_VALUE_CHARS = int(os.getenv("CONTEXT_SAMPLE_VALUE_CHARS", 200))
+
+_EXPLANATION_CHARS = 160
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English and SQL)."""
+    return len(text) // 4 + 1
+
+
+def conversation_tokens(conversation) -> int:
+    return sum(
+        estimate_tokens(part.get("text", ""))
+        for turn in conversation
+        for part in turn["parts"]
+    )
+
+
+def _compact_value(value, chars):
+    text = value if isinstance(value, str) else str(value)
+    if len(text) <= chars:
+        return value
+    return text[:chars] + f"… ({len(text):,} chars)"
+
+
+def compact_rows(rows, chars=SAMPLE_VALUE_CHARS):
+    """Sample rows with long values (e.g. JSONB node arrays) cut to `chars` characters."""
+    return [{k: _compact_value(v, chars) for k, v in row.items()} for row in rows or []]
+
+
+def _compact_summary(summary):
+    if not summary or "sample_rows" not in summary:
+        return summary
+    return {**summary, "sample_rows": compact_rows(summary["sample_rows"])}
+
+
+def _compact_turn(turn, entry):
+    """Older turns keep their SQL and result shape only; sample rows are dropped."""
+    summary = entry.get("summary") or {}
+    explanation = (entry.get("explanation") or "").strip()
+    if len(explanation) > _EXPLANATION_CHARS:
+        explanation = explanation[:_EXPLANATION_CHARS].rsplit(" ", 1)[0] + "…"
+    return {
+        "turn": turn,
+        "sql": entry["sql"],
+        "row_count": summary.get("row_count"),
+        "columns": summary.get("columns"),
+        "explanation": explanation,
+    }
+
+
+def compress_history(query_history, budget=TOKEN_BUDGET, recent_turns=RECENT_TURNS):
+    """
+    Fit the query history into the token budget: the last `recent_turns`
+    entries stay verbatim (with long sample values cut), older ones are
+    folded into compact summaries. If that is still too large, compact
+    turns are dropped oldest-first (the first turn is kept so "first query"
+    references still resolve), then sample rows are stripped from the
+    recent turns, the latest last, then recent turns are dropped
+    oldest-first down to the latest one.
+    """
+    split = max(0, len(query_history) - recent_turns)
+    older = [_compact_turn(i + 1, e) for i, e in enumerate(query_history[:split])]
+    recent = [
+        {"turn": i + 1, **e, "summary": _compact_summary(e.get("summary"))}
+        for i, e in enumerate(query_history[split:], start=split)
+    ]
+
+    def size():
+        return estimate_tokens(str(older + recent))
+
+    while older and size() > budget:
+        older.pop(1 if len(older) > 1 else 0)
+
+    for entry in recent:
+        if size() <= budget:
+            break
+        if entry.get("summary"):
+            entry["summary"] = {
+                k: v for k, v in entry["summary"].items() if k != "sample_rows"
+            }
+
+    while len(recent) > 1 and size() > budget:
+        recent.pop(0)
+
+    return older + recent
+
+
+def recent_messages(messages, recent_turns=RECENT_TURNS):
+    """Chat messages for the last `recent_turns` turns plus the pending question."""
+    return messages[-(recent_turns * 2 + 1):]
@@ -0,0 +1,258 @@
+# db.py
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg
+import streamlit as st
+from psycopg_pool import ConnectionPool, PoolTimeout
+
+from cancellation import QUERY_DEADLINE, CancelToken
+from columnar import concat_chunks, decode_rows
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+
+@st.cache_resource(show_spinner=False)
+def get_pool():
+    """
+    Process-wide Postgres connection pool, shared by every Streamlit
+    session and kept alive across reruns.
+    """
+    return ConnectionPool(
+        conninfo=os.getenv("DB_URL"),
+        min_size=_env_int("DB_POOL_MIN_SIZE", 1),
+        max_size=_env_int("DB_POOL_MAX_SIZE", 10),
+        # Connections idle for longer than this are closed (down to min_size)
+        max_idle=_env_float("DB_POOL_MAX_IDLE", 300),
+        # Max seconds a caller waits for a free connection
+        timeout=_env_float("DB_POOL_TIMEOUT", 30),
+        # Health check run on every checkout; broken connections are replaced
+        check=ConnectionPool.check_connection,
+        name="journey-analytics",
+        open=True,
+    )
+
+
+# ---------- CHECKOUT METRICS ----------
+_metrics_lock = threading.Lock()
+_metrics = {
+    "checkouts": 0,
+    "checkout_errors": 0,
+    "wait_ms_total": 0.0,
+    "wait_ms_max": 0.0,
+    "hold_ms_total": 0.0,
+}
+
+
+@contextmanager
+def connection():
+    """Borrow a connection from the pool, recording wait and hold times."""
+    requested = time.perf_counter()
+    try:
+        with get_pool().connection() as conn:
+            acquired = time.perf_counter()
+            try:
+                yield conn
+            finally:
+                _record_checkout(
+                    wait_ms=(acquired - requested) * 1000,
+                    hold_ms=(time.perf_counter() - acquired) * 1000,
+                )
+    except PoolTimeout:
+        with _metrics_lock:
+            _metrics["checkout_errors"] += 1
+        raise
+
+
+def _record_checkout(wait_ms, hold_ms):
+    with _metrics_lock:
+        _metrics["checkouts"] += 1
+        _metrics["wait_ms_total"] += wait_ms
+        _metrics["wait_ms_max"] = max(_metrics["wait_ms_max"], wait_ms)
+        _metrics["hold_ms_total"] += hold_ms
+
+
+# Server-side cap on any single statement issued by the app
+STATEMENT_TIMEOUT_MS = _env_int("DB_STATEMENT_TIMEOUT_MS", 30_000)
+
+
+def apply_statement_timeout(conn, timeout_ms=None):
+    """Set statement_timeout for the current transaction only."""
+    conn.execute(
+        "SELECT set_config('statement_timeout', %s, true)",
+        (str(timeout_ms or STATEMENT_TIMEOUT_MS),),
+    )
+
+
+def run_query(sql: str) -> pd.DataFrame:
+    """Execute a SELECT through the pool and return it as a DataFrame."""
+    with connection() as conn:
+        apply_statement_timeout(conn)
+        return pd.read_sql(sql, conn)
+
+
+# ---------- CHUNKED FETCHING ----------
+FETCH_SIZE = _env_int("RESULT_FETCH_SIZE", 5000)
+MAX_ROWS = _env_int("RESULT_MAX_ROWS", 200_000)
+MAX_BYTES = _env_int("RESULT_MAX_MB", 256) * 1024 * 1024
+# Binary-format results decoded into typed columns (see columnar.py)
+COLUMNAR = os.getenv("RESULT_COLUMNAR", "1") != "0"
+
+
+class ChunkedResult:
+    """
+    Streams a SELECT through a server-side (named) cursor, FETCH_SIZE rows
+    at a time, and stops once the max-row or max-byte guard is hit.
+    Iterate it for DataFrame chunks; frame() returns everything fetched.
+
+    With prepare=True the SQL (with %s params) runs as a server-side
+    prepared statement on a client cursor instead; psycopg keeps it prepared
+    on the pooled connection, so later executions skip parsing and planning.
+    Rows are then buffered client-side, so keep those queries bounded.
+
+    Cancelling the token (or reaching its deadline, QUERY_DEADLINE_S by
+    default) sends a cancel request for the running statement.
+    """
+
+    def __init__(self, sql, fetch_size=None, max_rows=None, max_bytes=None,
+                 on_complete=None, columnar=None, params=None, prepare=False, token=None):
+        self.sql = sql
+        self.token = token
+        self.params = params
+        self.prepare = prepare
+        self.columnar = COLUMNAR if columnar is None else columnar
+        self.fetch_size = fetch_size or FETCH_SIZE
+        self.max_rows = max_rows or MAX_ROWS
+        self.max_bytes = max_bytes or MAX_BYTES
+        self.on_complete = on_complete
+        self.truncated = False
+        self.rows = 0
+        self.bytes = 0
+        self.chunks = []
+        self.columns = []
+
+    def cancel(self, reason="cancelled"):
+        if self.token is None:
+            self.token = CancelToken(name="query")
+        self.token.cancel(reason)
+
+    def _timeout_ms(self):
+        remaining = self.token.remaining()
+        if remaining is None:
+            return STATEMENT_TIMEOUT_MS
+        return max(1, min(STATEMENT_TIMEOUT_MS, int(remaining * 1000)))
+
+    def __iter__(self):
+        if self.token is None:
+            # The deadline starts when the fetch does, not while it waits in a queue
+            self.token = CancelToken(QUERY_DEADLINE, "query")
+        self.token.raise_if_cancelled()
+        try:
+            with connection() as conn:
+                unregister = self.token.on_cancel(conn.cancel_safe)
+                try:
+                    yield from self._fetch(conn)
+                finally:
+                    unregister()
+        except psycopg.errors.QueryCanceled:
+            if self.token.cancelled:
+                raise self.token.error() from None
+            raise
+        finally:
+            self.token.close()
+
+        if not self.chunks:
+            empty = pd.DataFrame(columns=self.columns)
+            self.chunks.append(empty)
+            yield empty
+
+        if self.on_complete:
+            self.on_complete(self)
+
+    def _fetch(self, conn):
+        apply_statement_timeout(conn, self._timeout_ms())
+        if self.prepare:
+            cursor = conn.cursor(binary=self.columnar)
+        else:
+            cursor = conn.cursor(name=f"fetch_{uuid.uuid4().hex}", binary=self.columnar)
+        with cursor as cur:
+            if self.prepare:
+                cur.execute(self.sql, self.params, prepare=True)
+            else:
+                cur.execute(self.sql, self.params)
+            self.columns = [d.name for d in cur.description]
+            categorical = None
+
+            while not self.truncated:
+                self.token.raise_if_cancelled()
+                rows = cur.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+
+                remaining = self.max_rows - self.rows
+                if len(rows) >= remaining:
+                    self.truncated = len(rows) > remaining or bool(cur.fetchmany(1))
+                    rows = rows[:remaining]
+
+                if self.columnar:
+                    chunk, categorical = decode_rows(rows, cur.description, categorical)
+                else:
+                    chunk = pd.DataFrame.from_records(rows, columns=self.columns)
+                self.rows += len(chunk)
+                self.bytes += int(chunk.memory_usage(deep=True).sum())
+                if self.bytes >= self.max_bytes:
+                    self.truncated = True
+
+                self.chunks.append(chunk)
+                yield chunk
+
+    def frame(self) -> pd.DataFrame:
+        df = concat_chunks(self.chunks)
+        df.attrs["truncated"] = self.truncated
+        return df
+
+
+class FrameResult:
+    """An already materialized frame with the same interface as ChunkedResult."""
+
+    def __init__(self, df):
+        self._df = df
+        self.truncated = df.attrs.get("truncated", False)
+        self.rows = len(df)
+
+    def __iter__(self):
+        yield self._df
+
+    def frame(self):
+        return self._df
+
+
+def pool_stats():
+    """Snapshot of pool sizing plus checkout wait/hold metrics."""
+    stats = get_pool().get_stats()
+    with _metrics_lock:
+        m = dict(_metrics)
+
+    checkouts = m["checkouts"] or 1
+    return {
+        "pool_size": stats.get("pool_size", 0),
+        "pool_available": stats.get("pool_available", 0),
+        "pool_min": stats.get("pool_min", 0),
+        "pool_max": stats.get("pool_max", 0),
+        "requests_waiting": stats.get("requests_waiting", 0),
+        "checkouts": m["checkouts"],
+        "checkout_errors": m["checkout_errors"],
+        "avg_wait_ms": round(m["wait_ms_total"] / checkouts, 2),
+        "max_wait_ms": round(m["wait_ms_max"], 2),
+        "avg_hold_ms": round(m["hold_ms_total"] / checkouts, 2),
+    }
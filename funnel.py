@@ -0,0 +1,233 @@
+# funnel.py
+import re
+
+import numpy as np
+import pandas as pd
+
+from db import ChunkedResult
+from journey_graph import get_graph
+
+# Everything is aggregated in Postgres: only one row per node, node/channel
+# or link comes back, through the same row/byte guards as other results
+_NODE_STATS_SQL = """
+SELECT nid, count(DISTINCT uid) AS users, count(*) AS events
+FROM journey_xray
+WHERE aid = %(aid)s AND nid IS NOT NULL
+GROUP BY nid
+"""
+
+_CHANNEL_SQL = """
+SELECT nid, channel, count(DISTINCT uid) AS users
+FROM journey_xray
+WHERE aid = %(aid)s AND nid IS NOT NULL AND channel IS NOT NULL
+GROUP BY nid, channel
+"""
+
+# Per link: users who reached to_nid no earlier than from_nid (first touches)
+_CONVERSION_SQL = """
+WITH first AS (
+    SELECT nid, uid, min(ts) AS ts
+    FROM journey_xray
+    WHERE aid = %(aid)s AND nid IS NOT NULL AND uid IS NOT NULL
+    GROUP BY nid, uid
+), links AS (
+    SELECT DISTINCT from_nid, to_nid
+    FROM unnest(%(from_nids)s::bigint[], %(to_nids)s::bigint[]) AS l(from_nid, to_nid)
+), pairs AS (
+    SELECT l.from_nid, l.to_nid, extract(epoch FROM b.ts - a.ts)::float8 AS seconds
+    FROM links l
+    JOIN first a ON a.nid = l.from_nid
+    JOIN first b ON b.nid = l.to_nid AND b.uid = a.uid
+    WHERE b.ts >= a.ts
+)
+SELECT
+    from_nid, to_nid,
+    count(*) AS converted_users,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY seconds) AS median_seconds_to_next,
+    percentile_cont(0.9) WITHIN GROUP (ORDER BY seconds) AS p90_seconds_to_next
+FROM pairs
+GROUP BY from_nid, to_nid
+"""
+
+
+def _aggregate(sql, params, dtypes):
+    result = ChunkedResult(sql, params=params)
+    for _ in result:
+        pass
+    if result.truncated:
+        # A partial aggregate would be silently wrong
+        raise RuntimeError("journey too large for the funnel engine (row/size limit reached)")
+    # astype also types the columns of an empty result for the merges
+    return result.frame().astype(dtypes)
+
+
+class JourneyFunnel:
+    """
+    Per-node reach, link conversion, time-to-next-node and channel mix for
+    one journey: journey_xray aggregated in Postgres, joined to the
+    papi_automation node/link graph.
+    """
+
+    def __init__(self, aid, nodes, links):
+        self.aid = aid
+        self.nodes = nodes
+        self.links = links
+
+    @classmethod
+    def load(cls, aid):
+        graph = get_graph(aid)
+        nodes = graph.nodes_frame()[["nid", "label", "node_type"]]
+        return cls(aid, nodes, graph.links_frame())
+
+    def _node_stats(self):
+        return _aggregate(
+            _NODE_STATS_SQL, {"aid": self.aid}, {"nid": "int64", "users": "int64", "events": "int64"}
+        )
+
+    def node_reach(self) -> pd.DataFrame:
+        stats = self._node_stats()
+        # Include graph nodes nobody reached, and event nids missing from the graph
+        reach = self.nodes.merge(stats, on="nid", how="outer")
+        reach[["users", "events"]] = reach[["users", "events"]].fillna(0).astype("int64")
+        reach["label"] = reach["label"].fillna(reach["nid"].astype(str))
+        return reach.sort_values("users", ascending=False, ignore_index=True)
+
+    def link_conversion(self) -> pd.DataFrame:
+        converted = _aggregate(
+            _CONVERSION_SQL,
+            {
+                "aid": self.aid,
+                "from_nids": self.links["from_nid"].tolist(),
+                "to_nids": self.links["to_nid"].tolist(),
+            },
+            {
+                "from_nid": "int64", "to_nid": "int64", "converted_users": "int64",
+                "median_seconds_to_next": "float64", "p90_seconds_to_next": "float64",
+            },
+        )
+        users_from = self._node_stats().set_index("nid")["users"].rename("users_from")
+
+        result = self.links.merge(converted, on=["from_nid", "to_nid"], how="left")
+        result = result.merge(users_from, left_on="from_nid", right_index=True, how="left")
+        result[["converted_users", "users_from"]] = (
+            result[["converted_users", "users_from"]].fillna(0).astype("int64")
+        )
+        result["conversion_rate"] = np.where(
+            result["users_from"] > 0,
+            result["converted_users"] / result["users_from"].clip(lower=1),
+            0.0,
+        ).round(4)
+        result["drop_off_users"] = result["users_from"] - result["converted_users"]
+
+        labels = self.nodes.set_index("nid")["label"]
+        result.insert(1, "from_label", result["from_nid"].map(labels))
+        result.insert(3, "to_label", result["to_nid"].map(labels))
+        return result
+
+    def channel_mix(self) -> pd.DataFrame:
+        mix = _aggregate(_CHANNEL_SQL, {"aid": self.aid}, {"nid": "int64", "users": "int64"})
+        mix["share"] = (mix["users"] / mix.groupby("nid")["users"].transform("sum")).round(4)
+        labels = self.nodes.set_index("nid")["label"]
+        mix.insert(1, "label", mix["nid"].map(labels))
+        return mix.sort_values(["nid", "users"], ascending=[True, False], ignore_index=True)
+
+
+# ---------- QUESTION ROUTING ----------
+_AID_RE = re.compile(r"\b(?:aid|id|journey|automation)\s*(?:=|:|#|is)?\s*(\d+)", re.I)
+
+_LOOKUP = (
+    r"^\s*(?:(?:list|show|get|display|give me|what are)\s+)?(?:all\s+)?(?:the\s+)?{noun}"
+    r"\s+(?:of|for|in)\s+(?:the\s+)?(?:aid|id|journey|automation)\s*(?:=|:|#|is)?\s*\d+\s*[?.!]?\s*$"
+)
+
+_QUESTION_KINDS = [
+    ("link_conversion", re.compile(
+        r"drop[\s-]?offs?|conversions?|convert|funnel|time[\s-]to[\s-]next|between nodes", re.I)),
+    ("channel_mix", re.compile(
+        r"channel[\s-]?(?:mix|split|breakdown|distribution)|by channel|per channel", re.I)),
+    ("node_reach", re.compile(
+        r"(?:users|reach|count)\s+(?:per|by|at|for each|on each)\s+node|node[\s-]?wise|per[\s-]node|each node", re.I)),
+    # Merged HLL sketches of journey_xray_rollup (exact count without a
+    # rollup); approximate mode only
+    ("distinct_users", re.compile(
+        r"how many (?:distinct |unique )?users|(?:number|count) of (?:distinct |unique )?users"
+        r"|(?:distinct|unique) users|user count|count (?:distinct |unique )?users", re.I)),
+    # Plain graph lookups, served from the parsed-graph cache. Only the bare
+    # "list the nodes of journey N" phrasing: anything more is analysis
+    ("nodes", re.compile(_LOOKUP.format(noun=r"nodes"), re.I)),
+    ("links", re.compile(_LOOKUP.format(noun=r"(?:links|edges|connections)"), re.I)),
+]
+
+# Qualifiers the engine can't apply (it always answers for all time, all
+# channels and all users); such questions go to the LLM instead
+_MONTHS = "january|february|march|april|june|july|august|september|october|november|december"
+_CONSTRAINT_RES = [
+    re.compile(
+        r"\b(?:today|yesterday|tonight|since|until|till|before|after|during|ago|recent(?:ly)?"
+        r"|hourly|daily|weekly|monthly|yearly|between(?!\s+(?:the\s+)?nodes)"
+        r"|(?:last|past|this|previous|next)\s+(?:hours?|days?|weeks?|months?|quarters?|years?)"
+        r"|" + _MONTHS + r")\b", re.I),
+    re.compile(r"\b(?:e-?mails?|sms|push|web[\s-]?push|whatsapp|in[\s-]?app|rcs|channel\s*(?:=|:|is)\s*\w)", re.I),
+    re.compile(r"\b(?:uid|cid|glreqid|user[\s_-]?id|client(?:[\s_-]?id)?)\b", re.I),
+    re.compile(r"\b(?:only|excluding|except|without|where|top|bottom|more than|less than|at least|at most)\b", re.I),
+]
+
+
+def _constrained(question, aid):
+    """True when the question narrows the answer beyond the journey id."""
+    rest = question[:aid.start()] + " " + question[aid.end():]
+    # Any other number (a date, a user id, "last 7 days", "top 10") is a filter
+    if re.search(r"\d", rest):
+        return True
+    return any(pattern.search(rest) for pattern in _CONSTRAINT_RES)
+
+
+def match_funnel_question(question, approximate=False):
+    """
+    (kind, aid) when the question is a structural funnel question the engine
+    can answer without the LLM, otherwise None. Questions with time,
+    channel, user or other constraints are declined. Distinct-user counts
+    are HLL estimates, so they are only routed here in approximate mode.
+    """
+    aid = _AID_RE.search(question)
+    if not aid or _constrained(question, aid):
+        return None
+    for kind, pattern in _QUESTION_KINDS:
+        if kind == "distinct_users" and not approximate:
+            continue
+        if pattern.search(question):
+            return kind, int(aid.group(1))
+    return None
+
+
+def _distinct_users(aid) -> pd.DataFrame:
+    from rollups import distinct_users
+
+    estimate = distinct_users(aid)
+    if estimate is not None:
+        return pd.DataFrame({"aid": [aid], "approx_users": [estimate]})
+    return _aggregate(
+        "SELECT %(aid)s::bigint AS aid, count(DISTINCT uid) AS users FROM journey_xray WHERE aid = %(aid)s",
+        {"aid": aid},
+        {"aid": "int64", "users": "int64"},
+    )
+
+
+def run_funnel(kind, aid) -> pd.DataFrame:
+    if kind == "distinct_users":
+        return _distinct_users(aid)
+    if kind == "nodes":
+        return get_graph(aid).nodes_frame()
+    if kind == "links":
+        return get_graph(aid).links_frame()
+    return getattr(JourneyFunnel.load(aid), kind)()
+
+
+def describe_funnel(kind, aid) -> str:
+    """Stand-in for the SQL text in history and explanations."""
+    if kind == "distinct_users":
+        return (
+            f"/* funnel engine: distinct users for journey_xray aid = {aid} "
+            "(HyperLogLog estimate from journey_xray_rollup) */"
+        )
+    return f"/* funnel engine: {kind.replace('_', ' ')} for journey_xray aid = {aid} */"
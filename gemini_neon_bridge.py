@@ -1,43 +1,63 @@
 import asyncio
 import json
+import os
 from typing import Any, Dict, List
 from mcp import ClientSession
-from mcp.client.sse import sse_client
 import google.generativeai as genai
+from mcp_pool import NeonSessionPool, close_session_pools, get_session_pool
+from tracing import span
+from cancellation import AGENT_DEADLINE, CancelToken
+
+# Converted tool definitions and the genai.protos Tool built from them, shared by
+# every bridge in the process and rebuilt only when the pool refreshes its tool list
+_tool_cache: Dict[str, Any] = {"key": None, "tools": [], "tool_config": None, "skip_discovery": None}
+
+# Schema-discovery tools, not offered to Gemini when the schema catalog is in the prompt
+DISCOVERY_TOOLS = {"get_database_tables", "describe_table_schema"}
+
+
+def _catalog_prompt() -> str:
+    """Live schema section from schema_catalog, or "" when the database isn't reachable directly"""
+    if not os.getenv("DB_URL"):
+        return ""
+    try:
+        from schema_catalog import get_schema_catalog
+        return get_schema_catalog().prompt() or ""
+    except Exception:
+        return ""
 
 class GeminiNeonBridge:
     """Bridge between Google Gemini and Neon MCP Server"""
     
-    def __init__(self, neon_api_key: str, gemini_api_key: str, project_id: str):
+    def __init__(self, neon_api_key: str, gemini_api_key: str, project_id: str,
+                 tool_concurrency: int = 4, tool_timeout: float = 60.0):
         self.neon_api_key = neon_api_key
         self.gemini_api_key = gemini_api_key
         self.project_id = project_id
+        self.pool: NeonSessionPool | None = None
         self.session: ClientSession | None = None
-        self.sse_context = None
         self.tools: List[Dict[str, Any]] = []
         self.chat = None  # Persistent chat session
         self.model = None  # Persistent model instance
+        self.tool_timeout = tool_timeout  # Seconds allowed per tool call
+        self._tool_semaphore = asyncio.Semaphore(tool_concurrency)  # Max concurrent tool calls
         
         # Configure Gemini
         genai.configure(api_key=self.gemini_api_key)
     
     async def connect_to_neon(self):
-        """Connect to Neon's managed MCP server"""
-        url = "https://mcp.neon.tech/sse"
-        headers = {
-            "Authorization": f"Bearer {self.neon_api_key}"
-        }
-        
-        self.sse_context = sse_client(url, headers=headers)
-        streams = await self.sse_context.__aenter__()
+        """Connect to Neon's managed MCP server (via the process-wide warm session pool)"""
+        self.pool = await get_session_pool(self.neon_api_key)
+        self.session = await self.pool.session()
         
-        self.session = ClientSession(streams[0], streams[1])
-        await self.session.__aenter__()
-        await self.session.initialize()
-        
-        # Get available tools from Neon MCP
-        tools_response = await self.session.list_tools()
-        self.tools = self._convert_mcp_tools_to_gemini_format(tools_response.tools)
+        # Get available tools from Neon MCP (cached by the pool with a TTL)
+        mcp_tools, version = await self.pool.list_tools()
+        key = (id(self.pool), version)
+        if _tool_cache["key"] != key:
+            _tool_cache["tools"] = self._convert_mcp_tools_to_gemini_format(mcp_tools)
+            _tool_cache["tool_config"] = None
+            _tool_cache["key"] = key
+        self.tools = _tool_cache["tools"]
         
         print(f"✅ Connected to Neon MCP. Found {len(self.tools)} tools.")
         for tool in self.tools:
@@ -105,7 +125,7 @@ class GeminiNeonBridge:
     
     async def execute_tool_call(self, tool_name: str, arguments: Dict[str, Any]) -> Any:
         """Execute a tool call on the Neon MCP server"""
-        if not self.session:
+        if not self.pool:
             raise RuntimeError("Not connected to Neon MCP. Call connect_to_neon() first.")
         
         # Ensure project_id is included in arguments if not present
@@ -117,19 +137,45 @@ class GeminiNeonBridge:
             arguments['projectId'] = arguments.pop('project_id')
         
         try:
-            result = await self.session.call_tool(tool_name, arguments=arguments)
+            result = await self.pool.call_tool(tool_name, arguments=arguments)
             return result
         except Exception as e:
             return {"error": str(e)}
     
-    def _initialize_gemini_model(self, model_name: str = "gemini-2.0-flash-exp"):
+    def _initialize_gemini_model(self, model_name: str = "gemini-2.0-flash-exp", schema: str = ""):
         """Initialize Gemini model and chat session (only once)"""
         if self.model is not None and self.chat is not None:
             return  # Already initialized
         
+        # Schema construction is done once per process (per tool-list version).
+        # With the schema in the prompt the discovery tools aren't needed at all.
+        skip_discovery = bool(schema)
+        if (_tool_cache["tool_config"] is None or _tool_cache["tools"] is not self.tools
+                or _tool_cache["skip_discovery"] != skip_discovery):
+            _tool_cache["tool_config"] = self._build_tool_config(skip_discovery)
+            _tool_cache["skip_discovery"] = skip_discovery
+        tool_config = _tool_cache["tool_config"]
+        
+        # System instruction to guide Gemini's behavior
+        system_instruction = self._system_instruction(schema)
+        
+        # Create model with tools and system instruction (persistent)
+        self.model = genai.GenerativeModel(
+            model_name=model_name,
+            tools=[tool_config],
+            system_instruction=system_instruction
+        )
+        
+        # Start chat session (persistent - maintains history)
+        self.chat = self.model.start_chat()
+    
+    def _build_tool_config(self, skip_discovery: bool = False):
+        """Build the genai.protos Tool (function declarations) for the current MCP tools"""
         # Convert tools to Gemini's function declaration format
         function_declarations = []
         for tool in self.tools:
+            if skip_discovery and tool['name'] in DISCOVERY_TOOLS:
+                continue
             # Build properties dict for Gemini Schema
             properties = {}
             for prop_name, prop_def in tool['parameters']['properties'].items():
@@ -185,12 +231,21 @@ class GeminiNeonBridge:
             )
         
         # Create tool config
-        tool_config = genai.protos.Tool(
+        return genai.protos.Tool(
             function_declarations=function_declarations
         )
-        
-        # System instruction to guide Gemini's behavior
-        system_instruction = f"""You are an autonomous database assistant with direct access to execute SQL queries on a Neon PostgreSQL database.
+    
+    def _system_instruction(self, schema: str = "") -> str:
+        """System instruction to guide Gemini's behavior; schema is the catalog section, if available"""
+        if schema:
+            exploration = "The database schema below is current (types, cardinalities, sample values). Do NOT explore the schema with tool calls; write the query directly."
+            tables = f"""Tables in project-id {self.project_id} (journey_xray.aid = papi_automation.id):
+
+{schema}"""
+        else:
+            exploration = "Use `get_database_tables` or `describe_table_schema` if you need to understand the database structure first."
+            tables = self._table_notes()
+        return f"""You are an autonomous database assistant with direct access to execute SQL queries on a Neon PostgreSQL database.
 
 NEVER SAY that you need more information about the project or database or table to answer the question. Find that information yourself by executing SQL queries instead of asking user for more information.
 
@@ -199,7 +254,7 @@ CRITICAL BEHAVIOR RULES:
 2. PROJECT ID: Always include projectId="{self.project_id}" when calling `run_sql`.
 3. PROACTIVE QUERIES: If asked "show me nodes for id 1" or similar, immediately execute: SELECT * FROM papi_automation WHERE id = 1
 4. RESULT PRESENTATION: After executing queries, format and explain results clearly to the user.
-5. SCHEMA EXPLORATION: Use `get_database_tables` or `describe_table_schema` if you need to understand the database structure first.
+5. SCHEMA EXPLORATION: {exploration}
 
 WORKFLOW EXAMPLES:
 
@@ -229,7 +284,13 @@ ALWAYS:
 - Present results clearly
 - Be helpful and proactive
 
-journey_xray table in project-id late-brook-11506963 :
+{tables}
+"""
+
+    @staticmethod
+    def _table_notes() -> str:
+        """Hand-written table notes, used when the schema catalog is unavailable"""
+        return """journey_xray table in project-id late-brook-11506963 :
 aid is Journey or Automation ID
 channel is the channel of communication
 cid is client id
@@ -248,34 +309,88 @@ linkdatarray contains the information about the links between the nodes
 id in papi_automation table is same as aid in journey_xray table
 
 """
-
-        # Create model with tools and system instruction (persistent)
-        self.model = genai.GenerativeModel(
-            model_name=model_name,
-            tools=[tool_config],
-            system_instruction=system_instruction
-        )
-        
-        # Start chat session (persistent - maintains history)
-        self.chat = self.model.start_chat()
     
-    async def chat_with_gemini(self, user_message: str, model_name: str = "gemini-2.0-flash-exp") -> str:
-        """Chat with Gemini, allowing it to use Neon MCP tools with persistent memory"""
+    async def chat_with_gemini(self, user_message: str, model_name: str = "gemini-2.0-flash-exp",
+                               token: CancelToken | None = None) -> str:
+        """
+        Chat with Gemini, allowing it to use Neon MCP tools with persistent memory.
+        The whole exchange (every Gemini round trip and tool call) is bounded by
+        token, or by AGENT_DEADLINE_S when no token is given; cancelling it
+        aborts the in-flight request and raises Cancelled/DeadlineExceeded.
+        """
+        owned = token is None
+        if owned:
+            token = CancelToken(AGENT_DEADLINE, "agent")
+        try:
+            return await self._chat_cancellable(user_message, model_name, token)
+        finally:
+            if owned:
+                token.close()
+
+    async def _chat_cancellable(self, user_message: str, model_name: str, token: CancelToken) -> str:
+        token.raise_if_cancelled()
         if not self.session:
             await self.connect_to_neon()
         
         # Initialize model and chat if not already done
         if self.model is None or self.chat is None:
-            self._initialize_gemini_model(model_name)
+            schema = await asyncio.to_thread(_catalog_prompt)
+            self._initialize_gemini_model(model_name, schema)
+        
+        # The token may be cancelled from another thread (deadline timer, new question)
+        loop = asyncio.get_running_loop()
+        history_length = len(self.chat.history)
+        task = asyncio.ensure_future(self._chat_loop(user_message, token))
+        unregister = token.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+        with span("mcp_chat") as chat_span:
+            try:
+                response, iterations = await task
+            except BaseException as e:
+                # An interrupted turn can leave a function_call without its
+                # function_response, which Gemini rejects on the next message
+                self.chat.history = self.chat.history[:history_length]
+                if not isinstance(e, asyncio.CancelledError) or not token.cancelled:
+                    raise
+                chat_span.set(cancelled=token.reason)
+                raise token.error() from None
+            finally:
+                unregister()
+            chat_span.set(iterations=iterations)
+        
+        # Extract text response
+        if response.candidates and response.candidates[0].content.parts:
+            text_parts = [
+                part.text 
+                for part in response.candidates[0].content.parts 
+                if hasattr(part, 'text') and part.text
+            ]
+            return ' '.join(text_parts) if text_parts else str(response)
         
+        return str(response)
+    
+    async def _send(self, content, iteration):
+        """One Gemini round trip, traced with its token counts"""
+        with span("gemini.send_message", iteration=iteration) as stage:
+            response = await self.chat.send_message_async(content)
+            usage = getattr(response, 'usage_metadata', None)
+            if usage is not None:
+                stage.set(
+                    prompt_tokens=usage.prompt_token_count,
+                    response_tokens=usage.candidates_token_count,
+                )
+            return response
+    
+    async def _chat_loop(self, user_message: str, token: CancelToken):
+        """Send the message and run Gemini's tool calls until it answers; returns (response, iterations)"""
         # Send message to existing chat (maintains conversation history)
-        response = self.chat.send_message(user_message)
+        response = await self._send(user_message, 0)
         
         # Handle function calls in a loop
         max_iterations = 10  # Prevent infinite loops
         iteration = 0
         
         while iteration < max_iterations:
+            token.raise_if_cancelled()
             iteration += 1
             
             # Check if there's a function call
@@ -295,59 +410,65 @@ id in papi_automation table is same as aid in journey_xray table
             if not function_calls:
                 break
             
-            # Execute all function calls
-            function_responses = []
-            for function_call in function_calls:
-                function_name = function_call.name
-                # Convert args to dict
-                function_args = {}
-                if hasattr(function_call, 'args'):
-                    if isinstance(function_call.args, dict):
-                        function_args = function_call.args
-                    else:
-                        # Try to convert protobuf to dict
-                        try:
-                            function_args = dict(function_call.args)
-                        except:
-                            function_args = {}
-                
-                print(f"\n🔧 Gemini wants to call: {function_name}")
-                print(f"   Arguments: {json.dumps(function_args, indent=2)}")
-                
-                # Execute the function
-                function_result = await self.execute_tool_call(function_name, function_args)
-                
-                # Convert result to dict for Gemini
-                if isinstance(function_result, dict):
-                    result_dict = function_result
-                else:
-                    result_dict = {'result': str(function_result)}
-                
-                print(f"✅ Tool executed successfully")
-                
-                # Create function response
-                function_responses.append(
-                    genai.protos.Part(
-                        function_response=genai.protos.FunctionResponse(
-                            name=function_name,
-                            response=result_dict
-                        )
-                    )
-                )
+            # Execute all function calls of this turn concurrently
+            function_responses = await asyncio.gather(
+                *(self._run_function_call(function_call, token) for function_call in function_calls)
+            )
             
             # Send function responses back to Gemini (using persistent chat)
-            response = self.chat.send_message(function_responses)
+            response = await self._send(list(function_responses), iteration)
         
-        # Extract text response
-        if response.candidates and response.candidates[0].content.parts:
-            text_parts = [
-                part.text 
-                for part in response.candidates[0].content.parts 
-                if hasattr(part, 'text') and part.text
-            ]
-            return ' '.join(text_parts) if text_parts else str(response)
+        return response, iteration
+    
+    async def _run_function_call(self, function_call, token: CancelToken) -> Any:
+        """Execute one Gemini function call (bounded concurrency + timeout) and wrap the result"""
+        function_name = function_call.name
+        # Convert args to dict
+        function_args = {}
+        if hasattr(function_call, 'args'):
+            if isinstance(function_call.args, dict):
+                function_args = function_call.args
+            else:
+                # Try to convert protobuf to dict
+                try:
+                    function_args = dict(function_call.args)
+                except:
+                    function_args = {}
         
-        return str(response)
+        print(f"\n🔧 Gemini wants to call: {function_name}")
+        print(f"   Arguments: {json.dumps(function_args, indent=2)}")
+        
+        # Execute the function
+        with span("mcp_tool", tool=function_name) as stage:
+            async with self._tool_semaphore:
+                stage.set(queued_ms=round(stage.duration_ms, 1))
+                # Never let one tool call outlive the whole exchange
+                remaining = token.remaining()
+                timeout = self.tool_timeout if remaining is None else min(self.tool_timeout, remaining)
+                try:
+                    function_result = await asyncio.wait_for(
+                        self.execute_tool_call(function_name, function_args),
+                        timeout=timeout
+                    )
+                except asyncio.TimeoutError:
+                    function_result = {"error": f"Tool call timed out after {timeout:g}s"}
+                    stage.set(timed_out=True)
+        
+        # Convert result to dict for Gemini
+        if isinstance(function_result, dict):
+            result_dict = function_result
+        else:
+            result_dict = {'result': str(function_result)}
+        
+        print(f"✅ Tool executed: {function_name}")
+        
+        # Create function response
+        return genai.protos.Part(
+            function_response=genai.protos.FunctionResponse(
+                name=function_name,
+                response=result_dict
+            )
+        )
     
     def reset_conversation(self):
         """Reset the conversation history (start a new chat)"""
@@ -355,25 +476,23 @@ id in papi_automation table is same as aid in journey_xray table
             self.chat = self.model.start_chat()
             print("🔄 Conversation history reset")
     
-    async def query_data(self, question: str, model_name: str = "gemini-2.0-flash-exp") -> str:
+    async def query_data(self, question: str, model_name: str = "gemini-2.0-flash-exp",
+                         token: CancelToken | None = None) -> str:
         """Query data with emphasis on automatic SQL execution"""
         # Add a prompt that emphasizes execution
         enhanced_prompt = f"""{question}
 
 Remember: Execute the SQL query automatically using the run_sql tool. Do not just provide the SQL code - execute it and show the results."""
         
-        return await self.chat_with_gemini(enhanced_prompt, model_name)
+        return await self.chat_with_gemini(enhanced_prompt, model_name, token)
     
-    async def disconnect(self):
-        """Disconnect from Neon MCP"""
-        if self.session:
-            try:
-                await self.session.__aexit__(None, None, None)
-            except Exception:
-                pass
-        if hasattr(self, 'sse_context') and self.sse_context:
+    async def disconnect(self, close_pool: bool = False):
+        """Release this bridge's MCP session; the shared pool stays warm unless close_pool=True"""
+        self.session = None
+        self.pool = None
+        if close_pool:
             try:
-                await self.sse_context.__aexit__(None, None, None)
+                await close_session_pools()
             except Exception:
                 pass
         # Reset chat and model
@@ -431,7 +550,7 @@ async def main():
             print("\n" + "-"*80 + "\n")
     
     finally:
-        await bridge.disconnect()
+        await bridge.disconnect(close_pool=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,255 @@
+# index_advisor.py
+"""
+Offline index advisor over the executed-SQL log (query_log.py).
+
+    python index_advisor.py                       # DB_URL, log at QUERY_LOG_PATH
+    python index_advisor.py --dsn postgresql://localhost/journeys --top 5
+    python index_advisor.py --out recommended_indexes.sql
+
+Logged queries are grouped by normalized text. Predicates and join keys on
+journey_xray / papi_automation (equality, IN, ts ranges, JSONB operators)
+are turned into candidate indexes, and each candidate is scored by EXPLAIN
+cost of every logged query with and without it, weighted by how often the
+query ran. Candidates are simulated with HypoPG when the extension is
+available; otherwise each one is really built inside a transaction that is
+rolled back, so point --dsn at a local copy, not production.
+"""
+import argparse
+import os
+import re
+from collections import Counter, defaultdict
+
+import psycopg
+
+from query_log import read_log
+from result_cache import normalize_sql
+
+TABLES = {
+    "journey_xray": {"aid", "channel", "cid", "glreqid", "nid", "ts", "uid"},
+    "papi_automation": {
+        "id", "name", "created_date", "from_date", "to_date", "updated_date",
+        "journey_xray_enabled", "lp_content_parsed", "linkdatarray", "nodedatarray",
+    },
+}
+JSONB_COLUMNS = {"lp_content_parsed", "linkdatarray", "nodedatarray"}
+
+# Candidates that improve the weighted cost by less than this are dropped
+MIN_GAIN = 0.02
+
+_TABLE_RE = re.compile(
+    r"\b(?:from|join)\s+(journey_xray|papi_automation)\b"
+    r"(?:\s+(?:as\s+)?(?!where\b|group\b|order\b|limit\b|join\b|left\b|right\b|inner\b|"
+    r"full\b|cross\b|on\b|using\b|tablesample\b)([a-z_][a-z0-9_]*))?",
+    re.I,
+)
+_COL = r"(?:([a-z_][a-z0-9_]*)\.)?([a-z_][a-z0-9_]*)"
+_EQ_RE = re.compile(_COL + r"\s*(?:=(?!>)|\bin\s*\()", re.I)
+_EQ_RHS_RE = re.compile(r"=\s*" + _COL + r"\b(?!\s*\()", re.I)
+_RANGE_RE = re.compile(_COL + r"\s*(?:<=|>=|<(?!>)|>|\bbetween\b)", re.I)
+_RANGE_RHS_RE = re.compile(r"(?:<=|>=|<|>)\s*" + _COL + r"\b(?!\s*\()", re.I)
+_CONTAINS_RE = re.compile(_COL + r"\s*(?:@>|\?\||\?&|\?)", re.I)
+_JSON_KEY_RE = re.compile(_COL + r"\s*->>\s*'([^']+)'\s*(?:=|\bin\b)", re.I)
+_ORDER_RE = re.compile(r"\border\s+by\s+" + _COL, re.I)
+
+
+class Usage:
+    """Columns of one table a query filters, joins or sorts on."""
+
+    def __init__(self):
+        self.equality = set()
+        self.range = set()
+        self.contains = set()
+        self.json_keys = set()  # (column, key)
+        self.order = set()
+
+
+def _aliases(sql):
+    aliases = {}
+    for table, alias in _TABLE_RE.findall(sql):
+        table = table.lower()
+        aliases[table] = table
+        if alias:
+            aliases[alias.lower()] = table
+    return aliases
+
+
+def _resolve(qualifier, column, aliases):
+    """Table owning qualifier.column, or None if it isn't a known column."""
+    column = column.lower()
+    if qualifier:
+        table = aliases.get(qualifier.lower())
+        return table if table and column in TABLES[table] else None
+    owners = [t for t in set(aliases.values()) if column in TABLES[t]]
+    return owners[0] if len(owners) == 1 else None
+
+
+def parse_usage(sql):
+    """{table: Usage} for the predicates and join keys in one SELECT."""
+    aliases = _aliases(sql)
+    usage = defaultdict(Usage)
+
+    def collect(pattern, attr):
+        for m in pattern.finditer(sql):
+            table = _resolve(m.group(1), m.group(2), aliases)
+            if table:
+                getattr(usage[table], attr).add(m.group(2).lower())
+
+    collect(_EQ_RE, "equality")
+    collect(_EQ_RHS_RE, "equality")
+    collect(_RANGE_RE, "range")
+    collect(_RANGE_RHS_RE, "range")
+    collect(_CONTAINS_RE, "contains")
+    collect(_ORDER_RE, "order")
+    for m in _JSON_KEY_RE.finditer(sql):
+        table = _resolve(m.group(1), m.group(2), aliases)
+        if table and m.group(2).lower() in JSONB_COLUMNS:
+            usage[table].json_keys.add((m.group(2).lower(), m.group(3)))
+
+    for u in usage.values():
+        u.equality -= JSONB_COLUMNS
+        u.range -= JSONB_COLUMNS
+        u.contains &= JSONB_COLUMNS
+    return dict(usage)
+
+
+def candidates(usage):
+    """CREATE INDEX statements worth trying for one query's usage."""
+    found = set()
+    for table, u in usage.items():
+        for column in u.equality | u.range:
+            found.add(f"CREATE INDEX ON {table} ({column})")
+        # Equality columns first, then one range/sort column
+        eq = sorted(u.equality)
+        for tail in sorted((u.range | u.order) - u.equality):
+            if eq:
+                found.add(f"CREATE INDEX ON {table} ({', '.join(eq + [tail])})")
+        if len(eq) > 1:
+            found.add(f"CREATE INDEX ON {table} ({', '.join(eq)})")
+        for column in u.contains:
+            found.add(f"CREATE INDEX ON {table} USING gin ({column} jsonb_path_ops)")
+        for column, key in u.json_keys:
+            found.add(f"CREATE INDEX ON {table} (({column} ->> '{key}'))")
+    return found
+
+
+def load_workload(path=None):
+    """Counter of executed SQL by normalized text (first spelling kept)."""
+    counts, spelling = Counter(), {}
+    for entry in read_log(path):
+        sql = entry.get("executed_sql") or entry.get("sql") or ""
+        if not sql.lower().lstrip().startswith("select"):
+            continue
+        key = normalize_sql(sql)
+        counts[key] += 1
+        spelling.setdefault(key, sql)
+    return {spelling[key]: n for key, n in counts.items()}
+
+
+def _cost(conn, sql):
+    return conn.execute(f"EXPLAIN (FORMAT JSON) {sql}").fetchone()[0][0]["Plan"]["Total Cost"]
+
+
+def _has_hypopg(conn):
+    try:
+        with conn.transaction():
+            conn.execute("CREATE EXTENSION IF NOT EXISTS hypopg")
+        return True
+    except psycopg.Error:
+        return False
+
+
+def evaluate(conn, workload, baseline, candidate_sql, hypothetical):
+    """(baseline, with_index) weighted costs of the workload queries that read the candidate's table."""
+    table = candidate_sql.split(" ON ", 1)[1].split()[0]
+    queries = {sql: n for sql, n in workload.items() if table in sql.lower()}
+
+    if hypothetical:
+        conn.execute("SELECT * FROM hypopg_create_index(%s)", (candidate_sql,))
+        try:
+            improved = {sql: _cost(conn, sql) for sql in queries}
+        finally:
+            conn.execute("SELECT hypopg_reset()")
+    else:
+        with conn.transaction():
+            conn.execute(candidate_sql)
+            if "((" in candidate_sql:
+                conn.execute(f"ANALYZE {table}")  # expression indexes need their own stats
+            improved = {sql: _cost(conn, sql) for sql in queries}
+            raise psycopg.Rollback()
+
+    before = sum(baseline[sql] * n for sql, n in queries.items())
+    after = sum(improved[sql] * n for sql, n in queries.items())
+    helped = sum(1 for sql in queries if improved[sql] < baseline[sql] * (1 - MIN_GAIN))
+    return before, after, helped
+
+
+def recommend(conn, workload, top=10):
+    """Ranked [(create_index_sql, speedup, cost_saved, queries_helped)]."""
+    hypothetical = _has_hypopg(conn)
+    print(
+        "Simulating candidates with HypoPG" if hypothetical
+        else "HypoPG not available: building each candidate in a rolled-back transaction"
+    )
+
+    baseline, tried = {}, set()
+    for sql in list(workload):
+        try:
+            baseline[sql] = _cost(conn, sql)
+        except psycopg.Error as e:
+            print(f"  dropped a logged query that no longer plans: {e}")
+            del workload[sql]
+            continue
+        tried |= candidates(parse_usage(sql))
+
+    ranked = []
+    for candidate_sql in sorted(tried):
+        try:
+            before, after, helped = evaluate(conn, workload, baseline, candidate_sql, hypothetical)
+        except psycopg.Error as e:
+            print(f"  skipped {candidate_sql}: {e}")
+            conn.rollback()
+            continue
+        if helped and after < before * (1 - MIN_GAIN):
+            ranked.append((candidate_sql, before / max(after, 1e-9), before - after, helped))
+
+    ranked.sort(key=lambda r: r[2], reverse=True)
+    return ranked[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend indexes from the executed-SQL log")
+    parser.add_argument("--log", help="query log path (default QUERY_LOG_PATH)")
+    parser.add_argument("--dsn", help="Postgres to replay against (default DB_URL)")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--out", help="write the CREATE INDEX statements to this file")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    workload = load_workload(args.log)
+    if not workload:
+        print("No logged SELECT statements to analyse.")
+        return
+    print(f"{len(workload):,} distinct queries, {sum(workload.values()):,} executions")
+
+    with psycopg.connect(args.dsn or os.getenv("DB_URL"), autocommit=True) as conn:
+        ranked = recommend(conn, workload, top=args.top)
+
+    if not ranked:
+        print("No index improves the logged workload.")
+        return
+
+    print(f"\n{'speedup':>8}  {'cost saved':>14}  {'queries':>7}  index")
+    for candidate_sql, speedup, saved, helped in ranked:
+        print(f"{speedup:>7.1f}x  {saved:>14,.0f}  {helped:>7}  {candidate_sql};")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for candidate_sql, speedup, saved, helped in ranked:
+                f.write(f"-- est. {speedup:.1f}x on {helped} logged queries\n{candidate_sql};\n")
+        print(f"\nWrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
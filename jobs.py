@@ -0,0 +1,283 @@
+# jobs.py
+"""
+Process-wide scheduler for query jobs (SQL fetches, funnel computations).
+
+- A fixed pool of worker threads runs jobs, so a burst of sessions can't
+  open more concurrent scans than QUERY_WORKERS.
+- Pending jobs are queued per session and picked round-robin across
+  sessions, so one analyst's backlog doesn't starve everyone else.
+- The queue is bounded (QUERY_QUEUE_MAX); beyond it submit() raises QueueFull.
+- Identical jobs (same key) submitted while one is queued or running attach
+  to it instead of running again; every session reads the same chunks.
+- A job is cancelled once no session is waiting on it any more (new
+  question, reset, or the session's script run being interrupted).
+"""
+import os
+import threading
+from collections import OrderedDict, deque
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from columnar import concat_chunks
+
+WORKERS = int(os.getenv("QUERY_WORKERS", 4))
+MAX_QUEUE = int(os.getenv("QUERY_QUEUE_MAX", 64))
+# Seconds between on_wait callbacks while a session waits for chunks
+POLL_INTERVAL = 0.25
+
+
+class QueueFull(RuntimeError):
+    """Too many queued jobs; the caller should retry later."""
+
+
+class JobCancelled(RuntimeError):
+    """The job was cancelled before it finished."""
+
+
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+
+class Job:
+    """
+    One unit of work and the chunks it produced. source is either an
+    iterable of DataFrame chunks (e.g. ChunkedResult) or a callable that
+    returns a single DataFrame.
+    """
+
+    def __init__(self, key, source):
+        self.key = key
+        self.source = source
+        self.subscribers = set()
+        self.chunks = []
+        self.state = "queued"  # queued | running | done
+        self.cancelled = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def run(self):
+        try:
+            if callable(self.source):
+                self._publish(self.source())
+            else:
+                chunks = iter(self.source)
+                try:
+                    for chunk in chunks:
+                        if self.cancelled:
+                            break
+                        self._publish(chunk)
+                finally:
+                    if hasattr(chunks, "close"):
+                        chunks.close()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.cond:
+                self.state = "done"
+                self.cond.notify_all()
+
+    def _publish(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+
+class JobHandle:
+    """
+    A session's view of a Job, with the same interface as ChunkedResult:
+    iterate for chunks as they arrive, then frame() for everything.
+    """
+
+    def __init__(self, job, session_id, scheduler, shared=False):
+        self.job = job
+        self.session_id = session_id
+        self.scheduler = scheduler
+        self.shared = shared  # attached to another session's in-flight job
+
+    @property
+    def truncated(self):
+        return bool(getattr(self.job.source, "truncated", False))
+
+    @property
+    def rows(self):
+        return sum(len(chunk) for chunk in self.job.chunks)
+
+    @property
+    def bytes(self):
+        return getattr(self.job.source, "bytes", 0)
+
+    @property
+    def engine(self):
+        return getattr(self.job.source, "engine", None)
+
+    @property
+    def state(self):
+        return self.job.state
+
+    def iter_chunks(self, on_wait=None):
+        """
+        Yield chunks as the job publishes them. on_wait(handle) is called
+        every POLL_INTERVAL while nothing new has arrived.
+        """
+        job = self.job
+        seen = 0
+        finished = False
+        try:
+            while True:
+                with job.cond:
+                    job.cond.wait_for(
+                        lambda: len(job.chunks) > seen or job.state == "done" or job.cancelled,
+                        timeout=POLL_INTERVAL,
+                    )
+                    ready = job.chunks[seen:]
+                    done = job.state == "done"
+                for chunk in ready:
+                    seen += 1
+                    yield chunk
+                if job.cancelled:
+                    raise JobCancelled("Query cancelled")
+                if done and seen == len(job.chunks):
+                    if job.error is not None:
+                        raise job.error
+                    finished = True
+                    return
+                if not ready and on_wait:
+                    on_wait(self)
+        finally:
+            if not finished:
+                self.scheduler.detach(self)
+
+    def __iter__(self):
+        return self.iter_chunks()
+
+    def frame(self):
+        df = concat_chunks(self.job.chunks)
+        df.attrs["truncated"] = self.truncated
+        return df
+
+
+def iter_result(result, on_wait=None):
+    """Chunks of any result type; on_wait only applies to scheduled jobs."""
+    if isinstance(result, JobHandle):
+        return result.iter_chunks(on_wait)
+    return iter(result)
+
+
+class QueryScheduler:
+    def __init__(self, workers=WORKERS, max_queue=MAX_QUEUE):
+        self.max_queue = max_queue
+        self._queues = OrderedDict()  # session -> deque of queued jobs
+        self._inflight = {}  # key -> queued or running job
+        self._cond = threading.Condition()
+        self._queued = 0
+        self._running = 0
+        self.counters = {"submitted": 0, "deduplicated": 0, "cancelled": 0, "rejected": 0}
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"query-worker-{i}", daemon=True).start()
+
+    def submit(self, session_id, key, source):
+        with self._cond:
+            job = self._inflight.get(key)
+            if job is not None and not job.cancelled:
+                job.subscribers.add(session_id)
+                self.counters["deduplicated"] += 1
+                return JobHandle(job, session_id, self, shared=True)
+
+            if self._queued >= self.max_queue:
+                self.counters["rejected"] += 1
+                raise QueueFull(
+                    f"The server is busy ({self._queued} queries queued). Please retry shortly."
+                )
+
+            job = Job(key, source)
+            job.subscribers.add(session_id)
+            self._inflight[key] = job
+            self._queues.setdefault(session_id, deque()).append(job)
+            self._queued += 1
+            self.counters["submitted"] += 1
+            self._cond.notify()
+            return JobHandle(job, session_id, self)
+
+    def _next_job(self):
+        """Pop the head job of the least recently served session (caller holds the lock)."""
+        session_id, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        self._queued -= 1
+        if queue:
+            self._queues.move_to_end(session_id)
+        else:
+            del self._queues[session_id]
+        return job
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queues)
+                job = self._next_job()
+                job.state = "running"
+                self._running += 1
+            try:
+                job.run()
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    if self._inflight.get(job.key) is job:
+                        del self._inflight[job.key]
+
+    def detach(self, handle):
+        """Stop waiting on a job; it is cancelled once nobody waits on it."""
+        with self._cond:
+            abandoned = self._detach(handle.job, handle.session_id)
+        self._abort(abandoned)
+
+    @staticmethod
+    def _abort(jobs):
+        # Outside the scheduler lock: a Postgres cancel is a network round trip
+        for job in jobs:
+            cancel = getattr(job.source, "cancel", None)
+            if cancel is not None:
+                cancel("abandoned by every session waiting on it")
+
+    def _detach(self, job, session_id):
+        """Returns the jobs that must be aborted (caller holds the lock)."""
+        job.subscribers.discard(session_id)
+        if job.subscribers or job.state == "done" or job.cancelled:
+            return []
+        with job.cond:
+            job.cancelled = True
+            job.cond.notify_all()
+        self.counters["cancelled"] += 1
+        if self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+        for owner, queue in list(self._queues.items()):
+            if job in queue:
+                queue.remove(job)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[owner]
+        return [job] if job.state == "running" else []
+
+    def cancel_session(self, session_id):
+        """Detach a session from everything it is waiting on (new question or reset)."""
+        abandoned = []
+        with self._cond:
+            for job in list(self._inflight.values()):
+                if session_id in job.subscribers:
+                    abandoned += self._detach(job, session_id)
+        self._abort(abandoned)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "running": self._running,
+                "queued": self._queued,
+                "sessions_queued": len(self._queues),
+                **self.counters,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def get_scheduler():
+    return QueryScheduler()
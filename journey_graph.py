@@ -0,0 +1,239 @@
+# journey_graph.py
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from db import connection
+
+# Field names tried (in order) when reading nodedatarray / linkdatarray entries
+_NODE_KEY_FIELDS = ("key", "id", "nid", "nodeId")
+_NODE_LABEL_FIELDS = ("text", "name", "label", "title", "category")
+_NODE_TYPE_FIELDS = ("category", "type", "nodeType")
+_LINK_FROM_FIELDS = ("from", "source", "fromNode")
+_LINK_TO_FIELDS = ("to", "target", "toNode")
+
+
+def _first(entry, fields, default=None):
+    for field in fields:
+        if entry.get(field) not in (None, ""):
+            return entry[field]
+    return default
+
+
+def _as_list(value):
+    if isinstance(value, str):
+        value = json.loads(value)
+    if isinstance(value, dict):
+        # Some exports wrap the array, e.g. {"nodeDataArray": [...]}
+        value = next((v for v in value.values() if isinstance(v, list)), [])
+    return value or []
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class JourneyGraph:
+    """
+    Parsed journey graph in compact form: node ids, labels and types in
+    parallel arrays, links as CSR adjacency (offsets/targets index arrays),
+    so lookups and traversals never touch the raw JSON again.
+    """
+
+    def __init__(self, aid, name, updated_date, node_ids, labels, node_types, edges):
+        self.aid = aid
+        self.name = name
+        self.updated_date = updated_date
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.labels = labels
+        self.node_types = node_types
+        self.index = {int(nid): i for i, nid in enumerate(self.node_ids)}
+
+        src = np.fromiter((self.index[a] for a, _ in edges), dtype=np.int32, count=len(edges))
+        dst = np.fromiter((self.index[b] for _, b in edges), dtype=np.int32, count=len(edges))
+        self.offsets, self.targets = self._csr(src, dst, len(self.node_ids))
+        self._reverse = None
+
+    @staticmethod
+    def _csr(src, dst, n):
+        order = np.argsort(src, kind="stable")
+        counts = np.bincount(src, minlength=n)
+        offsets = np.zeros(n + 1, dtype=np.int32)
+        np.cumsum(counts, out=offsets[1:])
+        return offsets, dst[order]
+
+    @classmethod
+    def parse(cls, aid, name, updated_date, nodedatarray, linkdatarray):
+        node_ids, labels, node_types = [], [], []
+        known = set()
+        for entry in _as_list(nodedatarray):
+            nid = _to_int(_first(entry, _NODE_KEY_FIELDS))
+            if nid is not None and nid not in known:
+                known.add(nid)
+                node_ids.append(nid)
+                labels.append(str(_first(entry, _NODE_LABEL_FIELDS, nid)))
+                node_types.append(_first(entry, _NODE_TYPE_FIELDS))
+
+        edges = []
+        for entry in _as_list(linkdatarray):
+            src = _to_int(_first(entry, _LINK_FROM_FIELDS))
+            dst = _to_int(_first(entry, _LINK_TO_FIELDS))
+            if src in known and dst in known:
+                edges.append((src, dst))
+
+        return cls(aid, name, updated_date, node_ids, labels, node_types, edges)
+
+    @property
+    def nbytes(self):
+        arrays = self.node_ids.nbytes + self.offsets.nbytes + self.targets.nbytes
+        strings = sum(sys.getsizeof(label) for label in self.labels)
+        # Index dict: roughly 100 bytes per entry
+        return arrays + strings + 100 * len(self.index)
+
+    def successors(self, nid):
+        i = self.index[nid]
+        return self.node_ids[self.targets[self.offsets[i]:self.offsets[i + 1]]]
+
+    def predecessors(self, nid):
+        if self._reverse is None:
+            counts = np.diff(self.offsets)
+            src = np.repeat(np.arange(len(self.node_ids), dtype=np.int32), counts)
+            self._reverse = self._csr(self.targets, src, len(self.node_ids))
+        offsets, targets = self._reverse
+        i = self.index[nid]
+        return self.node_ids[targets[offsets[i]:offsets[i + 1]]]
+
+    def roots(self):
+        """Entry nodes (no incoming links)."""
+        has_incoming = np.zeros(len(self.node_ids), dtype=bool)
+        has_incoming[self.targets] = True
+        return self.node_ids[~has_incoming]
+
+    def reachable(self, start):
+        """Node ids reachable from `start`, in BFS order."""
+        seen = np.zeros(len(self.node_ids), dtype=bool)
+        queue = deque([self.index[start]])
+        seen[queue[0]] = True
+        order = []
+        while queue:
+            i = queue.popleft()
+            order.append(i)
+            for j in self.targets[self.offsets[i]:self.offsets[i + 1]]:
+                if not seen[j]:
+                    seen[j] = True
+                    queue.append(j)
+        return self.node_ids[order]
+
+    def nodes_frame(self) -> pd.DataFrame:
+        counts = np.diff(self.offsets)
+        return pd.DataFrame({
+            "nid": self.node_ids,
+            "label": self.labels,
+            "node_type": self.node_types,
+            "out_links": counts,
+        })
+
+    def links_frame(self) -> pd.DataFrame:
+        src = np.repeat(np.arange(len(self.node_ids)), np.diff(self.offsets))
+        return pd.DataFrame({
+            "from_nid": self.node_ids[src],
+            "to_nid": self.node_ids[self.targets],
+        })
+
+
+class JourneyGraphCache:
+    """
+    LRU cache of parsed journey graphs keyed by papi_automation.id, bounded
+    by estimated memory. A cached graph is re-validated against
+    updated_date at most once per `revalidate` seconds and re-parsed only
+    when the row changed.
+    """
+
+    def __init__(self, max_bytes, revalidate):
+        self.max_bytes = max_bytes
+        self.revalidate = revalidate
+        self.hits = 0
+        self.misses = 0
+        self._graphs = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, aid) -> JourneyGraph:
+        with self._lock:
+            cached = self._graphs.get(aid)
+            if cached is not None:
+                self._graphs.move_to_end(aid)
+                graph, checked_at = cached
+                if time.monotonic() - checked_at < self.revalidate:
+                    self.hits += 1
+                    return graph
+
+        if cached is not None:
+            with connection() as conn:
+                row = conn.execute(
+                    "SELECT updated_date FROM papi_automation WHERE id = %s", (aid,)
+                ).fetchone()
+            if row is not None and row[0] == graph.updated_date:
+                self._store(aid, graph)
+                self.hits += 1
+                return graph
+
+        self.misses += 1
+        graph = self._load(aid)
+        self._store(aid, graph)
+        return graph
+
+    def _load(self, aid):
+        with connection() as conn:
+            row = conn.execute(
+                """
+                SELECT name, updated_date, nodedatarray, linkdatarray
+                FROM papi_automation WHERE id = %s
+                """,
+                (aid,),
+            ).fetchone()
+        if row is None:
+            raise ValueError(f"No journey found in papi_automation for id={aid}")
+        return JourneyGraph.parse(aid, *row)
+
+    def _store(self, aid, graph):
+        with self._lock:
+            previous = self._graphs.pop(aid, None)
+            if previous is not None:
+                self._bytes -= previous[0].nbytes
+            self._graphs[aid] = (graph, time.monotonic())
+            self._bytes += graph.nbytes
+            while len(self._graphs) > 1 and self._bytes > self.max_bytes:
+                _, (evicted, _) = self._graphs.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "graphs": len(self._graphs),
+                "bytes": self._bytes,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def get_graph_cache():
+    return JourneyGraphCache(
+        max_bytes=int(os.getenv("GRAPH_CACHE_MAX_MB", 64)) * 1024 * 1024,
+        revalidate=float(os.getenv("GRAPH_CACHE_REVALIDATE", 30)),
+    )
+
+
+def get_graph(aid) -> JourneyGraph:
+    return get_graph_cache().get(aid)
@@ -1,7 +1,19 @@
 # llm.py
 from google import genai
+from google.genai import types
 import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+from llm_cache import cache_key, get_llm_cache
+from context import TOKEN_BUDGET, compact_rows, compress_history, conversation_tokens, recent_messages
+from rollups import rollup_prompt
+from replica import replica_prompt
+from schema_catalog import schema_prompt
+from tracing import current_span, set_attributes, span
+from cancellation import LLM_DEADLINE, CancelToken
+
+MODEL = "gemini-2.5-flash"
 
 def get_client():
     api_key = os.getenv("GEMINI_API_KEY")
@@ -9,22 +21,179 @@ def get_client():
         raise ValueError("GEMINI_API_KEY not found in environment")
     return genai.Client(api_key=api_key)
 
-def generate_sql():
+def _request_config(token=None):
+    """Per-request HTTP timeout: LLM_DEADLINE_S, or less if the token's deadline is sooner."""
+    timeout = LLM_DEADLINE or None
+    remaining = token.remaining() if token else None
+    if remaining is not None:
+        timeout = min(timeout, remaining) if timeout else remaining
+    if not timeout:
+        return None
+    return types.GenerateContentConfig(
+        http_options=types.HttpOptions(timeout=max(1, int(timeout * 1000)))
+    )
+
+def _generate(conversation, use_cache=True, token=None):
+    """
+    Single Gemini call, served from the on-disk LLM cache when the exact
+    same model + conversation was answered before.
+    """
+    cache = get_llm_cache()
+    key = cache_key(MODEL, conversation)
+
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            set_attributes(llm_cache_hit=True)
+            return cached
+
+    if token:
+        token.raise_if_cancelled()
     client = get_client()   # ✅ created AFTER dotenv is loaded
+    response = client.models.generate_content(
+        model=MODEL,
+        contents=conversation,
+        config=_request_config(token),
+    )
+    if token:
+        token.raise_if_cancelled()
+    text = response.text.strip()
+    _record_usage(response)
 
-    system_prompt = f"""
+    if use_cache:
+        cache.put(key, MODEL, text)
+    return text
+
+def _generate_stream(conversation, use_cache=True, is_complete=None, token=None):
+    """
+    Streaming counterpart of _generate: yields text as Gemini produces it.
+    is_complete(text) may return a cut-off index to stop the stream early.
+    The HTTP stream is closed as soon as the consumer stops reading or the
+    token is cancelled.
+    """
+    cache = get_llm_cache()
+    key = cache_key(MODEL, conversation)
+
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            set_attributes(llm_cache_hit=True)
+            yield cached
+            return
+
+    if token:
+        token.raise_if_cancelled()
+    client = get_client()
+    stream = client.models.generate_content_stream(
+        model=MODEL,
+        contents=conversation,
+        config=_request_config(token),
+    )
+
+    text = ""
+    try:
+        for chunk in stream:
+            if token:
+                token.raise_if_cancelled()
+            _record_usage(chunk)
+            piece = chunk.text or ""
+            cut = is_complete(text + piece) if is_complete else None
+            if cut is not None:
+                piece = (text + piece)[len(text):cut]
+                text += piece
+                yield piece
+                break
+            text += piece
+            yield piece
+    finally:
+        if hasattr(stream, "close"):
+            stream.close()
+
+    if use_cache:
+        cache.put(key, MODEL, text.strip())
+
+def _record_usage(response):
+    """Copy Gemini's token counts onto the current span (streams report them on the last chunk)."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None and usage.prompt_token_count:
+        set_attributes(
+            llm_cache_hit=False,
+            prompt_tokens=usage.prompt_token_count,
+            response_tokens=usage.candidates_token_count,
+        )
+
+def _select_end(text):
+    """
+    Index where the first complete SELECT in a streamed response ends
+    (a statement terminator or a closing code fence), or None.
+    """
+    in_quote = False
+    for i, ch in enumerate(text):
+        if ch == "'":
+            in_quote = not in_quote
+        elif ch == ";" and not in_quote:
+            return i
+    start = text.find("```")
+    if start != -1:
+        end = text.find("```", start + 3)
+        if end != -1:
+            return end + 3
+    return None
+
+def clean_sql(text):
+    """Strip code fences and a trailing semicolon from model output."""
+    sql = text.strip()
+    if sql.startswith("```"):
+        sql = sql.split("\n", 1)[1] if "\n" in sql else ""
+    sql = sql.replace("```", "").strip()
+    return sql.rstrip(";").strip()
+
+def _last_result_shape(summary):
+    """Row count and columns only: the sample rows are in the latest QUERY HISTORY entry."""
+    if not summary:
+        return summary
+    return {"row_count": summary.get("row_count"), "columns": summary.get("columns")}
+
+def _sql_conversation(feedback=None):
+    rollups = rollup_prompt()
+    replica = replica_prompt()
+    schema = schema_prompt()
+
+    conversation = [{"role": "user", "parts": [{"text": ""}]}]
+    for msg in recent_messages(st.session_state.messages):
+        role = "model" if msg["role"] == "assistant" else "user"
+        conversation.append(
+            {"role": role, "parts": [{"text": msg["content"]}]}
+        )
+
+    # e.g. why the previous attempt was rejected, so the model can narrow it
+    if feedback:
+        conversation.append({"role": "user", "parts": [{"text": feedback}]})
+
+    # The budget covers the whole prompt; the query history gets what's left
+    conversation[0]["parts"][0]["text"] = _sql_system_prompt(schema, rollups, replica, history=[])
+    history_budget = TOKEN_BUDGET - conversation_tokens(conversation)
+    conversation[0]["parts"][0]["text"] = _sql_system_prompt(
+        schema, rollups, replica, compress_history(st.session_state.query_history, budget=history_budget)
+    )
+
+    _record_prompt_tokens("generate_sql", conversation)
+    return conversation
+
+def _sql_system_prompt(schema, rollups, replica, history):
+    return f"""
 You are a PostgreSQL SQL generator.
 
 You have conversational and analytical memory.
 
-QUERY HISTORY (ordered oldest → newest):
-{st.session_state.query_history}
+QUERY HISTORY (ordered oldest → newest; older turns are summarized):
+{history}
 
 LAST SQL QUERY (shortcut):
 {st.session_state.last_sql}
 
 LAST QUERY RESULT SUMMARY:
-{st.session_state.last_result_summary}
+{_last_result_shape(st.session_state.last_result_summary)}
 
 INSTRUCTIONS:
 - If the user explicitly refers to:
@@ -38,57 +207,37 @@ INSTRUCTIONS:
 
 STRICT RULES:
 - Output ONLY a single PostgreSQL SELECT query
-- Query ONLY the tables: journey_xray, papi_automation
-
-- Columns of journey_xray table:
-    aid: bigint
-    channel: text
-    cid: bigint
-    glreqid: text
-    nid: bigint
-    ts: timestamp without time zone
-    uid: bigint
-
-- Columns of papi_automation table:
-    id: bigint
-    name: text
-    created_date: timestamp without time zone
-    from_date: timestamp without time zone
-    to_date: timestamp without time zone
-    updated_date: timestamp without time zone
-    journey_xray_enabled: bigint
-    lp_content_parsed: jsonb
-    linkdatarray: jsonb
-    nodedatarray: jsonb
+- Query ONLY the tables: journey_xray, papi_automation{", journey_xray_rollup" if rollups else ""}{", journey_nodes, journey_links" if replica else ""}
 
+{schema}{rollups}{replica}
 - NO markdown
 - NO explanations
 - NO comments
 - NO semicolon
 """
 
-    conversation = [{"role": "user", "parts": [{"text": system_prompt}]}]
+def _record_prompt_tokens(call, conversation):
+    tokens = conversation_tokens(conversation)
+    # Latest estimate per call only, so the session doesn't grow with every turn
+    st.session_state.prompt_tokens[call] = tokens
+    set_attributes(**{f"{call}_prompt_tokens_est": tokens})
+    return tokens
 
-    for msg in st.session_state.messages:
-        role = "model" if msg["role"] == "assistant" else "user"
-        conversation.append(
-            {"role": role, "parts": [{"text": msg["content"]}]}
-        )
+def generate_sql(use_cache=True, feedback=None, token=None):
+    return _generate(_sql_conversation(feedback), use_cache=use_cache, token=token)
 
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=conversation,
+def generate_sql_stream(use_cache=True, feedback=None, token=None):
+    """
+    Streams the generated SQL token by token. The stream is cut off as soon
+    as a complete SELECT has been emitted; pass the joined text to clean_sql().
+    """
+    return _generate_stream(
+        _sql_conversation(feedback), use_cache=use_cache, is_complete=_select_end, token=token
     )
-    return response.text.strip()
 
 
 # Explaing the sql result function
-def explain_result(user_question, sql, result_summary):
-    """
-    Uses Gemini to generate a plain-English explanation of the query result.
-    """
-    client = get_client()
-
+def _explain_conversation(user_question, sql, result_summary):
     system_prompt = f"""
 You are a data analyst explaining query results to a non-technical user.
 
@@ -101,7 +250,7 @@ Executed SQL:
 Query Result Summary:
 - Rows returned: {result_summary['row_count']}
 - Columns: {result_summary['columns']}
-- Sample rows: {result_summary['sample_rows']}
+- Sample rows: {compact_rows(result_summary['sample_rows'])}
 
 Explain:
 - What this result represents
@@ -116,11 +265,76 @@ Rules:
 """
 
     # Convert conversation history for Gemini
-    conversation = [{"role": "user", "parts": [{"text": system_prompt}]}]
+    return [{"role": "user", "parts": [{"text": system_prompt}]}]
 
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=conversation,
+def explain_result(user_question, sql, result_summary, use_cache=True, token=None):
+    """
+    Uses Gemini to generate a plain-English explanation of the query result.
+    """
+    conversation = _explain_conversation(user_question, sql, result_summary)
+    return _generate(conversation, use_cache=use_cache, token=token)
+
+def explain_result_stream(user_question, sql, result_summary, use_cache=True, token=None):
+    """Streaming variant of explain_result; yields text as it arrives."""
+    conversation = _explain_conversation(user_question, sql, result_summary)
+    return _generate_stream(conversation, use_cache=use_cache, token=token)
+
+
+@st.cache_resource(show_spinner=False)
+def _get_explain_executor():
+    return ThreadPoolExecutor(
+        max_workers=int(os.getenv("EXPLAIN_WORKERS", 4)),
+        thread_name_prefix="explain",
     )
 
-    return response.text.strip()
+
+def explain_result_stream_async(user_question, sql, result_summary, use_cache=True, token=None):
+    """
+    Streams the explanation from a background thread. Returns a generator
+    that yields tokens on the caller's thread as they arrive. If the caller
+    stops reading (or the token is cancelled) the background stream is
+    aborted too.
+    """
+    token = token.child(LLM_DEADLINE, "explanation") if token else CancelToken(LLM_DEADLINE, "explanation")
+    _record_prompt_tokens(
+        "explain_result",
+        _explain_conversation(user_question, sql, result_summary),
+    )
+    tokens = queue.Queue()
+    parent = current_span()
+
+    def worker():
+        try:
+            with span("gemini.explain_stream", parent=parent):
+                for piece in explain_result_stream(
+                    user_question, sql, result_summary, use_cache, token
+                ):
+                    tokens.put(piece)
+        except Exception as e:
+            tokens.put(e)
+        finally:
+            tokens.put(None)
+
+    _get_explain_executor().submit(worker)
+
+    def consume():
+        finished = False
+        try:
+            while True:
+                try:
+                    item = tokens.get(timeout=0.5)
+                except queue.Empty:
+                    token.raise_if_cancelled()
+                    continue
+                if item is None:
+                    finished = True
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            if not finished:
+                token.cancel("explanation abandoned")
+            token.close()
+
+    return consume()
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+
+NEON_MCP_URL = "https://mcp.neon.tech/sse"
+
+
+class _PooledSession:
+    """One MCP session, owned by a dedicated task.
+
+    The SSE client and ClientSession are anyio context managers that must be
+    entered and exited from the same task, so each session lives inside its
+    own long-running task and is torn down by signalling that task.
+    """
+
+    def __init__(self, url: str, headers: Dict[str, str]):
+        self.url = url
+        self.headers = headers
+        self.session: Optional[ClientSession] = None
+        self.error: Optional[BaseException] = None
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, timeout: float):
+        self._task = asyncio.create_task(self._run())
+        await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+        if self.session is None:
+            raise ConnectionError(str(self.error) or "MCP connect failed")
+
+    async def _run(self):
+        try:
+            async with sse_client(self.url, headers=self.headers) as streams:
+                async with ClientSession(streams[0], streams[1]) as session:
+                    await session.initialize()
+                    self.session = session
+                    self._ready.set()
+                    await self._closing.wait()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.session = None
+            self._ready.set()
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def close(self):
+        self._closing.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout=5)
+            except Exception:
+                self._task.cancel()
+
+
+class NeonSessionPool:
+    """Warm, self-healing pool of Neon MCP sessions with a cached tool list"""
+
+    def __init__(self, neon_api_key: str, url: str = NEON_MCP_URL, size: int = 2,
+                 tools_ttl: float = 600.0, health_interval: float = 30.0,
+                 connect_timeout: float = 20.0, max_retries: int = 5, max_backoff: float = 30.0):
+        self.url = url
+        self.headers = {"Authorization": f"Bearer {neon_api_key}"}
+        self.size = size
+        self.tools_ttl = tools_ttl
+        self.health_interval = health_interval
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+
+        self.tools_version = 0  # Bumped whenever the tool list is refreshed
+        self._slots: List[Optional[_PooledSession]] = [None] * size
+        self._locks = [asyncio.Lock() for _ in range(size)]
+        self._next = 0
+        self._tools: Optional[List[Any]] = None
+        self._tools_fetched_at = 0.0
+        self._tools_lock = asyncio.Lock()
+        self._health_task: Optional[asyncio.Task] = None
+        self.stats = {"connects": 0, "reconnects": 0, "failed_probes": 0, "tool_list_fetches": 0}
+
+    async def start(self):
+        """Open all sessions up front and start the background health probe"""
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+        await asyncio.gather(*(self._ensure(i) for i in range(self.size)))
+
+    async def _ensure(self, index: int) -> ClientSession:
+        """Return a live session for this slot, reconnecting with exponential backoff"""
+        async with self._locks[index]:
+            slot = self._slots[index]
+            if slot is not None and slot.alive:
+                return slot.session
+
+            if slot is not None:
+                await slot.close()
+                self.stats["reconnects"] += 1
+
+            delay = 0.5
+            for attempt in range(self.max_retries):
+                slot = _PooledSession(self.url, self.headers)
+                try:
+                    await slot.start(self.connect_timeout)
+                    self._slots[index] = slot
+                    self.stats["connects"] += 1
+                    return slot.session
+                except Exception as e:
+                    await slot.close()
+                    if attempt == self.max_retries - 1:
+                        raise ConnectionError(
+                            f"Could not connect to Neon MCP after {self.max_retries} attempts: {e}"
+                        ) from e
+                    print(f"⚠️  MCP connect failed ({e}); retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_backoff)
+
+    async def session(self) -> ClientSession:
+        """Next live session (round-robin)"""
+        index = self._next
+        self._next = (self._next + 1) % self.size
+        return await self._ensure(index)
+
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Any:
+        """Call a tool, retrying once on a fresh session if the connection dropped"""
+        session = await self.session()
+        try:
+            return await session.call_tool(tool_name, arguments=arguments)
+        except Exception:
+            if any(slot is not None and slot.session is session and slot.alive for slot in self._slots):
+                raise  # Session is still healthy: a genuine tool error
+            session = await self.session()
+            return await session.call_tool(tool_name, arguments=arguments)
+
+    async def list_tools(self) -> Tuple[List[Any], int]:
+        """MCP tool list, cached for tools_ttl seconds. Returns (tools, version)"""
+        async with self._tools_lock:
+            if self._tools is None or time.monotonic() - self._tools_fetched_at > self.tools_ttl:
+                session = await self.session()
+                response = await session.list_tools()
+                self._tools = response.tools
+                self._tools_fetched_at = time.monotonic()
+                self.tools_version += 1
+                self.stats["tool_list_fetches"] += 1
+            return self._tools, self.tools_version
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for index, slot in enumerate(self._slots):
+                if slot is not None and slot.alive:
+                    try:
+                        await asyncio.wait_for(slot.session.send_ping(), timeout=5)
+                        continue
+                    except Exception:
+                        self.stats["failed_probes"] += 1
+                        await slot.close()
+                try:
+                    await self._ensure(index)
+                except Exception as e:
+                    print(f"⚠️  MCP health probe could not reconnect slot {index}: {e}")
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        await asyncio.gather(
+            *(slot.close() for slot in self._slots if slot is not None)
+        )
+        self._slots = [None] * self.size
+
+
+# One pool per (API key, event loop): MCP sessions are bound to the loop that opened them
+_pools: Dict[Tuple[str, int], NeonSessionPool] = {}
+
+
+async def get_session_pool(neon_api_key: str, **kwargs) -> NeonSessionPool:
+    """Process-wide warm session pool for this Neon API key"""
+    key = (neon_api_key, id(asyncio.get_running_loop()))
+    pool = _pools.get(key)
+    if pool is None:
+        pool = NeonSessionPool(neon_api_key, **kwargs)
+        _pools[key] = pool
+        await pool.start()
+    return pool
+
+
+async def close_session_pools():
+    """Close every pool opened on the running event loop"""
+    loop_id = id(asyncio.get_running_loop())
+    for key in [k for k in _pools if k[1] == loop_id]:
+        await _pools.pop(key).close()
@@ -0,0 +1,81 @@
+# plan_guard.py
+import os
+
+from db import MAX_ROWS, apply_statement_timeout, connection
+
+# Planner cost units; a full scan of a large journey_xray is in the millions
+MAX_COST = float(os.getenv("PLAN_MAX_COST", 5_000_000))
+# Estimated result rows above which a LIMIT is injected
+MAX_PLAN_ROWS = int(os.getenv("PLAN_MAX_ROWS", MAX_ROWS))
+
+
+class PlanRejected(Exception):
+    """The planner estimates the query is too expensive to run."""
+
+    def __init__(self, message, plan):
+        super().__init__(message)
+        self.plan = plan
+
+
+class PlanCheck:
+    def __init__(self, sql, plan, rewritten_from=None, params=None, max_rows=None):
+        self.sql = sql
+        self.params = params
+        self.plan = plan
+        self.rewritten_from = rewritten_from
+        self.max_rows = max_rows  # the injected LIMIT, if any
+
+    @property
+    def cost(self):
+        return self.plan["Total Cost"]
+
+    @property
+    def rows(self):
+        return self.plan["Plan Rows"]
+
+    def capped(self, row_count):
+        """True when a result of row_count rows may have been cut by the injected LIMIT."""
+        return self.rewritten_from is not None and row_count >= self.max_rows
+
+    def describe(self):
+        text = (
+            f"Plan: est. cost {self.cost:,.0f} (limit {MAX_COST:,.0f}), "
+            f"est. rows {self.rows:,}, top node {self.plan['Node Type']}"
+        )
+        if self.rewritten_from:
+            text += f" · LIMIT {self.max_rows:,} injected"
+        return text
+
+
+def explain(sql, params=None):
+    """Top plan node of EXPLAIN (FORMAT JSON) for a SELECT (not executed)."""
+    with connection() as conn:
+        apply_statement_timeout(conn)
+        return conn.execute(f"EXPLAIN (FORMAT JSON) {sql}", params).fetchone()[0][0]["Plan"]
+
+
+def check_plan(sql, max_cost=None, max_rows=None, params=None):
+    """
+    EXPLAIN the query before running it. Queries estimated to return more
+    than max_rows rows are wrapped in a LIMIT; if the estimated cost is still
+    above max_cost the query is rejected with PlanRejected. A result that
+    fills the injected LIMIT is incomplete: see PlanCheck.capped().
+    """
+    max_cost = max_cost or MAX_COST
+    max_rows = max_rows or MAX_PLAN_ROWS
+
+    check = PlanCheck(sql, explain(sql, params), params=params)
+
+    if check.rows > max_rows:
+        limited = f"SELECT * FROM ({sql}) AS guarded LIMIT {max_rows}"
+        check = PlanCheck(
+            limited, explain(limited, params), rewritten_from=sql, params=params, max_rows=max_rows
+        )
+
+    if check.cost > max_cost:
+        raise PlanRejected(
+            f"Query rejected: estimated cost {check.cost:,.0f} exceeds {max_cost:,.0f} "
+            f"(est. rows {check.rows:,})",
+            check.plan,
+        )
+    return check
@@ -0,0 +1,46 @@
+# query_log.py
+"""
+Append-only JSONL log of the SQL the app actually executed, shared across
+sessions and restarts. Read offline by index_advisor.py.
+"""
+import json
+import os
+import threading
+import time
+
+# Set QUERY_LOG_PATH= (empty) to disable logging
+LOG_PATH = os.getenv("QUERY_LOG_PATH", ".query_log.jsonl")
+
+_lock = threading.Lock()
+
+
+def log_query(sql, executed_sql=None, elapsed_ms=None, rows=None, source="llm"):
+    if not LOG_PATH:
+        return
+    entry = {
+        "ts": time.time(),
+        "source": source,
+        "sql": sql,
+        "executed_sql": executed_sql or sql,
+        "elapsed_ms": round(elapsed_ms, 1) if elapsed_ms is not None else None,
+        "rows": rows,
+    }
+    line = json.dumps(entry, default=str) + "\n"
+    try:
+        with _lock, open(LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError:
+        pass  # logging must never break a query
+
+
+def read_log(path=None):
+    """Yield logged entries, skipping lines that fail to parse."""
+    path = path or LOG_PATH
+    if not path or not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
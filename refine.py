@@ -0,0 +1,767 @@
+# refine.py
+"""
+Answer refinement questions ("only …", "filter …", "sort …") from the
+previous result held in memory instead of re-running the query.
+
+A refined query is evaluated locally only when it is provably a filter,
+sort, LIMIT or column subset of the previous one, in one of two shapes:
+
+- the previous query with extra WHERE conjuncts / a new ORDER BY / LIMIT
+  and a subset of its select list (same FROM, GROUP BY and HAVING), or
+- SELECT … FROM (<previous query>) AS t WHERE … ORDER BY … LIMIT …
+
+Extra conditions may only reference columns that are selected as-is (and,
+for grouped queries, are GROUP BY keys), so filtering output rows is the
+same as filtering input rows. Supported conditions: comparisons, IN,
+BETWEEN, IS [NOT] NULL and [I]LIKE against literals, combined with
+AND/OR/NOT under SQL's three-valued logic. Text is only compared for
+(in)equality and never sorted here, since Postgres' collation may order it
+differently. Anything else falls back to the database.
+"""
+import operator
+import re
+
+import numpy as np
+import pandas as pd
+
+from result_cache import sql_tokens
+
+
+class Unsupported(ValueError):
+    """The refinement can't be proven equivalent; run it on the database."""
+
+
+_CLAUSES = ("select", "from", "where", "group", "having", "order", "limit", "offset")
+# Top-level keywords that put a query out of scope
+_REJECT = {"union", "intersect", "except", "window", "fetch", "for", "with", "into"}
+_AGGREGATES = {
+    "count", "sum", "avg", "min", "max", "array_agg", "string_agg", "json_agg", "jsonb_agg",
+    "bool_and", "bool_or", "every", "stddev", "stddev_pop", "stddev_samp", "variance",
+    "var_pop", "var_samp", "percentile_cont", "percentile_disc", "mode",
+}
+_NOT_ALIAS = {"null", "true", "false", "end", "asc", "desc", "distinct", "from"}
+# Words in a condition that aren't column references
+_KEYWORDS = {"and", "or", "not", "is", "in", "between", "like", "ilike", "date", "timestamp"}
+_COMPARE = {
+    "=": operator.eq, "<>": operator.ne, "!=": operator.ne,
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+}
+
+
+# ---------- PARSING ----------
+def _is_name(token):
+    kind, text = token
+    return kind == "ident" or (kind == "word" and text not in _NOT_ALIAS)
+
+
+def _name(token):
+    kind, text = token
+    return text[1:-1].replace('""', '"') if kind == "ident" else text
+
+
+def _split(tokens, separator):
+    """Split on a top-level token (e.g. ("op", ","))."""
+    parts, depth, start = [], 0, 0
+    for i, token in enumerate(tokens):
+        if token == ("op", "("):
+            depth += 1
+        elif token == ("op", ")"):
+            depth -= 1
+        elif depth == 0 and token == separator:
+            parts.append(tokens[start:i])
+            start = i + 1
+    parts.append(tokens[start:])
+    return parts
+
+
+def _conjuncts(tokens):
+    """
+    Top-level AND terms, keeping the AND of BETWEEN x AND y inside its term.
+    A condition with a top-level OR is a single term: AND binds tighter, so
+    splitting `a AND b OR c` on AND would change its meaning.
+    """
+    depth = 0
+    for token in tokens:
+        if token == ("op", "("):
+            depth += 1
+        elif token == ("op", ")"):
+            depth -= 1
+        elif depth == 0 and token == ("word", "or"):
+            return [tuple(_strip_parens(tokens))] if tokens else []
+
+    parts, depth, start, between = [], 0, 0, False
+    for i, token in enumerate(tokens):
+        if token == ("op", "("):
+            depth += 1
+        elif token == ("op", ")"):
+            depth -= 1
+        elif depth == 0 and token == ("word", "between"):
+            between = True
+        elif depth == 0 and token == ("word", "and"):
+            if between:
+                between = False
+            else:
+                parts.append(tokens[start:i])
+                start = i + 1
+    parts.append(tokens[start:])
+    return [tuple(_strip_parens(part)) for part in parts if part]
+
+
+def _strip_parens(tokens):
+    while (
+        len(tokens) > 2 and tokens[0] == ("op", "(") and tokens[-1] == ("op", ")")
+        and _balanced(tokens[1:-1])
+    ):
+        tokens = tokens[1:-1]
+    return tokens
+
+
+def _balanced(tokens):
+    depth = 0
+    for token in tokens:
+        if token == ("op", "("):
+            depth += 1
+        elif token == ("op", ")"):
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0
+
+
+def _int(tokens):
+    if len(tokens) != 1 or tokens[0][0] != "number" or not tokens[0][1].isdigit():
+        raise Unsupported("LIMIT/OFFSET must be a number")
+    return int(tokens[0][1])
+
+
+class Query:
+    """Top-level clauses of a single SELECT, as token lists."""
+
+    def __init__(self, sql):
+        tokens = sql_tokens(sql)
+        if not tokens or tokens[0] != ("word", "select"):
+            raise Unsupported("not a SELECT")
+        marks, depth = [], 0
+        for i, (kind, text) in enumerate(tokens):
+            if (kind, text) == ("op", "("):
+                depth += 1
+            elif (kind, text) == ("op", ")"):
+                depth -= 1
+            elif depth == 0 and kind == "word":
+                if text in _REJECT:
+                    raise Unsupported(f"top-level {text.upper()}")
+                if text in ("group", "order"):
+                    if tokens[i + 1:i + 2] != [("word", "by")]:
+                        raise Unsupported(f"{text.upper()} without BY")
+                    marks.append((i, text, i + 2))
+                elif text in _CLAUSES:
+                    marks.append((i, text, i + 1))
+        clauses = {}
+        for n, (i, name, body) in enumerate(marks):
+            if name in clauses:
+                raise Unsupported(f"repeated {name.upper()}")
+            end = marks[n + 1][0] if n + 1 < len(marks) else len(tokens)
+            clauses[name] = tokens[body:end]
+        if "from" not in clauses:
+            raise Unsupported("no FROM")
+
+        select = clauses["select"]
+        self.distinct = select[:1] == [("word", "distinct")]
+        if self.distinct:
+            select = select[1:]
+            if select[:1] == [("word", "on")]:
+                raise Unsupported("DISTINCT ON")
+        self.items = [tuple(item) for item in _split(select, ("op", ","))]
+        self.source = tuple(clauses["from"])
+        self.where = _conjuncts(clauses["where"]) if "where" in clauses else []
+        self.group = tuple(clauses["group"]) if "group" in clauses else None
+        self.having = tuple(clauses["having"]) if "having" in clauses else None
+        self.order = tuple(clauses["order"]) if "order" in clauses else None
+        self.limit = _int(clauses["limit"]) if "limit" in clauses else None
+        self.offset = _int(clauses["offset"]) if "offset" in clauses else None
+        self.tokens = tuple(tokens)
+
+    @property
+    def grouped(self):
+        return self.group is not None or self.having is not None or any(
+            token == ("word", "over") or (
+                token[0] == "word" and token[1] in _AGGREGATES
+                and item[i + 1:i + 2] == (("op", "("),)
+            )
+            for item in self.items for i, token in enumerate(item)
+        )
+
+
+def _split_alias(item):
+    """(expression, alias or None) of a select-list item."""
+    if len(item) >= 3 and item[-2] == ("word", "as") and _is_name(item[-1]):
+        return item[:-2], _name(item[-1])
+    if len(item) >= 2 and _is_name(item[-1]) and item[-2] != ("op", "."):
+        previous = item[-2]
+        if previous[0] in ("word", "ident", "number", "string") or previous == ("op", ")"):
+            return item[:-1], _name(item[-1])
+    return item, None
+
+
+def _column_ref(expr):
+    """(qualifier, name) when expr is a plain column reference."""
+    if len(expr) == 1 and _is_name(expr[0]):
+        return None, _name(expr[0])
+    if len(expr) == 3 and _is_name(expr[0]) and expr[1] == ("op", ".") and _is_name(expr[2]):
+        return _name(expr[0]), _name(expr[2])
+    return None
+
+
+def _is_star(expr):
+    return expr == (("op", "*"),) or (
+        len(expr) == 3 and _is_name(expr[0]) and expr[1:] == (("op", "."), ("op", "*"))
+    )
+
+
+# ---------- RESOLUTION ----------
+class _Scope:
+    """Maps column references in the refined query to positions in the previous result."""
+
+    def __init__(self, columns, qualified=False):
+        self.columns = columns  # (qualifier, name) -> position
+        self.qualified = qualified  # several tables in FROM: qualifiers must match
+
+    @classmethod
+    def of_frame(cls, df, qualifier=None):
+        names = list(df.columns)
+        if len(set(names)) != len(names):
+            raise Unsupported("duplicate column names")
+        return cls({(qualifier, name): pos for pos, name in enumerate(names)})
+
+    def resolve(self, qualifier, name):
+        if (qualifier, name) in self.columns:
+            return self.columns[(qualifier, name)]
+        if not self.qualified:
+            matches = {pos for (_, col), pos in self.columns.items() if col == name}
+            if len(matches) == 1:
+                return matches.pop()
+        raise Unsupported(f"column {name} is not available as-is in the previous result")
+
+
+def _single_source(source):
+    """True when FROM names a single table (qualifiers can be ignored)."""
+    return len(_split(list(source), ("op", ","))) == 1 and len(_split(list(source), ("word", "join"))) == 1
+
+
+def _previous_scope(last, df):
+    """Source columns the previous query selected unchanged, with their positions."""
+    items = [_split_alias(item) for item in last.items]
+    if len(items) == 1 and _is_star(items[0][0]):
+        scope = _Scope.of_frame(df)
+    elif any(_is_star(expr) for expr, _ in items):
+        raise Unsupported("* mixed with other columns")
+    else:
+        if len(items) != df.shape[1]:
+            raise Unsupported("select list doesn't match the cached result")
+        columns = {}
+        for pos, (expr, _) in enumerate(items):
+            ref = _column_ref(expr)
+            if ref is not None:
+                columns.setdefault(ref, pos)
+        scope = _Scope(columns)
+    scope.qualified = not _single_source(last.source)
+    return scope
+
+
+def _group_keys(last):
+    keys = set()
+    for expr in _split(list(last.group or ()), ("op", ",")):
+        ref = _column_ref(tuple(expr))
+        if ref is not None:
+            keys.add(ref[1])
+    return keys
+
+
+def _column_names(expr):
+    """Names of the column references in a condition (qualifiers dropped)."""
+    names = set()
+    for i, token in enumerate(expr):
+        if not _is_name(token) or token[0] == "word" and token[1] in _KEYWORDS:
+            continue
+        if expr[i + 1:i + 2] == (("op", "."),):
+            continue  # qualifier
+        if expr[i + 1:i + 2] == (("op", "("),):
+            raise Unsupported("function call in condition")
+        names.add(_name(token))
+    return names
+
+
+# ---------- CONDITIONS ----------
+class _Parser:
+    """Recursive-descent parser for WHERE conditions, resolving columns to positions."""
+
+    def __init__(self, tokens, scope):
+        self.tokens = list(tokens)
+        self.pos = 0
+        self.scope = scope
+
+    def peek(self, offset=0):
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else (None, None)
+
+    def take(self, *expected):
+        token = self.peek()
+        if expected and token not in expected:
+            raise Unsupported(f"unexpected {token[1]!r} in condition")
+        self.pos += 1
+        return token
+
+    def accept(self, token):
+        if self.peek() == token:
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        node = self.disjunction()
+        if self.pos != len(self.tokens):
+            raise Unsupported(f"unexpected {self.peek()[1]!r} in condition")
+        return node
+
+    def disjunction(self):
+        node = self.conjunction()
+        while self.accept(("word", "or")):
+            node = ("or", node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.accept(("word", "and")):
+            node = ("and", node, self.negation())
+        return node
+
+    def negation(self):
+        if self.accept(("word", "not")):
+            return ("not", self.negation())
+        return self.predicate()
+
+    def predicate(self):
+        if self.peek() == ("op", "("):
+            start = self.pos
+            self.take()
+            try:
+                node = self.disjunction()
+                self.take(("op", ")"))
+                return node
+            except Unsupported:
+                self.pos = start  # a parenthesized operand, not a condition
+        left = self.operand()
+        negate = self.accept(("word", "not"))
+        token = self.peek()
+        if token == ("word", "is"):
+            self.take()
+            negate = self.accept(("word", "not"))
+            self.take(("word", "null"))
+            return ("isnull", left, negate)
+        if token == ("word", "in"):
+            self.take()
+            self.take(("op", "("))
+            values = [self.literal()]
+            while self.accept(("op", ",")):
+                values.append(self.literal())
+            self.take(("op", ")"))
+            return ("in", left, values, negate)
+        if token == ("word", "between"):
+            self.take()
+            low = self.operand()
+            self.take(("word", "and"))
+            return ("between", left, low, self.operand(), negate)
+        if token in (("word", "like"), ("word", "ilike")):
+            self.take()
+            pattern = self.literal()
+            if pattern[0] != "str":
+                raise Unsupported("LIKE needs a string pattern")
+            return ("like", left, pattern[1], token[1] == "ilike", negate)
+        if negate or token[0] != "op" or token[1] not in _COMPARE:
+            raise Unsupported("unsupported condition")
+        self.take()
+        return ("cmp", token[1], left, self.operand())
+
+    def operand(self):
+        token = self.peek()
+        if _is_name(token) and token not in (("word", "date"), ("word", "timestamp")):
+            self.take()
+            qualifier = None
+            if self.accept(("op", ".")):
+                qualifier, token = _name(token), self.take()
+                if not _is_name(token):
+                    raise Unsupported("unsupported column reference")
+            if self.peek() == ("op", "("):
+                raise Unsupported("function call in condition")
+            return ("col", self.scope.resolve(qualifier, _name(token)))
+        return self.literal()
+
+    def literal(self):
+        kind, text = self.take()
+        if kind == "op" and text == "-" and self.peek()[0] == "number":
+            return ("num", -_number(self.take()[1]))
+        if kind == "number":
+            return ("num", _number(text))
+        if (kind, text) in (("word", "true"), ("word", "false")):
+            return ("bool", text == "true")
+        if (kind, text) in (("word", "date"), ("word", "timestamp")):
+            kind, text = self.take()
+            if kind != "string":
+                raise Unsupported("unsupported literal")
+            return ("ts", _timestamp(text))
+        if kind == "string":
+            value = text[1:-1].replace("''", "'")
+            if self.accept(("op", "::")):
+                cast = self.take()
+                if cast in (("word", "date"), ("word", "timestamp")):
+                    return ("ts", _timestamp(text))
+                if cast not in (("word", "text"), ("word", "varchar")):
+                    raise Unsupported("unsupported cast")
+            return ("str", value)
+        raise Unsupported(f"unsupported literal {text!r}")
+
+
+def _number(text):
+    value = float(text)
+    return int(value) if value.is_integer() and "." not in text and "e" not in text else value
+
+
+def _timestamp(quoted):
+    try:
+        return pd.Timestamp(quoted[1:-1])
+    except ValueError:
+        raise Unsupported(f"unparseable timestamp {quoted}") from None
+
+
+def _kind(series):
+    """num | bool | ts | str, or Unsupported for anything Postgres might compare differently."""
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_numeric_dtype(dtype):
+        return "num"
+    if pd.api.types.is_datetime64_dtype(dtype):
+        return "ts"
+    if pd.api.types.infer_dtype(series, skipna=True) in ("string", "empty"):
+        return "str"
+    raise Unsupported(f"can't evaluate {dtype} columns locally")
+
+
+def _values(node, df, column_kind=None):
+    """(kind, values) of an operand: a column Series, or a literal read as column_kind."""
+    if node[0] == "col":
+        series = df.iloc[:, node[1]]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(series.dtype.categories.dtype)
+        return _kind(series), series
+    return _coerce(column_kind, node)
+
+
+def _coerce(column_kind, literal):
+    """Postgres reads a quoted literal as the column's type, e.g. ts >= '2025-01-01'."""
+    kind, value = literal
+    if column_kind == "ts" and kind == "str":
+        return "ts", _timestamp(f"'{value}'")
+    return literal
+
+
+def _check(left_kind, right_kind, op=None):
+    if left_kind != right_kind:
+        raise Unsupported(f"comparing {left_kind} with {right_kind}")
+    if left_kind == "str" and op not in (None, "=", "<>", "!="):
+        raise Unsupported("ordering comparison on text (collation-dependent)")
+
+
+def _known(*values):
+    known = None
+    for value in values:
+        if isinstance(value, pd.Series):
+            known = value.notna() if known is None else known & value.notna()
+    return known
+
+
+def _truth(result, known):
+    truth = pd.Series(result).fillna(False).astype(bool)
+    return truth & known, known
+
+
+def _eval(node, df):
+    """(truth, known) boolean Series under SQL's three-valued logic."""
+    kind = node[0]
+    everything = pd.Series(True, index=df.index)
+    if kind == "and":
+        (lt, lk), (rt, rk) = _eval(node[1], df), _eval(node[2], df)
+        return lt & rt, (lk & rk) | (lk & ~lt) | (rk & ~rt)
+    if kind == "or":
+        (lt, lk), (rt, rk) = _eval(node[1], df), _eval(node[2], df)
+        return lt | rt, (lk & rk) | lt | rt
+    if kind == "not":
+        truth, known = _eval(node[1], df)
+        return ~truth & known, known
+    if kind == "isnull":
+        _, series = _values(node[1], df)
+        if not isinstance(series, pd.Series):
+            raise Unsupported("IS NULL on a literal")
+        isnull = series.isna()
+        return (~isnull if node[2] else isnull), everything
+    if kind == "cmp":
+        op, left_node, right_node = node[1:]
+        if left_node[0] != "col":
+            left_node, right_node = right_node, left_node
+            op = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}.get(op, op)
+        lk, left = _values(left_node, df)
+        rk, right = _values(right_node, df, lk)
+        _check(lk, rk, op)
+        known = _known(left, right)
+        if known is None:
+            raise Unsupported("comparison without a column")
+        return _truth(_COMPARE[op](left, right), known)
+    if kind == "in":
+        column_kind, series = _values(node[1], df)
+        if not isinstance(series, pd.Series):
+            raise Unsupported("IN on a literal")
+        values = [_coerce(column_kind, value) for value in node[2]]
+        for value_kind, _ in values:
+            _check(column_kind, value_kind)
+        known = series.notna()
+        member = _truth(series.isin([value for _, value in values]), known)[0]
+        return (~member & known if node[3] else member), known
+    if kind == "between":
+        k, series = _values(node[1], df)
+        (lk, low), (hk, high) = (_values(n, df, k) for n in node[2:4])
+        _check(k, lk, "<=")
+        _check(k, hk, "<=")
+        known = _known(series, low, high)
+        if known is None:
+            raise Unsupported("BETWEEN without a column")
+        inside = _truth((series >= low) & (series <= high), known)[0]
+        return (~inside & known if node[4] else inside), known
+    if kind == "like":
+        column_kind, series = _values(node[1], df)
+        if column_kind != "str" or not isinstance(series, pd.Series):
+            raise Unsupported("LIKE on a non-text column")
+        known = series.notna()
+        matched = series.astype(object).where(known, "").str.fullmatch(
+            _like_regex(node[2]), case=not node[3]
+        )
+        matched = _truth(matched, known)[0]
+        return (~matched & known if node[4] else matched), known
+    raise Unsupported(f"unsupported condition {kind}")
+
+
+def _like_regex(pattern):
+    parts, escaped = [], False
+    for ch in pattern:
+        if escaped:
+            parts.append(re.escape(ch))
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == "%":
+            parts.append(".*")
+        elif ch == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(ch))
+    return re.compile("".join(parts), re.S)
+
+
+# ---------- PLANNING ----------
+class Refinement:
+    """How to derive the refined result from the previous one."""
+
+    def __init__(self, conditions, order, limit, offset, outputs):
+        self.conditions = conditions  # parsed WHERE terms
+        self.order = order  # [(position, ascending, nulls_first)] or None to keep the order
+        self.limit = limit
+        self.offset = offset
+        self.outputs = outputs  # [(position, name)]
+
+    def apply(self, df):
+        if self.conditions:
+            mask = pd.Series(True, index=df.index)
+            for condition in self.conditions:
+                mask &= _eval(condition, df)[0]
+            df = df[mask.to_numpy()]
+        if self.order:
+            df = df.iloc[_sort_order(df, self.order)]
+        start = self.offset or 0
+        stop = start + self.limit if self.limit is not None else None
+        df = df.iloc[start:stop]
+        out = df.iloc[:, [pos for pos, _ in self.outputs]]
+        out.columns = [name for _, name in self.outputs]
+        out = out.reset_index(drop=True)
+        out.attrs["truncated"] = False
+        return out
+
+
+def _sort_order(df, keys):
+    """Row order for ORDER BY keys (Postgres defaults: NULLS LAST ascending, FIRST descending)."""
+    order = np.arange(len(df))
+    for pos, ascending, nulls_first in reversed(keys):
+        series = df.iloc[order, pos].reset_index(drop=True)
+        if _kind(series) == "str":
+            raise Unsupported("sorting text (collation-dependent)")
+        ranked = series.sort_values(
+            ascending=ascending, na_position="first" if nulls_first else "last", kind="stable"
+        )
+        order = order[ranked.index.to_numpy()]
+    return order
+
+
+def _order_keys(order, outputs, resolve):
+    keys = []
+    for item in _split(list(order), ("op", ",")):
+        item = list(item)
+        if not item:
+            raise Unsupported("empty ORDER BY item")
+        nulls_first = None
+        if item[-2:] in ([("word", "nulls"), ("word", "first")], [("word", "nulls"), ("word", "last")]):
+            nulls_first = item[-1][1] == "first"
+            item = item[:-2]
+        ascending = True
+        if item[-1:] in ([("word", "asc")], [("word", "desc")]):
+            ascending = item[-1][1] == "asc"
+            item = item[:-1]
+        expr = tuple(item)
+        if len(expr) == 1 and expr[0][0] == "number":
+            index = int(expr[0][1]) - 1
+            if not 0 <= index < len(outputs):
+                raise Unsupported("ORDER BY position out of range")
+            pos = outputs[index][0]
+        else:
+            pos = resolve(expr, outputs)
+        keys.append((pos, ascending, (not ascending) if nulls_first is None else nulls_first))
+    return keys
+
+
+def _plan_wrapped(new, last, df):
+    """SELECT … FROM (<previous query>) [AS] t …"""
+    source = new.source
+    if not source or source[0] != ("op", "("):
+        return None
+    inner = source[1:]
+    depth, close = 1, None
+    for i, token in enumerate(inner):
+        depth += token == ("op", "(")
+        depth -= token == ("op", ")")
+        if depth == 0:
+            close = i
+            break
+    if close is None or tuple(inner[:close]) != last.tokens:
+        return None
+    rest = list(inner[close + 1:])
+    if rest[:1] == [("word", "as")]:
+        rest = rest[1:]
+    if len(rest) > 1 or (rest and not _is_name(rest[0])):
+        raise Unsupported("joined with other tables")
+    qualifier = _name(rest[0]) if rest else None
+    if new.grouped or new.distinct:
+        raise Unsupported("aggregates over the previous result")
+
+    scope = _Scope.of_frame(df)
+    if qualifier:
+        scope.columns.update({(qualifier, name): pos for (_, name), pos in list(scope.columns.items())})
+
+    outputs = []
+    for item in new.items:
+        expr, alias = _split_alias(item)
+        if _is_star(expr):
+            outputs += [(pos, name) for pos, name in enumerate(df.columns)]
+            continue
+        ref = _column_ref(expr)
+        if ref is None:
+            raise Unsupported("computed column")
+        outputs.append((scope.resolve(*ref), alias or ref[1]))
+
+    def resolve(expr, outputs):
+        ref = _column_ref(expr)
+        if ref is None:
+            raise Unsupported("ORDER BY expression")
+        aliases = [pos for pos, name in outputs if ref[0] is None and name == ref[1]]
+        return aliases[0] if aliases else scope.resolve(*ref)
+
+    conditions = [_Parser(term, scope).parse() for term in new.where]
+    order = _order_keys(new.order, outputs, resolve) if new.order else None
+    return Refinement(conditions, order, new.limit, new.offset, outputs)
+
+
+def _plan_modified(new, last, df):
+    """The previous query with extra conditions, a new order/limit and fewer columns."""
+    if new.source != last.source or new.group != last.group or new.having != last.having:
+        return None
+    if last.limit is not None or last.offset is not None:
+        raise Unsupported("the previous result was limited")
+    if new.distinct != last.distinct or (new.distinct and new.items != last.items):
+        raise Unsupported("DISTINCT changed")
+
+    remaining = list(new.where)
+    for term in last.where:
+        if term not in remaining:
+            raise Unsupported("a previous condition was removed or changed")
+        remaining.remove(term)
+
+    scope = _previous_scope(last, df)
+    star = len(last.items) == 1 and _is_star(_split_alias(last.items[0])[0])
+    if remaining and last.grouped:
+        # Dropping whole groups is only the same as filtering their input rows
+        # when the condition reads nothing but grouping keys
+        if any(token == ("word", "over") for item in last.items for token in item):
+            raise Unsupported("window functions in the previous query")
+        keys = _group_keys(last)
+        for term in remaining:
+            if not _column_names(term) <= keys:
+                raise Unsupported("condition on a non-grouping column of a grouped query")
+
+    outputs = []
+    for item in new.items:
+        if item in last.items and not star:
+            pos = last.items.index(item)
+            outputs.append((pos, df.columns[pos]))
+            continue
+        expr, alias = _split_alias(item)
+        if _is_star(expr) and star:
+            outputs += [(pos, name) for pos, name in enumerate(df.columns)]
+            continue
+        ref = _column_ref(expr)
+        if ref is None:
+            raise Unsupported("column not in the previous select list")
+        outputs.append((scope.resolve(*ref), alias or ref[1]))
+
+    def resolve(expr, outputs):
+        if expr in (_split_alias(item)[0] for item in last.items) and not star:
+            return [_split_alias(item)[0] for item in last.items].index(expr)
+        ref = _column_ref(expr)
+        if ref is None:
+            raise Unsupported("ORDER BY expression")
+        aliases = [pos for pos, name in outputs if ref[0] is None and name == ref[1]]
+        return aliases[0] if aliases else scope.resolve(*ref)
+
+    conditions = [_Parser(term, scope).parse() for term in remaining]
+    if new.order == last.order:
+        order = None  # filtering keeps the database's order (and its collation)
+    else:
+        order = _order_keys(new.order, outputs, resolve) if new.order else None
+    return Refinement(conditions, order, new.limit, new.offset, outputs)
+
+
+def refine_locally(sql, last_sql, last_df):
+    """
+    The result of `sql` computed from `last_df` (the complete result of
+    `last_sql`), or None when that can't be proven equivalent.
+    """
+    if last_df is None or not last_sql or last_df.attrs.get("truncated"):
+        return None
+    try:
+        new, last = Query(sql), Query(last_sql)
+        if new.tokens == last.tokens:
+            return None  # same query; the result cache already covers it
+        refinement = _plan_wrapped(new, last, last_df) or _plan_modified(new, last, last_df)
+        if refinement is None:
+            return None
+        return refinement.apply(last_df)
+    except Exception:
+        # Unsupported, or anything pandas can't evaluate: ask the database
+        return None
@@ -0,0 +1,554 @@
+# replica.py
+"""
+Optional local analytical replica: journey_xray and papi_automation
+exported to Parquet and queried with DuckDB, so large aggregations run
+multi-core on the app host instead of on the primary database.
+
+    python replica.py            # export new events once (incremental)
+    python replica.py --loop 300 # export every 5 minutes
+    python replica.py --full     # rebuild from scratch (also compacts files)
+
+Layout under REPLICA_DIR (the replica is disabled when it's unset or
+duckdb isn't installed):
+
+    manifest.json                            current generation + watermark
+    <generation>/journey_xray/aid=<aid>/day=<date>/part-*.parquet
+    <generation>/papi_automation.parquet     scalar columns (no jsonb)
+    <generation>/journey_nodes.parquet       nodes flattened from nodedatarray
+    <generation>/journey_links.parquet       links flattened from linkdatarray
+
+Like the rollups, each export only reads rows with ts newer than the
+watermark, so late-arriving rows are not picked up until a --full rebuild.
+
+A SELECT runs on the replica when every table it reads is replicated (and
+no jsonb column is used) and the replica is fresh enough: its watermark
+may trail max(ts) on Postgres by at most REPLICA_MAX_LAG_S, and not at all
+when the query is relative to now(). Anything else, or a query DuckDB
+can't execute, goes to Postgres. DuckDB is set to integer division and
+NULL ordering like Postgres; text still sorts by code point rather than by
+the database collation. Queries served here are exact, so approximate
+mode doesn't apply to them.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+from cancellation import QUERY_DEADLINE, CancelToken
+from columnar import concat_chunks, decode_rows
+from db import MAX_BYTES, MAX_ROWS, ChunkedResult, connection
+from plan_guard import check_plan
+
+REPLICA_DIR = os.getenv("REPLICA_DIR", "")
+MAX_LAG = float(os.getenv("REPLICA_MAX_LAG_S", 600))
+THREADS = int(os.getenv("REPLICA_THREADS", os.cpu_count() or 1))
+MEMORY_LIMIT = os.getenv("REPLICA_MEMORY_LIMIT", "")
+# Rows per Postgres fetch / Parquet write during an export
+EXPORT_BATCH = int(os.getenv("REPLICA_EXPORT_BATCH", 500_000))
+
+XRAY_COLUMNS = ("aid", "channel", "cid", "glreqid", "nid", "ts", "uid")
+PAPI_COLUMNS = (
+    "id", "name", "created_date", "from_date", "to_date", "updated_date", "journey_xray_enabled",
+)
+# papi_automation columns that stay on Postgres
+JSONB_COLUMNS = ("lp_content_parsed", "nodedatarray", "linkdatarray")
+# Tables that only exist in the replica
+REPLICA_ONLY = ("journey_nodes", "journey_links")
+TABLES = ("journey_xray", "papi_automation") + REPLICA_ONLY
+
+_NOW_RE = re.compile(r"\b(now\s*\(|current_date\b|current_timestamp\b|localtimestamp\b)", re.I)
+_JSONB_RE = re.compile(r"\b(" + "|".join(JSONB_COLUMNS) + r")\b", re.I)
+
+
+def _manifest_path(root):
+    return os.path.join(root, "manifest.json")
+
+
+def read_manifest(root=REPLICA_DIR):
+    try:
+        with open(_manifest_path(root), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(root, manifest):
+    tmp = _manifest_path(root) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, _manifest_path(root))
+
+
+# ---------- EXPORT ----------
+def _write_events(directory, chunk, export_id, batch_no):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    chunk = chunk.assign(day=chunk["ts"].dt.normalize().dt.date)
+    ds.write_dataset(
+        pa.Table.from_pandas(chunk, preserve_index=False),
+        directory,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("aid", pa.int64()), ("day", pa.date32())]), flavor="hive"),
+        basename_template=f"part-{export_id}-{batch_no}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        max_partitions=1_000_000,
+    )
+
+
+def _export_events(conn, directory, low, high):
+    """Copy journey_xray rows with low < ts <= high into aid/day partitions. Returns rows written."""
+    export_id = uuid.uuid4().hex[:12]
+    written = 0
+    with conn.cursor(name=f"replica_{export_id}", binary=True) as cur:
+        if low is None:
+            cur.execute(f"SELECT {', '.join(XRAY_COLUMNS)} FROM journey_xray WHERE ts <= %s", (high,))
+        else:
+            cur.execute(
+                f"SELECT {', '.join(XRAY_COLUMNS)} FROM journey_xray WHERE ts > %s AND ts <= %s",
+                (low, high),
+            )
+        categorical = None
+        batch_no = 0
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH)
+            if not rows:
+                break
+            chunk, categorical = decode_rows(rows, cur.description, categorical)
+            _write_events(directory, chunk, export_id, batch_no)
+            written += len(chunk)
+            batch_no += 1
+    return written
+
+
+def _write_parquet(df, path):
+    tmp = path + ".tmp"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _export_journeys(conn, generation_dir):
+    """Rewrite papi_automation (minus jsonb) and its flattened nodes and links."""
+    from journey_graph import JourneyGraph
+
+    rows = conn.execute(
+        f"SELECT {', '.join(PAPI_COLUMNS)}, nodedatarray, linkdatarray FROM papi_automation"
+    ).fetchall()
+    n = len(PAPI_COLUMNS)
+    papi = pd.DataFrame([row[:n] for row in rows], columns=list(PAPI_COLUMNS))
+
+    nodes, links = [], []
+    for row in rows:
+        aid, name, updated_date = row[0], row[1], row[5]
+        try:
+            graph = JourneyGraph.parse(aid, name, updated_date, row[n], row[n + 1])
+        except Exception:
+            continue  # a malformed journey shouldn't stop the export
+        nodes.append(graph.nodes_frame().assign(aid=aid))
+        links.append(graph.links_frame().assign(aid=aid))
+    nodes = pd.concat(nodes, ignore_index=True) if nodes else pd.DataFrame(
+        {"nid": pd.Series(dtype="int64"), "label": pd.Series(dtype="object"),
+         "node_type": pd.Series(dtype="object"), "out_links": pd.Series(dtype="int64"),
+         "aid": pd.Series(dtype="int64")})
+    links = pd.concat(links, ignore_index=True) if links else pd.DataFrame(
+        {"from_nid": pd.Series(dtype="int64"), "to_nid": pd.Series(dtype="int64"),
+         "aid": pd.Series(dtype="int64")})
+    nodes["node_type"] = nodes["node_type"].astype("string")
+
+    _write_parquet(papi, os.path.join(generation_dir, "papi_automation.parquet"))
+    _write_parquet(nodes[["aid", "nid", "label", "node_type", "out_links"]],
+                   os.path.join(generation_dir, "journey_nodes.parquet"))
+    _write_parquet(links[["aid", "from_nid", "to_nid"]],
+                   os.path.join(generation_dir, "journey_links.parquet"))
+    return len(papi)
+
+
+def export(root=REPLICA_DIR, full=False):
+    """One export pass. Returns (events written, journeys written)."""
+    if not root:
+        raise ValueError("REPLICA_DIR is not set")
+    os.makedirs(root, exist_ok=True)
+    manifest = read_manifest(root)
+    previous = manifest["generation"] if manifest else None
+    if full or manifest is None:
+        generation, low = f"g{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}", None
+    else:
+        generation, low = previous, datetime.fromisoformat(manifest["watermark"]) if manifest["watermark"] else None
+    generation_dir = os.path.join(root, generation)
+    os.makedirs(os.path.join(generation_dir, "journey_xray"), exist_ok=True)
+
+    with connection() as conn:
+        high = conn.execute("SELECT max(ts) FROM journey_xray").fetchone()[0]
+        events = 0
+        if high is not None and (low is None or high > low):
+            events = _export_events(conn, os.path.join(generation_dir, "journey_xray"), low, high)
+        else:
+            high = low
+        journeys = _export_journeys(conn, generation_dir)
+
+    _write_manifest(root, {
+        "generation": generation,
+        "watermark": high.isoformat() if high else None,
+        "exported_at": time.time(),
+        "events": (manifest["events"] if manifest and generation == previous else 0) + events,
+        "journeys": journeys,
+    })
+    if previous and previous != generation:
+        # Queries still reading the old files fall back to Postgres
+        shutil.rmtree(os.path.join(root, previous), ignore_errors=True)
+    return events, journeys
+
+
+# ---------- QUERYING ----------
+_NOT_ALIAS = {
+    "where", "join", "on", "using", "group", "order", "limit", "inner", "left", "right", "full",
+    "cross", "natural", "having", "union", "intersect", "except", "window", "offset", "fetch",
+    "tablesample", "lateral",
+}
+
+
+def tables_read(sql):
+    """
+    Relations a statement reads: names after FROM/JOIN, including
+    comma-separated FROM lists, minus its CTEs. FROM inside function calls
+    (extract(day FROM ts), substring(x FROM 2)) and IS DISTINCT FROM are
+    ignored.
+    """
+    from result_cache import sql_tokens
+
+    tokens = sql_tokens(sql)
+    # CTE names: `name AS (` (the CTE bodies are scanned like everything else)
+    ctes = {
+        tokens[i][1].strip('"') for i in range(len(tokens) - 2)
+        if tokens[i][0] in ("word", "ident") and tokens[i + 1:i + 3] == [("word", "as"), ("op", "(")]
+    }
+    found = set()
+    # For each open parenthesis: does it contain a SELECT (a subquery)?
+    queries = [True]
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        if (kind, text) == ("op", "("):
+            queries.append(False)
+        elif (kind, text) == ("op", ")"):
+            if len(queries) > 1:
+                queries.pop()
+        elif kind == "word" and text == "select":
+            queries[-1] = True
+        elif (kind == "word" and text in ("from", "join") and queries[-1]
+              and tokens[i - 1:i] != [("word", "distinct")]):
+            i += 1
+            while i < len(tokens) and tokens[i][0] in ("word", "ident"):
+                name = tokens[i][1].strip('"')
+                # schema-qualified names are never replicated
+                if tokens[i + 1:i + 2] == [("op", ".")] and i + 2 < len(tokens):
+                    name = f"{name}.{tokens[i + 2][1]}"
+                    i += 2
+                found.add(name)
+                i += 1
+                # optional alias, then another relation after a comma
+                if tokens[i:i + 1] == [("word", "as")]:
+                    i += 1
+                if i < len(tokens) and tokens[i][0] in ("word", "ident") and tokens[i][1] not in _NOT_ALIAS:
+                    i += 1
+                if tokens[i:i + 1] != [("op", ",")]:
+                    break
+                i += 1
+            continue
+        i += 1
+    return found - ctes
+
+
+class Replica:
+    """Process-wide DuckDB database with views over the current replica generation."""
+
+    def __init__(self, root=REPLICA_DIR, threads=THREADS, max_lag=MAX_LAG):
+        self.root = root
+        self.threads = threads
+        self.max_lag = max_lag
+        self.served = 0
+        self.fallbacks = 0
+        self.stale = 0
+        self.error = None
+        self._con = None
+        self._manifest = None
+        self._manifest_mtime = None
+        self.tables = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        if not self.root:
+            return False
+        try:
+            import duckdb  # noqa: F401  (optional dependency)
+        except ImportError:
+            self.error = "duckdb is not installed"
+            return False
+        return True
+
+    def _refresh(self):
+        """(Re)create the views when a new generation was exported. Caller holds the lock."""
+        try:
+            mtime = os.stat(_manifest_path(self.root)).st_mtime
+        except OSError:
+            self._manifest, self.tables = None, set()
+            return
+        if mtime == self._manifest_mtime:
+            return
+        manifest = read_manifest(self.root)
+        if manifest is None:
+            return
+
+        import duckdb
+
+        if self._con is None:
+            config = {"threads": self.threads}
+            if MEMORY_LIMIT:
+                config["memory_limit"] = MEMORY_LIMIT
+            self._con = duckdb.connect(":memory:", config=config)
+            # Postgres semantics for bigint / bigint and NULL ordering (NULLs
+            # first in DESC), GLOBAL so cursors inherit them
+            self._con.execute("SET GLOBAL integer_division = true")
+            self._con.execute("SET GLOBAL default_null_order = 'nulls_last_on_asc_first_on_desc'")
+
+        base = os.path.join(self.root, manifest["generation"])
+        tables = set()
+        for name in ("papi_automation", "journey_nodes", "journey_links"):
+            path = os.path.join(base, f"{name}.parquet")
+            if os.path.exists(path):
+                self._con.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM read_parquet('{_sql_path(path)}')")
+                tables.add(name)
+        events = os.path.join(base, "journey_xray")
+        if manifest.get("events"):
+            self._con.execute(
+                f"""
+                CREATE OR REPLACE VIEW journey_xray AS
+                SELECT {', '.join(XRAY_COLUMNS)}
+                FROM read_parquet('{_sql_path(events)}/**/*.parquet',
+                                  hive_partitioning = true,
+                                  hive_types = {{'aid': BIGINT, 'day': DATE}})
+                """
+            )
+            tables.add("journey_xray")
+        self._manifest, self._manifest_mtime, self.tables = manifest, mtime, tables
+
+    def status(self):
+        """Current manifest, or None when there is no usable replica."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            try:
+                self._refresh()
+                self.error = None
+            except Exception as e:
+                self.error = str(e)
+                return None
+            return self._manifest
+
+    def can_serve(self, sql):
+        """True when sql only reads replicated data and the replica is fresh enough for it."""
+        manifest = self.status()
+        if manifest is None:
+            return False
+        tables = tables_read(sql)
+        if not tables or not tables <= self.tables:
+            return False
+        if "papi_automation" in tables and _JSONB_RE.search(sql):
+            return False
+        # Replica-only tables can't be read on Postgres, however stale
+        if "journey_xray" not in tables or tables & set(REPLICA_ONLY):
+            return True
+
+        from result_cache import get_result_cache
+
+        cache = get_result_cache()
+        try:
+            cache.check_freshness()
+        except Exception:
+            return False  # freshness unknown: let Postgres answer (or report the error)
+        latest = cache.xray_max_ts()
+        if latest is None or not manifest["watermark"]:
+            return False
+        lag = (latest - datetime.fromisoformat(manifest["watermark"])).total_seconds()
+        allowed = 0 if _NOW_RE.search(sql) else self.max_lag
+        if lag > allowed:
+            self.stale += 1
+            return False
+        return True
+
+    def cursor(self):
+        with self._lock:
+            self._refresh()
+            return self._con.cursor()
+
+    def describe(self):
+        manifest = self._manifest or {}
+        return f"Runs on the local DuckDB replica (journey_xray as of {manifest.get('watermark')})"
+
+    def stats(self):
+        manifest = self._manifest or {}
+        return {
+            "enabled": bool(self.root),
+            "watermark": manifest.get("watermark"),
+            "events": manifest.get("events", 0),
+            "served": self.served,
+            "fallbacks": self.fallbacks,
+            "stale": self.stale,
+            "error": self.error,
+        }
+
+
+def _sql_path(path):
+    return os.path.abspath(path).replace("'", "''")
+
+
+@st.cache_resource(show_spinner=False)
+def get_replica():
+    return Replica()
+
+
+class ReplicaResult:
+    """
+    Runs a SELECT on the replica with the same interface as ChunkedResult,
+    falling back to Postgres if DuckDB can't execute it. The fallback goes
+    through the plan guard like any other Postgres query. Cancelling it, or
+    reaching QUERY_DEADLINE_S, interrupts the DuckDB query.
+    """
+
+    def __init__(self, sql, max_rows=None, max_bytes=None, on_complete=None, token=None):
+        self.sql = sql
+        self.fallback = None  # ChunkedResult on Postgres, once DuckDB has failed
+        self.plan = None
+        self.token = token
+        self.max_rows = max_rows or MAX_ROWS
+        self.max_bytes = max_bytes or MAX_BYTES
+        self.on_complete = on_complete
+        self.engine = "replica"
+        self.truncated = False
+        self.rows = 0
+        self.bytes = 0
+        self.chunks = []
+        self.columns = []
+
+    def cancel(self, reason="cancelled"):
+        if self.token is None:
+            self.token = CancelToken(name="query")
+        self.token.cancel(reason)
+        if self.fallback is not None:
+            self.fallback.cancel(reason)
+
+    def _execute(self):
+        """The result frame, or None if DuckDB couldn't run the query."""
+        import duckdb
+
+        replica = get_replica()
+        cursor = replica.cursor()
+        unregister = self.token.on_cancel(cursor.interrupt)
+        try:
+            # One row over the limit tells us the result was truncated
+            df = cursor.execute(
+                f"SELECT * FROM ({self.sql}) AS replica_query LIMIT {self.max_rows + 1}"
+            ).df()
+        except duckdb.Error:
+            self.token.raise_if_cancelled()
+            replica.fallbacks += 1
+            return None
+        finally:
+            unregister()
+            cursor.close()
+        replica.served += 1
+        return df
+
+    def __iter__(self):
+        if self.token is None:
+            self.token = CancelToken(QUERY_DEADLINE, "query")
+        self.token.raise_if_cancelled()
+        try:
+            df = self._execute()
+        finally:
+            self.token.close()
+
+        if df is None:
+            self.engine = "postgres"
+            # Raises PlanRejected for a query too expensive to run on the primary
+            self.plan = check_plan(self.sql)
+            self.token.raise_if_cancelled()
+            self.fallback = ChunkedResult(self.plan.sql)
+            yield from self.fallback
+            self.truncated = self.fallback.truncated or self.plan.capped(self.fallback.rows)
+            self.rows, self.bytes = self.fallback.rows, self.fallback.bytes
+            self.chunks, self.columns = self.fallback.chunks, self.fallback.columns
+            if self.on_complete:
+                self.on_complete(self)
+            return
+
+        if len(df) > self.max_rows:
+            df, self.truncated = df.iloc[:self.max_rows], True
+        self.columns = list(df.columns)
+        self.rows = len(df)
+        self.bytes = int(df.memory_usage(deep=True).sum())
+        if self.bytes >= self.max_bytes:
+            self.truncated = True
+        self.chunks.append(df)
+        yield df
+
+        if self.on_complete:
+            self.on_complete(self)
+
+    def frame(self) -> pd.DataFrame:
+        df = concat_chunks(self.chunks)
+        df.attrs["truncated"] = self.truncated
+        return df
+
+
+def replica_prompt():
+    """
+    Schema section advertising the replica-only tables to the SQL generator,
+    or "" when there is no usable replica.
+    """
+    replica = get_replica()
+    if not replica.status() or not set(REPLICA_ONLY) <= replica.tables:
+        return ""
+    return """
+- Tables journey_nodes and journey_links (papi_automation.nodedatarray and
+  linkdatarray flattened, one row per node / per link):
+    journey_nodes: aid bigint (= papi_automation.id), nid bigint (= journey_xray.nid),
+                   label text, node_type text, out_links bigint (number of outgoing links)
+    journey_links: aid bigint, from_nid bigint, to_nid bigint
+  PREFER these over parsing nodedatarray/linkdatarray. They are not in
+  PostgreSQL, so don't join them with journey_xray_rollup.
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export journey_xray/papi_automation to the local replica")
+    parser.add_argument("--loop", type=float, default=0, help="export every N seconds")
+    parser.add_argument("--full", action="store_true", help="rebuild the replica from scratch")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    root = os.getenv("REPLICA_DIR", REPLICA_DIR)
+    full = args.full
+    while True:
+        start = time.perf_counter()
+        events, journeys = export(root, full=full)
+        print(f"Exported {events:,} events and {journeys:,} journeys in {time.perf_counter() - start:.2f}s")
+        if not args.loop:
+            break
+        full = False
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# result_cache.py
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+from db import ChunkedResult, FrameResult, connection
+from jobs import get_scheduler
+
+# Tokens: quoted strings/identifiers first so their contents are left alone
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<string>'(?:[^']|'')*')
+    | (?P<ident>"(?:[^"]|"")*")
+    | (?P<number>\b\d+(?:\.\d*)?(?:[eE][+-]?\d+)?\b)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<op><>|!=|<=|>=|::|\|\||[^\sA-Za-z0-9_])
+    """,
+    re.VERBOSE,
+)
+
+
+def sql_tokens(sql: str):
+    """
+    (kind, text) tokens of a statement, kind being string, ident, number,
+    word or op. Words are case-folded and numbers canonicalized without
+    changing their type (3 and 3.0 stay different: 3/2 is integer
+    division); string literals and quoted identifiers are kept verbatim.
+    """
+    tokens = []
+    for m in _TOKEN_RE.finditer(sql.strip().rstrip(";")):
+        kind = m.lastgroup
+        text = m.group()
+        if kind == "word":
+            text = text.lower()
+        elif kind == "number":
+            text = _canonical_number(text)
+        tokens.append((kind, text))
+    return tokens
+
+
+def _canonical_number(text):
+    """Drop leading zeros and normalize the exponent; keep the decimal point and digits."""
+    mantissa, _, exponent = text.lower().partition("e")
+    whole, point, fraction = mantissa.partition(".")
+    text = (whole.lstrip("0") or "0") + point + fraction
+    return f"{text}e{int(exponent)}" if exponent else text
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Canonical form of a SELECT used as the cache key: whitespace collapsed,
+    keywords/identifiers case-folded, numeric literals canonicalized.
+    """
+    return " ".join(text for _, text in sql_tokens(sql))
+
+
+class ResultCache:
+    """
+    Process-wide LRU cache of query results, bounded by entry count and
+    DataFrame memory, with a TTL per entry. Results that read journey_xray
+    are dropped as soon as new events land (max(ts) moves forward); that
+    check runs at most once per freshness window.
+    """
+
+    def __init__(self, ttl, max_entries, max_bytes, freshness):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.freshness = freshness
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._xray_max_ts = None
+        self._xray_checked_at = 0.0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry["stored_at"] > self.ttl:
+                if entry is not None:
+                    self._evict(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["df"]
+
+    def put(self, key, df, reads_xray):
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = {
+                "df": df,
+                "nbytes": nbytes,
+                "stored_at": time.monotonic(),
+                "reads_xray": reads_xray,
+            }
+            self._bytes += nbytes
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                self._evict(next(iter(self._entries)))
+
+    def check_freshness(self):
+        """Invalidate journey_xray results if new events arrived since they were cached."""
+        now = time.monotonic()
+        if now - self._xray_checked_at < self.freshness:
+            return
+        self._xray_checked_at = now
+
+        with connection() as conn:
+            max_ts = conn.execute("SELECT max(ts) FROM journey_xray").fetchone()[0]
+
+        with self._lock:
+            if self._xray_max_ts is not None and max_ts != self._xray_max_ts:
+                for key in [k for k, e in self._entries.items() if e["reads_xray"]]:
+                    self._evict(key)
+            self._xray_max_ts = max_ts
+
+    def xray_max_ts(self):
+        """max(ts) of journey_xray as of the last freshness check (None before the first)."""
+        return self._xray_max_ts
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _evict(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["nbytes"]
+
+
+@st.cache_resource(show_spinner=False)
+def get_result_cache():
+    return ResultCache(
+        ttl=float(os.getenv("RESULT_CACHE_TTL", 300)),
+        max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 256)),
+        max_bytes=int(os.getenv("RESULT_CACHE_MAX_MB", 256)) * 1024 * 1024,
+        freshness=float(os.getenv("RESULT_CACHE_FRESHNESS", 60)),
+    )
+
+
+def cached_query(sql: str, params=None, prepare=False, session_id=None, replica=False):
+    """
+    Run a SELECT through the shared result cache.
+    Returns (result, cache_hit); iterate result for DataFrame chunks and
+    call result.frame() for the full frame. Misses are streamed from
+    Postgres and stored once fully fetched. params/prepare are passed to
+    ChunkedResult for templated queries. With a session_id the fetch runs
+    on the shared query scheduler, where identical in-flight misses from
+    other sessions are deduplicated. With replica=True a miss runs on the
+    local DuckDB replica, falling back to Postgres (plan-guarded) if DuckDB
+    can't run it.
+    """
+    cache = get_result_cache()
+    key = normalize_sql(sql)
+    if params:
+        key += " -- " + repr(tuple(params))
+    reads_xray = "journey_xray" in key
+
+    if reads_xray:
+        cache.check_freshness()
+
+    df = cache.get(key)
+    if df is not None:
+        return FrameResult(df), True
+
+    store = lambda result: cache.put(key, result.frame(), reads_xray)
+    if replica:
+        from replica import ReplicaResult
+
+        result = ReplicaResult(sql, on_complete=store)
+    else:
+        result = ChunkedResult(sql, params=params, prepare=prepare, on_complete=store)
+    if session_id is not None:
+        result = get_scheduler().submit(session_id, ("sql", key), result)
+    return result, False
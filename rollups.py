@@ -0,0 +1,323 @@
+# rollups.py
+"""
+Incremental rollups of journey_xray by (aid, nid, channel, time bucket).
+
+    python rollups.py            # create tables if needed, refresh once
+    python rollups.py --loop 300 # refresh every 5 minutes
+
+Each refresh only scans rows with ts newer than the stored watermark. Every
+bucket keeps an exact event count and a HyperLogLog sketch of distinct uid,
+so distinct users can be estimated across any set of buckets.
+Rows that arrive late (ts at or before the watermark) are not picked up.
+"""
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+import streamlit as st
+
+from db import connection
+
+BUCKET = os.getenv("ROLLUP_BUCKET", "day")          # date_trunc() unit
+PRECISION = int(os.getenv("ROLLUP_HLL_PRECISION", 11))  # 2^p registers, ~1.04/sqrt(2^p) error
+
+_HASH_BITS = 32  # hashtext() is a 32-bit hash
+
+
+class HyperLogLog:
+    """HLL sketch over 32-bit hashes; registers are filled by the SQL in refresh()."""
+
+    def __init__(self, precision=PRECISION, registers=None):
+        self.p = precision
+        self.m = 1 << precision
+        self.registers = (
+            registers if registers is not None else np.zeros(self.m, dtype=np.uint8)
+        )
+
+    def update(self, regs, rhos):
+        np.maximum.at(self.registers, np.asarray(regs), np.asarray(rhos, dtype=np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        if raw > (1 << _HASH_BITS) / 30:
+            return -(1 << _HASH_BITS) * math.log(1 - raw / (1 << _HASH_BITS))
+        return raw
+
+    def to_bytes(self):
+        """Sparse (reg uint16, rho uint8 pairs) when small, dense registers otherwise."""
+        nonzero = np.flatnonzero(self.registers)
+        if len(nonzero) * 3 < self.m:
+            pairs = np.empty(len(nonzero), dtype=[("reg", "<u2"), ("rho", "u1")])
+            pairs["reg"] = nonzero
+            pairs["rho"] = self.registers[nonzero]
+            return b"S" + pairs.tobytes()
+        return b"D" + self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, precision=PRECISION):
+        data = bytes(data)
+        sketch = cls(precision)
+        if data[:1] == b"D":
+            sketch.registers = np.frombuffer(data[1:], dtype=np.uint8).copy()
+        else:
+            pairs = np.frombuffer(data[1:], dtype=[("reg", "<u2"), ("rho", "u1")])
+            sketch.registers[pairs["reg"]] = pairs["rho"]
+        return sketch
+
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS journey_xray_rollup (
+    aid bigint NOT NULL,
+    nid bigint NOT NULL,
+    channel text NOT NULL,
+    bucket timestamp without time zone NOT NULL,
+    events bigint NOT NULL,
+    users bigint NOT NULL,
+    uid_sketch bytea NOT NULL,
+    PRIMARY KEY (aid, nid, channel, bucket)
+);
+CREATE INDEX IF NOT EXISTS journey_xray_rollup_bucket ON journey_xray_rollup (bucket);
+CREATE TABLE IF NOT EXISTS journey_xray_rollup_state (
+    id int PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    bucket text NOT NULL,
+    precision int NOT NULL,
+    watermark timestamp without time zone,
+    refreshed_at timestamp with time zone
+);
+"""
+
+# Per (bucket key, HLL register): max rho and event count for the new rows.
+# Rows without a uid, aid or nid can't go into a sketch or a rollup key.
+# rho = leading zeros of the remaining (32 - p) hash bits + 1.
+_DELTA_SQL = """
+WITH hashed AS (
+    SELECT aid, nid, coalesce(channel, '') AS channel,
+           date_trunc(%(bucket)s, ts) AS bucket,
+           hashtext(uid::text)::bigint & 4294967295 AS h
+    FROM journey_xray
+    WHERE ts > %(low)s AND ts <= %(high)s
+      AND uid IS NOT NULL AND aid IS NOT NULL AND nid IS NOT NULL
+)
+SELECT aid, nid, channel, bucket,
+       (h & %(mask)s)::int AS reg,
+       max(%(wbits)s + 1 - length(ltrim((h >> %(p)s)::bit(32)::text, '0'))) AS rho,
+       count(*) AS events
+FROM hashed
+GROUP BY 1, 2, 3, 4, 5
+"""
+
+
+# Same registers for the events newer than the watermark (not rolled up yet)
+_TAIL_SQL = """
+SELECT (h & %(mask)s)::int AS reg,
+       max(%(wbits)s + 1 - length(ltrim((h >> %(p)s)::bit(32)::text, '0'))) AS rho
+FROM (
+    SELECT hashtext(uid::text)::bigint & 4294967295 AS h
+    FROM journey_xray
+    WHERE {filters}
+) hashed
+GROUP BY 1
+"""
+
+
+def create_tables():
+    with connection() as conn:
+        conn.execute(SCHEMA_SQL)
+        conn.execute(
+            """
+            INSERT INTO journey_xray_rollup_state (id, bucket, precision)
+            VALUES (1, %s, %s) ON CONFLICT (id) DO NOTHING
+            """,
+            (BUCKET, PRECISION),
+        )
+        conn.commit()
+
+
+def refresh():
+    """Fold journey_xray rows newer than the watermark into the rollup. Returns rows folded in."""
+    with connection() as conn:
+        with conn.transaction():
+            bucket, precision, low = conn.execute(
+                "SELECT bucket, precision, watermark FROM journey_xray_rollup_state "
+                "WHERE id = 1 FOR UPDATE"
+            ).fetchone()
+            high = conn.execute("SELECT max(ts) FROM journey_xray").fetchone()[0]
+            if high is None or (low is not None and high <= low):
+                return 0
+
+            delta = conn.execute(
+                _DELTA_SQL,
+                {
+                    "bucket": bucket,
+                    "low": low or "-infinity",
+                    "high": high,
+                    "mask": (1 << precision) - 1,
+                    "p": precision,
+                    "wbits": _HASH_BITS - precision,
+                },
+            ).fetchall()
+
+            touched = {}
+            folded = 0
+            for aid, nid, channel, bucket_ts, reg, rho, events in delta:
+                key = (aid, nid, channel, bucket_ts)
+                entry = touched.get(key)
+                if entry is None:
+                    entry = touched[key] = [0, [], []]
+                entry[0] += events
+                entry[1].append(reg)
+                entry[2].append(rho)
+                folded += events
+
+            # Only buckets at or after the old watermark can receive new rows
+            existing = {}
+            if low is not None:
+                for aid, nid, channel, bucket_ts, events, sketch in conn.execute(
+                    """
+                    SELECT aid, nid, channel, bucket, events, uid_sketch
+                    FROM journey_xray_rollup WHERE bucket >= date_trunc(%s, %s::timestamp)
+                    """,
+                    (bucket, low),
+                ):
+                    existing[(aid, nid, channel, bucket_ts)] = (events, sketch)
+
+            rows = []
+            for key, (events, regs, rhos) in touched.items():
+                sketch = HyperLogLog(precision)
+                old_events = 0
+                if key in existing:
+                    old_events, old_sketch = existing[key]
+                    sketch.merge(HyperLogLog.from_bytes(old_sketch, precision))
+                sketch.update(regs, rhos)
+                rows.append((*key, old_events + events, round(sketch.estimate()), sketch.to_bytes()))
+
+            with conn.cursor() as cur:
+                cur.executemany(
+                    """
+                    INSERT INTO journey_xray_rollup
+                        (aid, nid, channel, bucket, events, users, uid_sketch)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (aid, nid, channel, bucket) DO UPDATE SET
+                        events = EXCLUDED.events,
+                        users = EXCLUDED.users,
+                        uid_sketch = EXCLUDED.uid_sketch
+                    """,
+                    rows,
+                )
+            conn.execute(
+                "UPDATE journey_xray_rollup_state SET watermark = %s, refreshed_at = now() WHERE id = 1",
+                (high,),
+            )
+    return folded
+
+
+def distinct_users(aid, nid=None, channel=None, start=None, end=None):
+    """
+    Estimated distinct uid across all matching buckets (merged HLL sketches)
+    plus the events newer than the watermark, or None when the rollup
+    hasn't been built yet.
+    """
+    params = {"aid": aid, "nid": nid, "channel": channel, "start": start, "end": end}
+    filters = ["aid = %(aid)s"]
+    if nid is not None:
+        filters.append("nid = %(nid)s")
+    if channel is not None:
+        filters.append("coalesce(channel, '') = %(channel)s")
+    bucket_filters, ts_filters = list(filters), list(filters)
+    if start is not None:
+        bucket_filters.append("bucket >= %(start)s")
+        ts_filters.append("ts >= %(start)s")
+    if end is not None:
+        bucket_filters.append("bucket < %(end)s")
+        ts_filters.append("ts < %(end)s")
+
+    with connection() as conn:
+        state = conn.execute(
+            "SELECT precision, watermark FROM journey_xray_rollup_state WHERE id = 1"
+        ).fetchone()
+        if state is None or state[1] is None:
+            return None
+        precision, params["watermark"] = state
+        sketch = HyperLogLog(precision)
+        for (data,) in conn.execute(
+            f"SELECT uid_sketch FROM journey_xray_rollup WHERE {' AND '.join(bucket_filters)}",
+            params,
+        ):
+            sketch.merge(HyperLogLog.from_bytes(data, precision))
+
+        ts_filters += ["ts > %(watermark)s", "uid IS NOT NULL"]
+        tail = conn.execute(
+            _TAIL_SQL.format(filters=" AND ".join(ts_filters)),
+            {**params, "mask": (1 << precision) - 1, "p": precision, "wbits": _HASH_BITS - precision},
+        ).fetchall()
+        if tail:
+            regs, rhos = zip(*tail)
+            sketch.update(regs, rhos)
+    return round(sketch.estimate())
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def rollup_prompt():
+    """
+    Schema section advertising the rollup to the SQL generator, or "" when
+    the rollup has not been built yet.
+    """
+    try:
+        with connection() as conn:
+            row = conn.execute(
+                "SELECT bucket, watermark FROM journey_xray_rollup_state WHERE id = 1"
+            ).fetchone()
+    except Exception:
+        return ""
+    if row is None or row[1] is None:
+        return ""
+
+    bucket, watermark = row
+    return f"""
+- Rollup table journey_xray_rollup (pre-aggregated journey_xray, one row per
+  aid, nid, channel, {bucket} bucket; covers events with ts <= '{watermark}'):
+    aid: bigint
+    nid: bigint
+    channel: text ('' when journey_xray.channel is NULL)
+    bucket: timestamp without time zone (date_trunc('{bucket}', ts))
+    events: bigint (number of journey_xray rows in the bucket)
+    users: bigint (approximate distinct uid within that single bucket)
+  PREFER journey_xray_rollup for event counts (SUM(events)) and per-bucket user
+  counts grouped by aid/nid/channel/{bucket}. users is NOT additive across
+  buckets: NEVER SUM(users) or AVG(users). For distinct users over several
+  buckets, nodes or channels, use COUNT(DISTINCT uid) on journey_xray.
+  Never select uid_sketch.
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh journey_xray rollups")
+    parser.add_argument("--loop", type=float, default=0, help="refresh every N seconds")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    create_tables()
+    while True:
+        start = time.perf_counter()
+        folded = refresh()
+        print(f"Folded {folded:,} journey_xray rows in {time.perf_counter() - start:.2f}s")
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
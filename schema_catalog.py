@@ -0,0 +1,274 @@
+# schema_catalog.py
+"""
+Live description of the queried tables for the LLM prompts, introspected
+from information_schema and pg_stats instead of being hard-coded.
+
+For every column: type, nullability, estimated distinct values, the most
+common values (or the value range for ordered types) and a short note.
+The catalog is loaded once per process and re-validated at most every
+SCHEMA_REVALIDATE_S seconds against a cheap fingerprint (column list plus
+last ANALYZE time); it is only reloaded when that changed. If the database
+can't be introspected, the static column list below is used instead.
+"""
+import os
+import threading
+import time
+
+import streamlit as st
+
+from db import connection
+
+TABLES = tuple(
+    t.strip() for t in os.getenv("SCHEMA_TABLES", "journey_xray,papi_automation").split(",") if t.strip()
+)
+REVALIDATE = float(os.getenv("SCHEMA_REVALIDATE_S", 300))
+# Most common values shown per column, and their max length
+SAMPLE_VALUES = 5
+SAMPLE_CHARS = 40
+
+# Notes for columns without a COMMENT in the database
+NOTES = {
+    ("journey_xray", "aid"): "journey / automation id (= papi_automation.id)",
+    ("journey_xray", "channel"): "channel of communication",
+    ("journey_xray", "cid"): "client id",
+    ("journey_xray", "glreqid"): "global request id",
+    ("journey_xray", "nid"): "node id",
+    ("journey_xray", "ts"): "event timestamp",
+    ("journey_xray", "uid"): "user id",
+    ("papi_automation", "id"): "journey / automation id (= journey_xray.aid)",
+    ("papi_automation", "name"): "journey name",
+    ("papi_automation", "lp_content_parsed"): "journey metadata",
+    ("papi_automation", "nodedatarray"): "the nodes of the journey",
+    ("papi_automation", "linkdatarray"): "the links between the nodes",
+}
+
+# Used when the database can't be introspected
+FALLBACK_COLUMNS = {
+    "journey_xray": [
+        ("aid", "bigint"), ("channel", "text"), ("cid", "bigint"), ("glreqid", "text"),
+        ("nid", "bigint"), ("ts", "timestamp without time zone"), ("uid", "bigint"),
+    ],
+    "papi_automation": [
+        ("id", "bigint"), ("name", "text"),
+        ("created_date", "timestamp without time zone"),
+        ("from_date", "timestamp without time zone"),
+        ("to_date", "timestamp without time zone"),
+        ("updated_date", "timestamp without time zone"),
+        ("journey_xray_enabled", "bigint"), ("lp_content_parsed", "jsonb"),
+        ("linkdatarray", "jsonb"), ("nodedatarray", "jsonb"),
+    ],
+}
+
+# Types whose histogram bounds are shown as a min..max range
+_RANGE_TYPES = ("timestamp", "date", "integer", "bigint", "smallint", "numeric", "double", "real")
+# Types whose values are too large to be useful as samples
+_NO_SAMPLES = ("json", "jsonb", "bytea", "ARRAY")
+
+_FINGERPRINT_SQL = """
+SELECT
+    md5(string_agg(c.table_name || '.' || c.column_name || ':' || c.data_type, ','
+                   ORDER BY c.table_name, c.ordinal_position)),
+    (SELECT max(greatest(s.last_analyze, s.last_autoanalyze))::text
+     FROM pg_stat_user_tables s
+     WHERE s.schemaname = current_schema() AND s.relname = ANY(%(tables)s))
+FROM information_schema.columns c
+WHERE c.table_schema = current_schema() AND c.table_name = ANY(%(tables)s)
+"""
+
+_COLUMNS_SQL = """
+SELECT
+    c.table_name, c.column_name, c.data_type, c.is_nullable = 'YES',
+    col_description(format('%%I.%%I', c.table_schema, c.table_name)::regclass, c.ordinal_position),
+    s.n_distinct, s.null_frac,
+    s.most_common_vals::text::text[],
+    s.histogram_bounds::text::text[]
+FROM information_schema.columns c
+LEFT JOIN pg_stats s
+    ON s.schemaname = c.table_schema AND s.tablename = c.table_name AND s.attname = c.column_name
+WHERE c.table_schema = current_schema() AND c.table_name = ANY(%(tables)s)
+ORDER BY c.table_name, c.ordinal_position
+"""
+
+_ROWS_SQL = """
+SELECT c.relname, c.reltuples::bigint
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = current_schema() AND c.relname = ANY(%(tables)s)
+"""
+
+
+class Column:
+    def __init__(self, name, data_type, nullable=True, note=None, distinct=None,
+                 null_frac=None, samples=(), value_range=None):
+        self.name = name
+        self.data_type = data_type
+        self.nullable = nullable
+        self.note = note
+        self.distinct = distinct
+        self.null_frac = null_frac
+        self.samples = list(samples)
+        self.value_range = value_range
+
+    def describe(self):
+        parts = [self.note] if self.note else []
+        if self.distinct is not None:
+            parts.append(f"~{self.distinct:,} distinct")
+        if self.samples:
+            parts.append("e.g. " + ", ".join(_quote(v, self.data_type) for v in self.samples))
+        if self.value_range:
+            parts.append("range {} .. {}".format(*self.value_range))
+        if self.null_frac:
+            parts.append(f"{self.null_frac:.0%} NULL")
+        elif not self.nullable:
+            parts.append("NOT NULL")
+        return f"{self.name}: {self.data_type}" + (" — " + "; ".join(parts) if parts else "")
+
+
+class Table:
+    def __init__(self, name, columns, rows=None):
+        self.name = name
+        self.columns = columns
+        self.rows = rows
+
+
+def _quote(value, data_type):
+    if data_type in ("text", "character varying", "character") or data_type.startswith("timestamp"):
+        return "'" + value.replace("'", "''") + "'"
+    return value
+
+
+def _distinct(n_distinct, rows):
+    """pg_stats.n_distinct is either a count or, when negative, a fraction of the rows."""
+    if n_distinct is None:
+        return None
+    if n_distinct >= 0:
+        return int(n_distinct)
+    if rows and rows > 0:
+        return int(-n_distinct * rows)
+    return None
+
+
+def _column(table, name, data_type, nullable, comment, n_distinct, null_frac, common, bounds, rows):
+    samples = ()
+    if common and not data_type.startswith(_NO_SAMPLES):
+        samples = [v[:SAMPLE_CHARS] for v in common[:SAMPLE_VALUES] if v is not None]
+    value_range = None
+    if bounds and data_type.startswith(_RANGE_TYPES):
+        value_range = (bounds[0], bounds[-1])
+        if data_type.startswith("timestamp"):
+            value_range = tuple(f"'{v}'" for v in value_range)
+    return Column(
+        name, data_type, nullable,
+        note=comment or NOTES.get((table, name)),
+        distinct=_distinct(n_distinct, rows),
+        null_frac=null_frac,
+        samples=samples,
+        value_range=value_range,
+    )
+
+
+def introspect(tables=TABLES):
+    """{table: Table} for the tables that exist, from information_schema and pg_stats."""
+    params = {"tables": list(tables)}
+    with connection() as conn:
+        rows = dict(conn.execute(_ROWS_SQL, params).fetchall())
+        columns = conn.execute(_COLUMNS_SQL, params).fetchall()
+
+    catalog = {}
+    for table, *fields in columns:
+        # reltuples is -1 until the table is first analyzed
+        estimate = rows.get(table)
+        if estimate is not None and estimate < 0:
+            estimate = None
+        entry = catalog.setdefault(table, Table(table, [], estimate))
+        entry.columns.append(_column(table, *fields, estimate))
+    return {name: catalog[name] for name in tables if name in catalog}
+
+
+def fallback_catalog():
+    """The static column list, without statistics."""
+    return {
+        table: Table(table, [
+            Column(name, data_type, note=NOTES.get((table, name))) for name, data_type in columns
+        ])
+        for table, columns in FALLBACK_COLUMNS.items()
+    }
+
+
+def render(catalog):
+    """Schema section of the prompts."""
+    lines = []
+    for table in catalog.values():
+        size = f" (~{table.rows:,} rows)" if table.rows else ""
+        lines.append(f"- Columns of {table.name} table{size}:")
+        lines.extend(f"    {column.describe()}" for column in table.columns)
+        lines.append("")
+    return "\n".join(lines)
+
+
+class SchemaCatalog:
+    def __init__(self, tables=TABLES, revalidate=REVALIDATE):
+        self.tables = tables
+        self.revalidate = revalidate
+        self.loads = 0
+        self.error = None
+        self._catalog = None
+        self._prompt = None
+        self._fingerprint = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _fetch_fingerprint(self):
+        with connection() as conn:
+            return conn.execute(_FINGERPRINT_SQL, {"tables": list(self.tables)}).fetchone()
+
+    def catalog(self):
+        """
+        The live catalog, or None if the database can't be introspected.
+        Re-validated at most every `revalidate` seconds.
+        """
+        with self._lock:
+            fresh = (
+                self._checked_at is not None
+                and time.monotonic() - self._checked_at < self.revalidate
+            )
+            if fresh:
+                return self._catalog
+            try:
+                fingerprint = self._fetch_fingerprint()
+                if fingerprint != self._fingerprint or self._catalog is None:
+                    self._catalog = introspect(self.tables) or None
+                    self._prompt = render(self._catalog) if self._catalog else None
+                    self._fingerprint = fingerprint
+                    self.loads += 1
+                self.error = None
+            except Exception as e:
+                # Keep serving the last good catalog; retry after `revalidate`
+                self.error = str(e)
+            self._checked_at = time.monotonic()
+            return self._catalog
+
+    def prompt(self):
+        """Live schema section, or None (callers fall back to a static description)."""
+        self.catalog()
+        return self._prompt
+
+    def stats(self):
+        catalog = self._catalog or {}
+        return {
+            "tables": len(catalog),
+            "columns": sum(len(t.columns) for t in catalog.values()),
+            "loads": self.loads,
+            "age_s": round(time.monotonic() - self._checked_at) if self._checked_at else None,
+            "error": self.error,
+        }
+
+
+@st.cache_resource(show_spinner=False)
+def get_schema_catalog():
+    return SchemaCatalog()
+
+
+def schema_prompt():
+    """Schema section for the SQL prompt: live when possible, the static column list otherwise."""
+    return get_schema_catalog().prompt() or render(fallback_catalog())
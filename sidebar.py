@@ -1,5 +1,16 @@
 # sidebar.py
+import numpy as np
+import pandas as pd
 import streamlit as st
+from db import pool_stats
+from result_cache import get_result_cache
+from llm_cache import get_llm_cache
+from journey_graph import get_graph_cache
+from templates import get_template_registry
+from schema_catalog import get_schema_catalog
+from replica import get_replica
+from tracing import durations, get_trace, stage_stats
+from jobs import current_session_id, get_scheduler
 
 def render_sidebar():
     with st.sidebar:
@@ -13,14 +24,142 @@ def render_sidebar():
             - get all the nodes for id 10
             """
         )
+        st.divider()
+        st.toggle(
+            "⚡ Approximate mode",
+            key="approximate",
+            help="Answer count/sum questions on journey_xray from a small table sample, "
+                 "with confidence intervals. Much faster on large journeys."
+        )
+
         st.divider()
         st.markdown("### ⚙️ System Status")
         st.success("UI Loaded")
         st.info("Model: Gemini 2.5 Flash")
 
+        try:
+            stats = pool_stats()
+            st.caption(
+                f"DB pool: {stats['pool_size'] - stats['pool_available']}/{stats['pool_size']} in use "
+                f"(max {stats['pool_max']}), {stats['requests_waiting']} waiting · "
+                f"avg wait {stats['avg_wait_ms']} ms, max {stats['max_wait_ms']} ms "
+                f"over {stats['checkouts']} checkouts"
+            )
+        except Exception:
+            st.warning("DB pool unavailable")
+
+        cache = get_result_cache().stats()
+        st.caption(
+            f"Result cache: {cache['hits']} hits / {cache['misses']} misses "
+            f"({cache['hit_rate']:.0%}), {cache['entries']} entries, "
+            f"{cache['bytes'] / 1024 / 1024:.1f} MB"
+        )
+
+        graphs = get_graph_cache().stats()
+        st.caption(
+            f"Journey graph cache: {graphs['graphs']} graphs, "
+            f"{graphs['hits']} hits / {graphs['misses']} misses"
+        )
+
+        schema = get_schema_catalog().stats()
+        if schema["error"]:
+            st.caption("Schema catalog: unavailable, using the static column list")
+        elif schema["tables"]:
+            st.caption(
+                f"Schema catalog: {schema['tables']} tables, {schema['columns']} columns · "
+                f"checked {schema['age_s']}s ago, loaded {schema['loads']}×"
+            )
+
+        replica = get_replica()
+        if replica.status():
+            stats = replica.stats()
+            st.caption(
+                f"Local replica: {stats['events']:,} events as of {stats['watermark']} · "
+                f"{stats['served']} served, {stats['fallbacks']} fell back, {stats['stale']} too stale"
+            )
+        elif replica.error:
+            st.caption(f"Local replica: unavailable ({replica.error})")
+
+        jobs = get_scheduler().stats()
+        st.caption(
+            f"Query workers: {jobs['running']} running, {jobs['queued']} queued "
+            f"({jobs['sessions_queued']} sessions) · {jobs['deduplicated']} shared, "
+            f"{jobs['cancelled']} cancelled, {jobs['rejected']} rejected"
+        )
+
+        templates = get_template_registry().stats()
+        st.caption(
+            f"Query templates: {templates['templates']} shapes, "
+            f"{templates['prepared']} prepared runs, "
+            f"{templates['skipped_llm']} answered without the LLM"
+        )
+
+        if st.session_state.prompt_tokens:
+            st.caption(
+                "Prompt tokens (last turn, est.): "
+                + ", ".join(f"{call} ~{tokens}" for call, tokens in st.session_state.prompt_tokens.items())
+            )
+
+        llm_stats = get_llm_cache().stats()
+        st.caption(
+            f"LLM cache: {llm_stats['hits']} hits / {llm_stats['misses']} misses "
+            f"({llm_stats['hit_rate']:.0%})"
+            + (" · bypassed" if llm_stats["bypass"] else "")
+        )
+
+        render_timing()
+
         if st.button("🔄 Reset Conversation"):
+            if st.session_state.turn_token is not None:
+                st.session_state.turn_token.cancel("conversation reset")
+            get_scheduler().cancel_session(current_session_id())
             st.session_state.messages = []
             st.session_state.last_sql = None
             st.session_state.last_result_summary = None
+            st.session_state.last_df = None
             st.session_state.query_history = []
+            st.session_state.prompt_tokens = {}
             st.rerun()
+
+
+def render_timing():
+    """Per-stage breakdown of the last turn plus p50/p95 across recent turns."""
+    stats = stage_stats()
+    if not stats:
+        return
+
+    with st.expander("⏱️ Latency"):
+        spans = get_trace(st.session_state.last_trace)
+        if spans:
+            root = next((s.start_ns for s in spans if s.parent_id is None), spans[0].start_ns)
+            st.markdown("**Last turn**")
+            st.dataframe(
+                pd.DataFrame(
+                    {
+                        "stage": s.name,
+                        "start_ms": round((s.start_ns - root) / 1e6, 1),
+                        "ms": round(s.duration_ms, 1),
+                        "details": ", ".join(
+                            f"{k}={v}" for k, v in s.attributes.items() if k != "question"
+                        ),
+                    }
+                    for s in spans
+                ),
+                hide_index=True,
+                use_container_width=True,
+            )
+
+        st.markdown("**Recent turns**")
+        st.dataframe(
+            pd.DataFrame.from_dict(stats, orient="index").sort_values("p95_ms", ascending=False),
+            use_container_width=True,
+        )
+
+        turns = durations("turn")
+        if len(turns) > 1:
+            counts, edges = np.histogram(np.asarray(turns) / 1000, bins=min(10, len(turns)))
+            st.caption("Turn latency histogram (s)")
+            st.bar_chart(
+                pd.Series(counts, index=[f"{edge:.1f}" for edge in edges[:-1]]),
+                height=140,
+            )
@@ -15,9 +15,45 @@ def init_session_state():
     if "query_history" not in st.session_state:
         st.session_state.query_history = []
 
+    if "prompt_tokens" not in st.session_state:
+        st.session_state.prompt_tokens = {}
+
+    if "approximate" not in st.session_state:
+        st.session_state.approximate = False
+
+    if "last_trace" not in st.session_state:
+        st.session_state.last_trace = None
+
+    if "last_df" not in st.session_state:
+        st.session_state.last_df = None
+
+    if "turn_token" not in st.session_state:
+        st.session_state.turn_token = None
+
+class IncrementalSummary:
+    """summarize_df computed chunk by chunk, without the full frame."""
+
+    def __init__(self, sample_size=3):
+        self.sample_size = sample_size
+        self.row_count = 0
+        self.columns = None
+        self.sample_rows = []
+
+    def update(self, chunk: pd.DataFrame):
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+        missing = self.sample_size - len(self.sample_rows)
+        if missing > 0:
+            self.sample_rows.extend(chunk.head(missing).to_dict(orient="records"))
+        self.row_count += len(chunk)
+        return self
+
+    def result(self):
+        return {
+            "row_count": self.row_count,
+            "columns": self.columns or [],
+            "sample_rows": self.sample_rows
+        }
+
 def summarize_df(df: pd.DataFrame):
-    return {
-        "row_count": len(df),
-        "columns": list(df.columns),
-        "sample_rows": df.head(3).to_dict(orient="records")
-    }
\ No newline at end of file
+    return IncrementalSummary().update(df).result()
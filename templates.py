@@ -0,0 +1,161 @@
+# templates.py
+"""
+Parameterized templates for recurring query shapes.
+
+Generated SQL that compares an id column to an integer literal
+(`WHERE aid = 129`, `p.id = 7`) is reduced to a template with %s
+placeholders. Once a template has been seen it is run as a prepared
+statement with bound parameters. Questions that produced a template are
+remembered by their shape ("list all users for aid={n}"), so the same
+question with a different id skips the LLM. A shape is only learned when
+every number in the question is one of the bound ids (otherwise "top 10"
+would replay LIMIT 10 for "top 20") and the question was asked without
+earlier turns in the prompt, since the registry is shared by all sessions.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+
+from result_cache import normalize_sql
+
+MAX_TEMPLATES = int(os.getenv("TEMPLATE_MAX", 512))
+
+_ID_LITERAL_RE = re.compile(
+    r"\b((?:[a-z_][a-z0-9_]*\.)?(?:aid|id|nid|cid|uid))(\s*=\s*)(\d+)\b(?!\s*\.)", re.I
+)
+_NUMBER_RE = re.compile(r"\d+")
+# Questions that depend on the previous turn can't be replayed from their text alone
+_CONTEXTUAL_RE = re.compile(
+    r"\b(only|filter|breakdown|sort|this|that|these|above|previous|earlier|first query|same)\b", re.I
+)
+
+
+def parameterize(sql):
+    """(template_sql, params) with id literals replaced by %s, or (None, ()) if there are none."""
+    # Outside the placeholders, % must be escaped for psycopg
+    escaped = sql.replace("%", "%%")
+    params = []
+
+    def bind(m):
+        params.append(int(m.group(3)))
+        return f"{m.group(1)}{m.group(2)}%s"
+
+    template = _ID_LITERAL_RE.sub(bind, escaped)
+    if not params:
+        return None, ()
+    return template, tuple(params)
+
+
+def render_sql(template, params):
+    """Inline integer params back into a template for display and logging."""
+    values = iter(params)
+    return re.sub(r"%%|%s", lambda m: "%" if m.group() == "%%" else str(int(next(values))), template)
+
+
+def question_shape(question):
+    """(shape, numbers) for a question, or None when it refers to earlier turns."""
+    text = " ".join(question.lower().split())
+    if _CONTEXTUAL_RE.search(text):
+        return None
+    numbers = [int(n) for n in _NUMBER_RE.findall(text)]
+    if not numbers:
+        return None
+    return _NUMBER_RE.sub("{n}", text), numbers
+
+
+def _param_mapping(numbers, params):
+    """
+    Index into numbers for each param, or None unless every param comes
+    from a number in the question and every number is used by a param.
+    """
+    unused = list(range(len(numbers)))
+    mapping = []
+    for param in params:
+        index = next((i for i in unused if numbers[i] == param), None)
+        if index is None:
+            # The same number may fill several params (aid = 5 ... p.id = 5)
+            index = numbers.index(param) if param in numbers else None
+            if index is None:
+                return None
+        else:
+            unused.remove(index)
+        mapping.append(index)
+    return tuple(mapping) if not unused else None
+
+
+class TemplateRegistry:
+    """Process-wide LRU of seen templates and of question shapes learned from them."""
+
+    def __init__(self, max_templates=MAX_TEMPLATES):
+        self.max_templates = max_templates
+        self._templates = OrderedDict()  # normalized template -> times seen
+        self._questions = OrderedDict()  # question shape -> (template, param -> number index)
+        self._lock = threading.Lock()
+        self.prepared = 0
+        self.skipped_llm = 0
+
+    def observe(self, question, sql, learn=True):
+        """
+        Record generated SQL. Returns (template, params, known); known is
+        True when the template was seen before and should run prepared.
+        template is None when the SQL has no id literals. Pass learn=False
+        when the SQL may depend on earlier turns, so the question shape
+        isn't remembered.
+        """
+        template, params = parameterize(sql)
+        if template is None:
+            return None, (), False
+
+        key = normalize_sql(template)
+        with self._lock:
+            known = key in self._templates
+            self._templates[key] = self._templates.get(key, 0) + 1
+            self._templates.move_to_end(key)
+            self._evict(self._templates)
+            if known:
+                self.prepared += 1
+
+            shape = question_shape(question) if learn else None
+            mapping = _param_mapping(shape[1], params) if shape else None
+            if mapping is not None:
+                text = shape[0]
+                self._questions[text] = (template, mapping)
+                self._questions.move_to_end(text)
+                self._evict(self._questions)
+        return template, params, known
+
+    def match_question(self, question):
+        """(template, params) when the question is a learned shape with new ids, else None."""
+        shape = question_shape(question)
+        if not shape:
+            return None
+        text, numbers = shape
+        with self._lock:
+            learned = self._questions.get(text)
+            if learned is None:
+                return None
+            self._questions.move_to_end(text)
+            self.skipped_llm += 1
+        template, mapping = learned
+        return template, tuple(numbers[i] for i in mapping)
+
+    def _evict(self, entries):
+        while len(entries) > self.max_templates:
+            entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "templates": len(self._templates),
+                "questions": len(self._questions),
+                "prepared": self.prepared,
+                "skipped_llm": self.skipped_llm,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def get_template_registry():
+    return TemplateRegistry()
@@ -0,0 +1,42 @@
+# tests/test_approx.py
+import pandas as pd
+import pytest
+
+from approx import approximate_query
+
+
+def test_counts_are_sampled_and_scaled_with_intervals():
+    approximation = approximate_query(
+        "SELECT nid, count(*) AS events, sum(cid) FROM journey_xray x WHERE aid = 1 GROUP BY nid",
+        percent=1, seed=7,
+    )
+    assert "journey_xray x TABLESAMPLE SYSTEM (1) REPEATABLE (7)" in approximation.sql
+    df = approximation.scale(pd.DataFrame({"nid": [1], "events": [100], "sum": [50.0]}))
+    assert list(df.columns) == ["nid", "events", "events_ci_low", "events_ci_high", "sum"]
+    assert df.events[0] == 10_000 and df["sum"][0] == 5000.0
+    assert df.events_ci_low[0] < 10_000 < df.events_ci_high[0]
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT count(DISTINCT uid) FROM journey_xray WHERE aid = 1",
+    "SELECT nid, count(*), count( distinct uid) FROM journey_xray GROUP BY nid",
+    "SELECT nid, count(*) FROM journey_xray GROUP BY nid HAVING count(*) > 100",
+])
+def test_distinct_aggregates_and_having_run_exact(sql):
+    assert approximate_query(sql) is None
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM journey_xray WHERE aid = 1",
+    "SELECT uid FROM journey_xray WHERE aid = 1",
+    "SELECT count(*) FROM journey_xray a JOIN journey_xray b USING (uid)",
+    "SELECT count(*) FROM papi_automation",
+])
+def test_non_aggregate_or_unsupported_queries_run_exact(sql):
+    assert approximate_query(sql) is None
+
+
+def test_result_with_unexpected_shape_is_left_alone():
+    approximation = approximate_query("SELECT count(*) FROM journey_xray")
+    df = pd.DataFrame({"a": [1], "b": [2]})
+    assert approximation.scale(df) is df
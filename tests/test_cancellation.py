@@ -0,0 +1,113 @@
+# tests/test_cancellation.py
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from cancellation import Cancelled, CancelToken, DeadlineExceeded
+
+
+def test_cancel_runs_callbacks_once():
+    token = CancelToken()
+    calls = []
+    token.on_cancel(lambda: calls.append("a"))
+    token.cancel("new question")
+    token.cancel("again")
+    assert calls == ["a"]
+    assert token.reason == "new question"
+    with pytest.raises(Cancelled, match="new question"):
+        token.raise_if_cancelled()
+
+
+def test_unregistered_callbacks_do_not_run():
+    token = CancelToken()
+    calls = []
+    unregister = token.on_cancel(lambda: calls.append("a"))
+    unregister()
+    token.cancel()
+    assert calls == []
+
+
+def test_callback_registered_after_cancel_runs_immediately():
+    token = CancelToken()
+    token.cancel()
+    calls = []
+    token.on_cancel(lambda: calls.append("a"))
+    assert calls == ["a"]
+
+
+def test_failing_callback_does_not_block_the_others():
+    token = CancelToken()
+    calls = []
+    token.on_cancel(lambda: 1 / 0)
+    token.on_cancel(lambda: calls.append("b"))
+    token.cancel()
+    assert calls == ["b"]
+
+
+def test_deadline_cancels_with_deadline_exceeded():
+    token = CancelToken(0.05, "query")
+    fired = threading.Event()
+    token.on_cancel(fired.set)
+    assert fired.wait(2)
+    assert isinstance(token.error(), DeadlineExceeded)
+
+
+def test_child_is_cancelled_with_its_parent_and_bounded_by_its_deadline():
+    parent = CancelToken(10)
+    child = parent.child(60, "llm")
+    assert child.remaining() <= 10
+    parent.cancel("superseded")
+    assert child.reason == "superseded"
+
+
+def test_cancelling_a_child_leaves_the_parent_running():
+    parent = CancelToken()
+    child = parent.child(name="llm")
+    child.cancel()
+    assert not parent.cancelled
+    assert parent._callbacks == []  # the child's hook on the parent was removed
+
+
+def test_close_stops_the_deadline_without_cancelling():
+    token = CancelToken(0.05)
+    token.close()
+    time.sleep(0.1)
+    assert not token.cancelled
+
+
+class FakeChat:
+    """Mimics ChatSession: history grows by (sent, received) per answered message."""
+
+    def __init__(self, responses):
+        self.history = ["earlier question", "earlier answer"]
+        self.responses = responses
+
+    async def send_message_async(self, content):
+        response = self.responses.pop(0)
+        if response is None:
+            await asyncio.sleep(10)  # a slow Gemini call
+        self.history += [content, response]
+        return response
+
+
+def test_cancelled_agent_turn_rolls_back_the_chat_history():
+    bridge_module = pytest.importorskip("gemini_neon_bridge")
+    bridge = bridge_module.GeminiNeonBridge("neon", "gemini", "project")
+    bridge.session = object()
+    bridge.model = object()
+    call = SimpleNamespace(function_call=SimpleNamespace(name="run_sql", args={}))
+    wants_tool = SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[call]))])
+    bridge.chat = FakeChat([wants_tool, None])
+
+    async def tool(name, args):
+        return {"result": "ok"}
+
+    bridge.execute_tool_call = tool
+    token = CancelToken(0.2, "agent")
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(bridge.chat_with_gemini("question", token=token))
+    # The unanswered function_call is gone; the next message starts clean
+    assert bridge.chat.history == ["earlier question", "earlier answer"]
@@ -0,0 +1,40 @@
+# tests/test_context.py
+from context import compact_rows, compress_history, estimate_tokens
+
+
+def turn(i, sample=None):
+    return {
+        "sql": f"SELECT * FROM journey_xray WHERE aid = {i}",
+        "summary": {"row_count": 10, "columns": ["aid", "nid"], "sample_rows": sample or [{"aid": i, "nid": 1}]},
+        "explanation": "word " * 100,
+    }
+
+
+def test_long_sample_values_are_cut():
+    rows = compact_rows([{"id": 7, "nodedatarray": [{"key": n} for n in range(1000)]}], chars=50)
+    assert rows[0]["id"] == 7
+    assert len(rows[0]["nodedatarray"]) < 80 and rows[0]["nodedatarray"].endswith("chars)")
+
+
+def test_latest_turn_sample_rows_are_cut_and_trimmed_to_budget():
+    huge = [{"nodedatarray": "x" * 50_000} for _ in range(3)]
+    history = [turn(i) for i in range(1, 6)] + [turn(6, huge)]
+    compressed = compress_history(history, budget=1000)
+    assert estimate_tokens(str(compressed)) <= 1000
+    assert compressed[-1]["sql"].endswith("aid = 6")
+    # the caller's history is left untouched
+    assert history[-1]["summary"]["sample_rows"] == huge
+
+
+def test_first_turn_survives_when_older_turns_are_dropped():
+    history = [turn(i) for i in range(1, 12)]
+    compressed = compress_history(history, budget=700, recent_turns=3)
+    assert compressed[0]["turn"] == 1
+    assert compressed[-1]["turn"] == 11
+
+
+def test_everything_is_kept_within_budget():
+    history = [turn(i) for i in range(1, 3)]
+    compressed = compress_history(history, budget=100_000)
+    assert [t["turn"] for t in compressed] == [1, 2]
+    assert compressed[-1]["summary"]["sample_rows"] == [{"aid": 2, "nid": 1}]
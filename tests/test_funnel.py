@@ -0,0 +1,62 @@
+# tests/test_funnel.py
+import pytest
+
+from funnel import match_funnel_question
+
+
+@pytest.mark.parametrize("question, route", [
+    ("how many users per node for aid 129", ("node_reach", 129)),
+    ("show the drop-off between nodes for journey 12", ("link_conversion", 12)),
+    ("channel mix for aid=5", ("channel_mix", 5)),
+    ("get all the nodes for id 10", ("nodes", 10)),
+    ("list the links of automation #3", ("links", 3)),
+    ("nodes of journey 7?", ("nodes", 7)),
+    ("What are the edges in aid=4", ("links", 4)),
+])
+def test_structural_questions_are_routed(question, route):
+    assert match_funnel_question(question) == route
+
+
+@pytest.mark.parametrize("question", [
+    "how many users reached each node in aid 129 last week",
+    "drop-off for aid=129 between 2025-01-01 and 2025-01-31",
+    "conversion of email users for aid 129",
+    "which nodes did uid 5 visit in journey 12",
+    "users per node for aid 129 since monday",
+    "funnel for aid 129 in march",
+    "top 5 nodes by users for aid 129",
+    "users per node for aid 129 where channel = sms",
+    "list all users for aid=129",
+    "show nodes with the most users for aid 129",
+    "what share of users reached each of the nodes in aid 5",
+    "list the nodes that no user reached for aid 3",
+    "which links are never taken in journey 8",
+    "list the nodes of journey 12 sorted by label",
+])
+def test_constrained_or_unrelated_questions_go_to_the_llm(question):
+    assert match_funnel_question(question) is None
+
+
+@pytest.mark.parametrize("question", [
+    "how many users for aid 129",
+    "number of unique users in journey 129",
+    "count distinct users for aid=129",
+])
+def test_distinct_user_counts_use_the_rollup(question):
+    assert match_funnel_question(question, approximate=True) == ("distinct_users", 129)
+
+
+@pytest.mark.parametrize("question", [
+    "how many users for aid 129",
+    "count users for aid=129",
+])
+def test_distinct_user_counts_are_exact_without_approximate_mode(question):
+    # An HLL estimate is only given to users who opted into approximate answers
+    assert match_funnel_question(question) is None
+
+
+def test_per_node_user_counts_are_not_a_single_distinct_count():
+    for approximate in (False, True):
+        assert match_funnel_question(
+            "how many users per node for aid 129", approximate=approximate
+        ) == ("node_reach", 129)
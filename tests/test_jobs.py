@@ -0,0 +1,132 @@
+# tests/test_jobs.py
+import threading
+
+import pandas as pd
+import pytest
+
+from jobs import JobCancelled, QueryScheduler, QueueFull
+
+
+class GatedSource:
+    """Chunked source that blocks before each chunk until released."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.cancelled = None
+
+    def __iter__(self):
+        self.started.set()
+        for chunk in self.chunks:
+            self.release.wait(5)
+            yield chunk
+
+    def cancel(self, reason):
+        self.cancelled = reason
+        self.release.set()
+
+
+def frame(n):
+    return pd.DataFrame({"x": range(n)})
+
+
+def test_round_robin_across_sessions():
+    # No workers: jobs stay queued and are popped by hand
+    scheduler = QueryScheduler(workers=0)
+    for key in ("a1", "a2", "a3"):
+        scheduler.submit("alice", key, lambda: frame(1))
+    scheduler.submit("bob", "b1", lambda: frame(1))
+    scheduler.submit("carol", "c1", lambda: frame(1))
+
+    order = [scheduler._next_job().key for _ in range(5)]
+    assert order == ["a1", "b1", "c1", "a2", "a3"]
+    assert scheduler.stats()["queued"] == 0
+
+
+def test_identical_keys_share_one_job():
+    scheduler = QueryScheduler(workers=0)
+    first = scheduler.submit("alice", "same", lambda: frame(1))
+    second = scheduler.submit("bob", "same", lambda: frame(1))
+    assert second.job is first.job
+    assert second.shared and not first.shared
+    stats = scheduler.stats()
+    assert stats["queued"] == 1
+    assert stats["submitted"] == 1 and stats["deduplicated"] == 1
+
+
+def test_queue_full_rejects():
+    scheduler = QueryScheduler(workers=0, max_queue=2)
+    scheduler.submit("alice", "k1", lambda: frame(1))
+    scheduler.submit("alice", "k2", lambda: frame(1))
+    with pytest.raises(QueueFull):
+        scheduler.submit("bob", "k3", lambda: frame(1))
+    # Attaching to an in-flight job does not need a queue slot
+    scheduler.submit("bob", "k1", lambda: frame(1))
+    assert scheduler.stats()["rejected"] == 1
+
+
+def test_queued_job_is_dropped_once_every_session_detaches():
+    scheduler = QueryScheduler(workers=0)
+    first = scheduler.submit("alice", "k", lambda: frame(1))
+    scheduler.submit("bob", "k", lambda: frame(1))
+
+    scheduler.cancel_session("alice")
+    assert not first.job.cancelled
+    assert scheduler.stats()["queued"] == 1
+
+    scheduler.cancel_session("bob")
+    assert first.job.cancelled
+    stats = scheduler.stats()
+    assert stats["queued"] == 0 and stats["sessions_queued"] == 0
+    assert stats["cancelled"] == 1
+    # A new submission with the same key runs afresh
+    again = scheduler.submit("alice", "k", lambda: frame(1))
+    assert again.job is not first.job
+
+
+def test_handle_streams_chunks_and_frame():
+    scheduler = QueryScheduler(workers=1)
+    source = GatedSource([frame(2), frame(3)])
+    source.release.set()
+    handle = scheduler.submit("alice", "k", source)
+    assert [len(chunk) for chunk in handle] == [2, 3]
+    assert handle.state == "done"
+    assert handle.rows == 5
+    assert len(handle.frame()) == 5
+
+
+def test_callable_error_is_raised_to_the_reader():
+    def boom():
+        raise ValueError("bad query")
+
+    scheduler = QueryScheduler(workers=1)
+    handle = scheduler.submit("alice", "k", boom)
+    with pytest.raises(ValueError, match="bad query"):
+        list(handle)
+
+
+def test_cancel_session_aborts_running_job():
+    scheduler = QueryScheduler(workers=1)
+    source = GatedSource([frame(1), frame(1)])
+    handle = scheduler.submit("alice", "k", source)
+    assert source.started.wait(5)
+
+    scheduler.cancel_session("alice")
+    assert source.cancelled == "abandoned by every session waiting on it"
+    with pytest.raises(JobCancelled):
+        list(handle)
+
+
+def test_running_job_survives_while_another_session_waits():
+    scheduler = QueryScheduler(workers=1)
+    source = GatedSource([frame(4)])
+    first = scheduler.submit("alice", "k", source)
+    second = scheduler.submit("bob", "k", source)
+    assert source.started.wait(5)
+
+    scheduler.cancel_session("alice")
+    assert source.cancelled is None
+    source.release.set()
+    assert sum(len(chunk) for chunk in second) == 4
+    assert first.job is second.job
@@ -0,0 +1,79 @@
+# tests/test_plan_guard.py
+import pytest
+
+import plan_guard
+from plan_guard import PlanRejected, check_plan
+
+
+def fake_explain(plans):
+    """EXPLAIN stand-in: plans maps a SQL prefix to its top plan node."""
+    calls = []
+
+    def explain(sql, params=None):
+        calls.append(sql)
+        for prefix, plan in plans.items():
+            if sql.startswith(prefix):
+                return {"Node Type": "Seq Scan", **plan}
+        raise AssertionError(f"unexpected EXPLAIN: {sql}")
+
+    return explain, calls
+
+
+def test_cheap_query_passes_unchanged(monkeypatch):
+    explain, calls = fake_explain({"SELECT": {"Total Cost": 100.0, "Plan Rows": 10}})
+    monkeypatch.setattr(plan_guard, "explain", explain)
+
+    check = check_plan("SELECT 1", max_cost=1000, max_rows=100)
+    assert check.sql == "SELECT 1"
+    assert check.rewritten_from is None
+    assert calls == ["SELECT 1"]
+    assert "LIMIT" not in check.describe()
+    assert not check.capped(10_000)
+
+
+def test_wide_result_gets_a_limit(monkeypatch):
+    explain, calls = fake_explain({
+        "SELECT * FROM (": {"Total Cost": 500.0, "Plan Rows": 100},
+        "SELECT uid": {"Total Cost": 900.0, "Plan Rows": 50_000},
+    })
+    monkeypatch.setattr(plan_guard, "explain", explain)
+
+    check = check_plan("SELECT uid FROM journey_xray", max_cost=1000, max_rows=100)
+    assert check.sql == "SELECT * FROM (SELECT uid FROM journey_xray) AS guarded LIMIT 100"
+    assert check.rewritten_from == "SELECT uid FROM journey_xray"
+    assert check.cost == 500.0
+    assert len(calls) == 2
+    assert "LIMIT 100 injected" in check.describe()
+    # A result that fills the LIMIT may be missing rows; a shorter one is complete
+    assert check.capped(100)
+    assert not check.capped(99)
+
+
+def test_expensive_query_is_rejected(monkeypatch):
+    explain, _ = fake_explain({"SELECT": {"Total Cost": 2e7, "Plan Rows": 10}})
+    monkeypatch.setattr(plan_guard, "explain", explain)
+
+    with pytest.raises(PlanRejected, match="exceeds") as excinfo:
+        check_plan("SELECT count(*) FROM journey_xray", max_cost=1e6, max_rows=100)
+    assert excinfo.value.plan["Total Cost"] == 2e7
+
+
+def test_limit_that_stays_expensive_is_rejected(monkeypatch):
+    explain, _ = fake_explain({"SELECT": {"Total Cost": 2e7, "Plan Rows": 1e6}})
+    monkeypatch.setattr(plan_guard, "explain", explain)
+
+    with pytest.raises(PlanRejected):
+        check_plan("SELECT * FROM journey_xray ORDER BY ts", max_cost=1e6, max_rows=100)
+
+
+def test_params_are_passed_to_explain(monkeypatch):
+    seen = []
+    monkeypatch.setattr(
+        plan_guard,
+        "explain",
+        lambda sql, params=None: seen.append(params)
+        or {"Node Type": "Index Scan", "Total Cost": 1.0, "Plan Rows": 1},
+    )
+    check = check_plan("SELECT * FROM journey_xray WHERE aid = %s", params=("a1",))
+    assert seen == [("a1",)]
+    assert check.params == ("a1",)
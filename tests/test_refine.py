@@ -0,0 +1,89 @@
+# tests/test_refine.py
+import pandas as pd
+import pytest
+
+import refine
+from refine import refine_locally
+
+LAST = "SELECT * FROM journey_xray WHERE aid = 1 OR nid = 30"
+
+
+@pytest.fixture
+def events():
+    return pd.DataFrame({
+        "aid": [1, 1, 2, 2, 1],
+        "nid": [10, 30, 30, 20, 20],
+        "uid": [6, 6, 7, None, 8],
+    })
+
+
+def test_extra_condition_filters_previous_result(events):
+    last = "SELECT * FROM journey_xray WHERE aid = 1"
+    df = events[events.aid == 1].reset_index(drop=True)
+    out = refine_locally("SELECT * FROM journey_xray WHERE aid = 1 AND nid = 20", last, df)
+    assert out.to_dict("records") == [{"aid": 1, "nid": 20, "uid": 8.0}]
+
+
+def test_or_binds_looser_than_and(events):
+    df = events[(events.aid == 1) | (events.nid == 30)].reset_index(drop=True)
+    # (uid = 6 AND aid = 1) OR nid = 30 is not "the previous WHERE AND uid = 6"
+    sql = "SELECT * FROM journey_xray WHERE uid = 6 AND aid = 1 OR nid = 30"
+    assert refine_locally(sql, LAST, df) is None
+
+
+def test_or_with_previous_conjuncts_falls_back(events):
+    last = "SELECT * FROM journey_xray WHERE aid = 1 AND nid = 10 OR nid = 30"
+    df = events[((events.aid == 1) & (events.nid == 10)) | (events.nid == 30)].reset_index(drop=True)
+    sql = "SELECT * FROM journey_xray WHERE aid = 1 AND nid = 10 OR nid = 30 AND uid = 6"
+    assert refine_locally(sql, last, df) is None
+
+
+def test_parenthesized_previous_condition_is_kept(events):
+    df = events[(events.aid == 1) | (events.nid == 30)].reset_index(drop=True)
+    sql = "SELECT * FROM journey_xray WHERE (aid = 1 OR nid = 30) AND uid = 6"
+    out = refine_locally(sql, LAST, df)
+    assert out[["aid", "nid"]].values.tolist() == [[1, 10], [1, 30]]
+
+
+def test_wrapped_query_respects_precedence(events):
+    df = events[(events.aid == 1) | (events.nid == 30)].reset_index(drop=True)
+    sql = f"SELECT * FROM ({LAST}) AS t WHERE uid = 6 AND aid = 1 OR nid = 30"
+    out = refine_locally(sql, LAST, df)
+    expected = df[((df.uid == 6) & (df.aid == 1)) | (df.nid == 30)]
+    assert out.values.tolist() == expected.values.tolist()
+
+
+def test_null_comparison_is_unknown(events):
+    last = "SELECT * FROM journey_xray WHERE aid = 2"
+    df = events[events.aid == 2].reset_index(drop=True)
+    out = refine_locally("SELECT * FROM journey_xray WHERE aid = 2 AND NOT uid = 7", last, df)
+    assert out.empty
+
+
+def test_order_by_desc_puts_nulls_first(events):
+    last = "SELECT * FROM journey_xray WHERE aid = 2"
+    df = events[events.aid == 2].reset_index(drop=True)
+    out = refine_locally("SELECT * FROM journey_xray WHERE aid = 2 ORDER BY uid DESC", last, df)
+    assert out.uid.isna().tolist() == [True, False]
+
+
+def test_condition_on_aggregate_input_falls_back():
+    last = "SELECT aid, count(*) AS n FROM journey_xray GROUP BY aid"
+    df = pd.DataFrame({"aid": [1, 2], "n": [3, 2]})
+    sql = "SELECT aid, count(*) AS n FROM journey_xray WHERE uid = 6 GROUP BY aid"
+    assert refine_locally(sql, last, df) is None
+
+
+def test_pandas_errors_fall_back_to_the_database(events, monkeypatch):
+    def fail(self, df):
+        raise TypeError("Invalid comparison between dtype=datetime64[ns, UTC] and Timestamp")
+
+    monkeypatch.setattr(refine.Refinement, "apply", fail)
+    last = "SELECT * FROM journey_xray"
+    assert refine_locally("SELECT * FROM journey_xray WHERE aid = 1", last, events) is None
+
+
+def test_truncated_results_are_never_refined(events):
+    df = events.copy()
+    df.attrs["truncated"] = True
+    assert refine_locally("SELECT * FROM journey_xray WHERE aid = 1", "SELECT * FROM journey_xray", df) is None
@@ -0,0 +1,172 @@
+# tests/test_replica.py
+import time
+
+import pandas as pd
+import pytest
+
+import plan_guard
+import replica
+import result_cache
+from plan_guard import PlanRejected
+from replica import Replica, ReplicaResult, tables_read
+
+pytest.importorskip("duckdb")
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def events():
+    return pd.DataFrame({
+        "aid": [1, 1, 2, 2],
+        "channel": ["sms", None, "email", "sms"],
+        "cid": [1, 1, 1, 1],
+        "glreqid": ["a", "b", "c", "d"],
+        "nid": [10, 20, 10, None],
+        "ts": pd.to_datetime(["2025-01-01 10:00", "2025-01-02 11:00", "2025-01-02 12:00", "2025-01-03 09:00"]),
+        "uid": [5, 6, 7, 8],
+    })
+
+
+@pytest.fixture
+def local(tmp_path, events, monkeypatch):
+    """A one-generation replica on disk, with Postgres' max(ts) equal to its watermark."""
+    generation = tmp_path / "g1"
+    replica._write_events(str(generation / "journey_xray"), events, "test", 0)
+    pd.DataFrame({"id": [1, 2], "name": ["a", "b"]}).to_parquet(generation / "papi_automation.parquet")
+    watermark = events.ts.max()
+    replica._write_manifest(str(tmp_path), {
+        "generation": "g1", "watermark": watermark.isoformat(),
+        "exported_at": time.time(), "events": len(events), "journeys": 2,
+    })
+
+    class Freshness:
+        latest = watermark.to_pydatetime()
+
+        def check_freshness(self):
+            pass
+
+        def xray_max_ts(self):
+            return self.latest
+
+    freshness = Freshness()
+    monkeypatch.setattr(result_cache, "get_result_cache", lambda: freshness)
+    instance = Replica(str(tmp_path), threads=2, max_lag=600)
+    monkeypatch.setattr(replica, "get_replica", lambda: instance)
+    instance.freshness = freshness
+    return instance
+
+
+class Postgres:
+    """Stand-in for the fallback ChunkedResult; records the SQL it was given."""
+
+    truncated, rows, bytes, chunks, columns = False, 1, 0, [], ["source"]
+    executed = []
+
+    def __init__(self, sql):
+        self.executed.append(sql)
+
+    def __iter__(self):
+        yield pd.DataFrame({"source": ["postgres"] * self.rows})
+
+    def cancel(self, reason):
+        pass
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+    """Fallback plans run through the guard; EXPLAIN comes from `plans` (SQL -> plan node)."""
+    plans = {}
+
+    def explain(sql, params=None):
+        return {"Node Type": "Seq Scan", "Total Cost": 100.0, "Plan Rows": 1, **plans.get(sql, {})}
+
+    monkeypatch.setattr(Postgres, "executed", [])
+    monkeypatch.setattr(Postgres, "rows", 1)
+    monkeypatch.setattr(plan_guard, "explain", explain)
+    monkeypatch.setattr(replica, "ChunkedResult", Postgres)
+    return plans
+
+
+def run(sql):
+    result = ReplicaResult(sql)
+    chunks = list(result)
+    return result, pd.concat(chunks, ignore_index=True)
+
+
+def test_tables_read():
+    assert tables_read("SELECT extract(day FROM ts), count(*) FROM journey_xray x "
+                       "JOIN papi_automation p ON p.id = x.aid GROUP BY 1") == {"journey_xray", "papi_automation"}
+    assert tables_read("WITH t AS (SELECT * FROM journey_xray) SELECT count(*) FROM t") == {"journey_xray"}
+    assert tables_read("SELECT * FROM journey_xray WHERE channel IS DISTINCT FROM 'sms'") == {"journey_xray"}
+    assert tables_read("SELECT * FROM a, public.b WHERE a.x IN (SELECT y FROM c)") == {"a", "public.b", "c"}
+
+
+def test_routing(local):
+    assert local.can_serve("SELECT aid, count(DISTINCT uid) FROM journey_xray GROUP BY aid")
+    assert not local.can_serve("SELECT * FROM journey_xray_rollup")
+    assert not local.can_serve("SELECT nodedatarray FROM papi_automation")
+
+
+def test_stale_replica_falls_back(local):
+    local.freshness.latest += pd.Timedelta(seconds=60)
+    assert local.can_serve("SELECT count(*) FROM journey_xray")
+    # now()-relative queries need the replica to be fully caught up
+    assert not local.can_serve("SELECT count(*) FROM journey_xray WHERE ts > now() - interval '1 day'")
+    local.freshness.latest += pd.Timedelta(seconds=600)
+    assert not local.can_serve("SELECT count(*) FROM journey_xray")
+
+
+def test_aggregation_matches_pandas(local, events):
+    result, df = run(
+        "SELECT aid, count(*) AS n, count(DISTINCT uid) AS users FROM journey_xray GROUP BY aid ORDER BY aid"
+    )
+    assert result.engine == "replica"
+    assert df.values.tolist() == [[1, 2, 2], [2, 2, 2]]
+
+
+def test_integer_division_like_postgres(local):
+    _, df = run("SELECT count(*) / 3 AS q FROM journey_xray")
+    assert df.q.tolist() == [1]
+
+
+def test_nulls_first_on_desc_like_postgres(local):
+    _, df = run("SELECT nid FROM journey_xray ORDER BY nid DESC LIMIT 2")
+    assert df.nid.isna().tolist() == [True, False]
+    _, df = run("SELECT nid FROM journey_xray ORDER BY nid LIMIT 3")
+    assert not df.nid.isna().any()
+
+
+def test_unsupported_sql_falls_back_to_postgres(local, postgres):
+    result, df = run("SELECT to_char(ts, 'YYYY') FROM journey_xray")
+    assert result.engine == "postgres"
+    assert df.source.tolist() == ["postgres"]
+    assert Postgres.executed == ["SELECT to_char(ts, 'YYYY') FROM journey_xray"]
+
+
+def test_fallback_goes_through_the_plan_guard(local, postgres, monkeypatch):
+    monkeypatch.setattr(plan_guard, "MAX_PLAN_ROWS", 5)
+    monkeypatch.setattr(Postgres, "rows", 5)
+    sql = "SELECT to_char(ts, 'YYYY') AS y FROM journey_xray"
+    postgres[sql] = {"Plan Rows": 10_000_000}
+    result = ReplicaResult(sql)
+    list(result)
+    assert Postgres.executed == [f"SELECT * FROM ({sql}) AS guarded LIMIT 5"]
+    # Filling the injected LIMIT counts as truncated
+    assert result.truncated
+
+    postgres[sql] = {"Total Cost": 1e12}
+    Postgres.executed = []
+    with pytest.raises(PlanRejected):
+        list(ReplicaResult(sql))
+    assert Postgres.executed == []
+
+
+def test_row_limit_truncates(local, postgres):
+    result = ReplicaResult("SELECT * FROM journey_xray", max_rows=3)
+    list(result)
+    assert result.rows == 3 and result.truncated
+
+
+def test_no_replica_without_directory():
+    assert Replica("").status() is None
+    assert not Replica("").can_serve("SELECT count(*) FROM journey_xray")
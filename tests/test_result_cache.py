@@ -0,0 +1,24 @@
+# tests/test_result_cache.py
+from result_cache import normalize_sql
+
+
+def test_formatting_and_case_are_ignored():
+    assert normalize_sql("select  AID\n from Journey_Xray where aid=129;") == \
+        normalize_sql("SELECT aid FROM journey_xray WHERE aid = 129")
+
+
+def test_integer_and_numeric_literals_get_different_keys():
+    assert normalize_sql("SELECT 3.0/2") != normalize_sql("SELECT 3/2")
+    assert normalize_sql("SELECT count(*) * 100.0 / 7 FROM journey_xray") != \
+        normalize_sql("SELECT count(*) * 100 / 7 FROM journey_xray")
+
+
+def test_redundant_number_formatting_is_dropped():
+    assert normalize_sql("SELECT 007, 01.50, 1E+3") == normalize_sql("SELECT 7, 1.50, 1e3")
+    assert normalize_sql("SELECT 1.5") != normalize_sql("SELECT 1.50")
+
+
+def test_string_literals_and_quoted_identifiers_are_kept_verbatim():
+    assert normalize_sql("SELECT 'SMS'") != normalize_sql("SELECT 'sms'")
+    assert normalize_sql('SELECT "Aid" FROM t') != normalize_sql('SELECT "aid" FROM t')
+    assert normalize_sql("SELECT '3.0'") == "select '3.0'"
@@ -0,0 +1,129 @@
+# tests/test_rollups.py
+import re
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import rollups
+from rollups import _HASH_BITS, HyperLogLog
+
+
+def registers(hashes, p):
+    """Python version of the register/rho computation in _DELTA_SQL."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    regs = (hashes & np.uint64((1 << p) - 1)).astype(np.int64)
+    rest = hashes >> np.uint64(p)
+    width = _HASH_BITS - p
+    bit_length = np.array([int(v).bit_length() for v in rest])
+    return regs, width + 1 - bit_length
+
+
+def sketch_of(hashes, p=11):
+    sketch = HyperLogLog(p)
+    sketch.update(*registers(hashes, p))
+    return sketch
+
+
+@pytest.mark.parametrize("n", [100, 5_000, 200_000])
+def test_estimate_is_within_a_few_standard_errors(n):
+    hashes = np.random.default_rng(n).choice(1 << 32, size=n, replace=False)
+    sketch = sketch_of(hashes)
+    assert abs(sketch.estimate() - n) / n < 4 * 1.04 / np.sqrt(sketch.m)
+
+
+def test_merge_estimates_the_union_not_the_sum():
+    rng = np.random.default_rng(1)
+    users = rng.choice(1 << 32, size=20_000, replace=False)
+    # Two days sharing half of their users
+    day1, day2 = sketch_of(users[:15_000]), sketch_of(users[5_000:])
+    assert day1.estimate() + day2.estimate() > 28_000
+    assert abs(day1.merge(day2).estimate() - 20_000) / 20_000 < 0.1
+
+
+def test_duplicates_do_not_count():
+    hashes = np.random.default_rng(2).choice(1 << 32, size=1_000, replace=False)
+    assert sketch_of(np.concatenate([hashes] * 5)).estimate() == sketch_of(hashes).estimate()
+
+
+@pytest.mark.parametrize("n", [10, 50_000])
+def test_bytes_round_trip_sparse_and_dense(n):
+    sketch = sketch_of(np.random.default_rng(3).choice(1 << 32, size=n, replace=False))
+    data = sketch.to_bytes()
+    assert data[:1] == (b"S" if n == 10 else b"D")
+    restored = HyperLogLog.from_bytes(data, sketch.p)
+    assert np.array_equal(restored.registers, sketch.registers)
+
+
+class DuckConnection:
+    """Enough of a psycopg connection to run refresh() against DuckDB."""
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def _translate(sql):
+        sql = re.sub(r"%\((\w+)\)s", r"$\1", sql).replace("%s", "?")
+        return sql.replace(" FOR UPDATE", "")
+
+    def execute(self, sql, params=None):
+        return self.db.execute(self._translate(sql), params)
+
+    @contextmanager
+    def transaction(self):
+        yield
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def executemany(self, sql, rows):
+        self.db.executemany(self._translate(sql), rows)
+
+
+@pytest.fixture
+def duck(monkeypatch):
+    duckdb = pytest.importorskip("duckdb")
+    db = duckdb.connect()
+    # Stand-in for Postgres' 32-bit hashtext()
+    db.execute("CREATE MACRO hashtext(x) AS (hash(x) % 4294967296)::bigint")
+    db.execute(
+        "CREATE TABLE journey_xray (aid bigint, nid bigint, channel text, ts timestamp, uid bigint)"
+    )
+    db.execute(
+        rollups.SCHEMA_SQL.replace("bytea", "blob").replace("timestamp with time zone", "timestamp")
+        .replace("CREATE INDEX IF NOT EXISTS journey_xray_rollup_bucket ON journey_xray_rollup (bucket);", "")
+    )
+    db.execute(
+        "INSERT INTO journey_xray_rollup_state (id, bucket, precision) VALUES (1, 'day', 11)"
+    )
+
+    @contextmanager
+    def connection():
+        yield DuckConnection(db)
+
+    monkeypatch.setattr(rollups, "connection", connection)
+    return db
+
+
+def test_refresh_skips_rows_missing_uid_aid_or_nid(duck):
+    events = pd.DataFrame({
+        "aid": [1, 1, 1, None, 1],
+        "nid": [10, 10, 10, 10, None],
+        "channel": ["sms", "sms", "sms", "sms", "sms"],
+        "ts": pd.to_datetime(["2025-01-01 10:00"] * 4 + ["2025-01-01 11:00"]),
+        "uid": [5, 6, None, 7, 8],
+    })
+    duck.register("events", events)
+    duck.execute("INSERT INTO journey_xray SELECT aid, nid, channel, ts, uid FROM events")
+
+    assert rollups.refresh() == 2
+    assert duck.execute(
+        "SELECT aid, nid, channel, events, users FROM journey_xray_rollup"
+    ).fetchall() == [(1, 10, "sms", 2, 2)]
+    # The watermark moved past the NULL rows, so the next refresh has nothing to do
+    assert duck.execute(
+        "SELECT watermark FROM journey_xray_rollup_state"
+    ).fetchone()[0] == pd.Timestamp("2025-01-01 11:00")
+    assert rollups.refresh() == 0
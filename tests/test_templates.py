@@ -0,0 +1,59 @@
+# tests/test_templates.py
+from templates import TemplateRegistry, parameterize, render_sql
+
+USERS = "SELECT DISTINCT uid FROM journey_xray WHERE aid = {aid}"
+
+
+def test_parameterize_binds_id_literals_only():
+    template, params = parameterize(
+        "SELECT uid FROM journey_xray WHERE aid = 129 AND ts > now() - interval '7 days' LIMIT 10"
+    )
+    assert params == (129,)
+    assert "aid = %s" in template and "LIMIT 10" in template and "'7 days'" in template
+    assert render_sql(template, params) == \
+        "SELECT uid FROM journey_xray WHERE aid = 129 AND ts > now() - interval '7 days' LIMIT 10"
+
+
+def test_learned_question_replays_with_new_ids():
+    registry = TemplateRegistry()
+    registry.observe("list all users for aid=129", USERS.format(aid=129))
+    template, params = registry.match_question("list all users for aid=210")
+    assert params == (210,)
+    assert render_sql(template, params) == USERS.format(aid=210)
+
+
+def test_numbers_that_are_not_bound_ids_are_not_learned():
+    registry = TemplateRegistry()
+    registry.observe("top 10 users for aid=129", USERS.format(aid=129) + " LIMIT 10")
+    registry.observe("events in the last 7 days for aid=129",
+                     "SELECT count(*) FROM journey_xray WHERE aid = 129 AND ts > now() - interval '7 days'")
+    assert registry.match_question("top 20 users for aid=5") is None
+    assert registry.match_question("events in the last 30 days for aid=5") is None
+
+
+def test_repeated_number_fills_several_params():
+    registry = TemplateRegistry()
+    sql = "SELECT name FROM papi_automation p JOIN journey_xray x ON x.aid = p.id WHERE p.id = 7 AND x.aid = 7"
+    registry.observe("journey name for aid 7", sql)
+    template, params = registry.match_question("journey name for aid 8")
+    assert params == (8, 8)
+
+
+def test_turns_that_depend_on_history_are_not_learned():
+    registry = TemplateRegistry()
+    template, params, known = registry.observe("for aid=210.", USERS.format(aid=210), learn=False)
+    assert params == (210,)
+    assert registry.match_question("for aid=5.") is None
+
+
+def test_contextual_questions_are_never_matched():
+    registry = TemplateRegistry()
+    registry.observe("list all users for aid=129", USERS.format(aid=129))
+    assert registry.match_question("only users for aid=129 sorted") is None
+
+
+def test_second_sighting_runs_prepared():
+    registry = TemplateRegistry()
+    assert registry.observe("q", USERS.format(aid=1))[2] is False
+    assert registry.observe("q", USERS.format(aid=2))[2] is True
+    assert registry.stats()["prepared"] == 1
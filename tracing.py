@@ -0,0 +1,163 @@
+# tracing.py
+"""
+Lightweight tracing: nested spans with attributes, exported as one JSON
+line per span in the OpenTelemetry (OTLP/JSON) span layout, plus in-process
+per-stage latency history for the sidebar timing panel.
+
+    with span("turn", question=q) as turn:
+        with span("generate_sql"):
+            ...
+        set_attributes(rows=1200)
+
+The current span is tracked in a contextvar, so nesting works across
+asyncio tasks. Threads start with no current span; pass parent= explicitly.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# Set TRACE_PATH= (empty) to disable the file export
+TRACE_PATH = os.getenv("TRACE_PATH", ".traces.jsonl")
+# Durations kept per stage for p50/p95
+HISTORY = int(os.getenv("TRACE_HISTORY", 500))
+# Whole traces kept for the per-turn breakdown
+MAX_TRACES = 100
+
+_current = contextvars.ContextVar("current_span", default=None)
+_lock = threading.Lock()
+_durations = defaultdict(lambda: deque(maxlen=HISTORY))
+_traces = OrderedDict()
+
+
+class Span:
+    def __init__(self, name, parent=None, attributes=None, start_ns=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    @property
+    def duration_ms(self):
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_otel(self):
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [
+                {"key": key, "value": _otel_value(value)}
+                for key, value in self.attributes.items()
+                if value is not None
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+
+
+def _otel_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, (int, np.integer)):
+        return {"intValue": str(int(value))}
+    if isinstance(value, (float, np.floating)):
+        return {"doubleValue": float(value)}
+    return {"stringValue": str(value)}
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    current = Span(name, parent or _current.get(), attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        _finish(current)
+
+
+def current_span():
+    return _current.get()
+
+
+def set_attributes(**attributes):
+    """Attach attributes to the current span, if any."""
+    current = _current.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def record(name, duration_ms, **attributes):
+    """Add an already-measured stage as a child of the current span, ending now."""
+    end_ns = time.time_ns()
+    finished = Span(name, _current.get(), attributes, start_ns=end_ns - int(duration_ms * 1e6))
+    _finish(finished, end_ns)
+    return finished
+
+
+def _finish(finished, end_ns=None):
+    finished.end_ns = end_ns or time.time_ns()
+    with _lock:
+        _durations[finished.name].append(finished.duration_ms)
+        _traces.setdefault(finished.trace_id, []).append(finished)
+        _traces.move_to_end(finished.trace_id)
+        while len(_traces) > MAX_TRACES:
+            _traces.popitem(last=False)
+    _export(finished)
+
+
+def _export(finished):
+    if not TRACE_PATH:
+        return
+    try:
+        line = json.dumps(finished.to_otel()) + "\n"
+        with _lock, open(TRACE_PATH, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError:
+        pass  # tracing must never break a turn
+
+
+def get_trace(trace_id):
+    """Finished spans of one trace, in start order."""
+    with _lock:
+        spans = list(_traces.get(trace_id, ()))
+    return sorted(spans, key=lambda s: s.start_ns)
+
+
+def durations(name):
+    with _lock:
+        return list(_durations.get(name, ()))
+
+
+def stage_stats():
+    """{stage: {"count", "p50_ms", "p95_ms"}} over the recent history."""
+    with _lock:
+        snapshot = {name: list(values) for name, values in _durations.items() if values}
+    return {
+        name: {
+            "count": len(values),
+            "p50_ms": round(float(np.percentile(values, 50)), 1),
+            "p95_ms": round(float(np.percentile(values, 95)), 1),
+        }
+        for name, values in snapshot.items()
+    }